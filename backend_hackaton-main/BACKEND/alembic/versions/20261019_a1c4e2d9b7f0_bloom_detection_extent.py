@@ -0,0 +1,100 @@
+"""Indexed extent columns on bloom_detections
+
+Adds geohash and min/max lon/lat, the pattern-ops geohash index used by the
+prefix lookups in get_bloom_history, and backfills them from bounding_box.
+Tables that do not exist yet are left to Base.metadata.create_all.
+
+Revision ID: a1c4e2d9b7f0
+Revises:
+Create Date: 2026-10-19 09:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.geometry import geohash_of_bbox
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e2d9b7f0'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+TABLE = "bloom_detections"
+INDEX = "ix_bloom_detections_geohash"
+EXTENT_COLUMNS = [
+    ("geohash", sa.String(12)),
+    ("min_lon", sa.Float()),
+    ("min_lat", sa.Float()),
+    ("max_lon", sa.Float()),
+    ("max_lat", sa.Float()),
+]
+BACKFILL_BATCH = 1000
+
+detections = sa.table(
+    TABLE,
+    sa.column("id", sa.Integer),
+    sa.column("bounding_box", sa.JSON),
+    *[sa.column(name, type_) for name, type_ in EXTENT_COLUMNS],
+)
+
+
+def _geographic_box(value):
+    """[min_lon, min_lat, max_lon, max_lat] if the stored bounding_box is one, else None"""
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    # {x, y, width, height} pixel boxes and their unions are not degrees
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        return None
+    return [min_lon, min_lat, max_lon, max_lat]
+
+
+def _backfill(bind):
+    rows = bind.execute(
+        sa.select(detections.c.id, detections.c.bounding_box).where(detections.c.min_lon.is_(None))
+    ).all()
+    updates = []
+    for row in rows:
+        box = _geographic_box(row.bounding_box)
+        if box is not None:
+            updates.append({"row_id": row.id, "geohash": geohash_of_bbox(box), "min_lon": box[0],
+                            "min_lat": box[1], "max_lon": box[2], "max_lat": box[3]})
+    statement = detections.update().where(detections.c.id == sa.bindparam("row_id")).values(
+        **{name: sa.bindparam(name) for name, _ in EXTENT_COLUMNS}
+    )
+    for start in range(0, len(updates), BACKFILL_BATCH):
+        bind.execute(statement, updates[start:start + BACKFILL_BATCH])
+
+
+def upgrade():
+    offline = op.get_context().as_sql
+    if offline:
+        # --sql: no database to inspect, emit the full change (the backfill needs a connection)
+        existing, indexes = set(), set()
+    else:
+        inspector = sa.inspect(op.get_bind())
+        if TABLE not in inspector.get_table_names():
+            return
+        existing = {column["name"] for column in inspector.get_columns(TABLE)}
+        indexes = {index["name"] for index in inspector.get_indexes(TABLE)}
+    with op.batch_alter_table(TABLE) as batch:
+        for name, type_ in EXTENT_COLUMNS:
+            if name not in existing:
+                batch.add_column(sa.Column(name, type_, nullable=True))
+    # create_all may have built a plain index under the same name: rebuild it with pattern ops
+    if INDEX in indexes:
+        op.drop_index(INDEX, table_name=TABLE)
+    op.create_index(INDEX, TABLE, ["geohash"], postgresql_ops={"geohash": "varchar_pattern_ops"})
+    if not offline:
+        _backfill(op.get_bind())
+
+
+def downgrade():
+    op.drop_index(INDEX, table_name=TABLE)
+    with op.batch_alter_table(TABLE) as batch:
+        for name, _ in reversed(EXTENT_COLUMNS):
+            batch.drop_column(name)
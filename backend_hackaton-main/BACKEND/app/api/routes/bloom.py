@@ -2,16 +2,35 @@
 Bloom detection API endpoints
 """
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Depends
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Depends, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Tuple
 from datetime import datetime, timedelta
 from pydantic import BaseModel, Field
+import asyncio
+import json
 import logging
 from app.services.bloom_detector import bloom_detector
 from app.services.gee_service import gee_service
 from app.database.database import get_db
 from sqlalchemy.orm import Session
-from app.services.iamodel_service import predict_flowering_days,entrenar_modelo_floracion
+from app.services.iamodel_service import (
+    predict_flowering_distribution, predict_flowering_batch, entrenar_modelo_floracion, cached_prediction,
+    model_file_version, completar_calendario, construir_trayectoria, curva_trayectoria, precargar_modelo,
+    modelo_base_disponible, version_servida
+)
+from app.services.global_model_service import global_flowering_model
+from app.services.model_registry import model_registry
+from app.services.feature_store import feature_store
+from app.services.feature_engineering import compact_history, history_to_arrow, history_to_columns
+from app.services.packed_model_store import packed_model_store
+from app.services.parcel_similarity import parcel_similarity_index, predict_blended, blended_distribution
+from app.services.llm_service import llm_service, bucket_inputs, fill_placeholders
+from app.services.pipeline import Pipeline
+from app.services.explanation_service import explanation_engine, indicators_from_drivers
+from app.services.parcel_registry import parcel_registry
+from app.services.geometry import prepare_polygon
+from app.core.config import settings
 import os
 
 logger = logging.getLogger(__name__)
@@ -54,6 +73,16 @@ class PolygonRequest(BaseModel):
     """Modelo para recibir las coordenadas de la parcela como polígono"""
     coordinates: List[List[float]] = Field(..., description="Lista de puntos [lon, lat] que forman el polígono")
 
+class ParcelRequest(PolygonRequest):
+    """Alta de una parcela en el registro"""
+    id: Optional[int] = Field(default=None, description="Id de la parcela (el del feature store / modelos); autoincremental si se omite")
+    name: Optional[str] = Field(default=None, description="Nombre descriptivo de la parcela")
+
+class ParcelUpdateRequest(BaseModel):
+    """Cambio de geometría o nombre de una parcela registrada"""
+    coordinates: Optional[List[List[float]]] = Field(default=None, description="Nuevo polígono [lon, lat]")
+    name: Optional[str] = None
+
 @router.post("/detect", response_model=BloomDetectionResponse)
 async def detect_blooms(
     request: BloomDetectionRequest,
@@ -300,68 +329,214 @@ async def health_check():
             "timestamp": datetime.utcnow().isoformat()
         }
 
+def _registrar_parcela(request: ParcelRequest) -> dict:
+    """Valida y registra la parcela (geometría y base de datos: bloquea, se llama con asyncio.to_thread)."""
+    prepared = _validar_poligono(request.coordinates)
+    if request.id is not None and parcel_registry.get(request.id) is not None:
+        raise HTTPException(status_code=409, detail=f"La parcela {request.id} ya está registrada")
+    return parcel_registry.create(request.coordinates, parcel_id=request.id, name=request.name, prepared=prepared)
+
+def _actualizar_parcela(parcel_id: int, request: ParcelUpdateRequest) -> Optional[dict]:
+    """Valida el polígono nuevo y actualiza la parcela (bloquea, se llama con asyncio.to_thread)."""
+    prepared = _validar_poligono(request.coordinates) if request.coordinates is not None else None
+    return parcel_registry.update(parcel_id, coordinates=request.coordinates, name=request.name, prepared=prepared)
+
+@router.post("/parcels", status_code=201)
+async def create_parcel(request: ParcelRequest):
+    """
+    Registra una parcela: guarda su polígono y precalcula área, bbox, centroide y celdas MODIS.
+    Después el resto de endpoints la referencian solo por id.
+    """
+    try:
+        return await asyncio.to_thread(_registrar_parcela, request)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error registering parcel: {e}")
+        raise HTTPException(status_code=503, detail="Parcel registry not available")
+
+@router.get("/parcels")
+async def list_parcels(limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """Parcelas registradas, por id."""
+    try:
+        return {"parcels": await asyncio.to_thread(parcel_registry.list, limit=limit, offset=offset)}
+    except Exception as e:
+        logger.error(f"Error listing parcels: {e}")
+        raise HTTPException(status_code=503, detail="Parcel registry not available")
+
+@router.get("/parcels/search")
+async def search_parcels(
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+):
+    """Parcelas registradas que intersecan un bbox o contienen un punto (índice espacial en memoria)."""
+    if bbox is not None:
+        try:
+            caja = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            caja = []
+        if len(caja) != 4 or caja[0] > caja[2] or caja[1] > caja[3]:
+            raise HTTPException(status_code=400, detail="bbox debe ser min_lon,min_lat,max_lon,max_lat")
+        return {"bbox": caja, "parcels": await asyncio.to_thread(parcel_registry.search, bbox=caja)}
+    if lon is None or lat is None:
+        raise HTTPException(status_code=400, detail="Indique bbox o lon y lat")
+    return {"point": [lon, lat], "parcels": await asyncio.to_thread(parcel_registry.search, point=[lon, lat])}
+
+@router.get("/parcels/{parcel_id}")
+async def get_parcel(parcel_id: int):
+    """Geometría y metadatos precalculados de una parcela."""
+    parcela = await asyncio.to_thread(parcel_registry.get, parcel_id)
+    if parcela is None:
+        raise HTTPException(status_code=404, detail=f"Parcela {parcel_id} no registrada")
+    return parcela
+
+@router.put("/parcels/{parcel_id}")
+async def update_parcel(parcel_id: int, request: ParcelUpdateRequest):
+    """Cambia el polígono (recalculando sus metadatos) o el nombre de una parcela registrada."""
+    try:
+        parcela = await asyncio.to_thread(_actualizar_parcela, parcel_id, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if parcela is None:
+        raise HTTPException(status_code=404, detail=f"Parcela {parcel_id} no registrada")
+    return parcela
+
 @router.post("/train-model")
-async def train_model(request: PolygonRequest):
+async def train_model(request: Optional[PolygonRequest] = None, id: Optional[int] = None, fine_tune: bool = False):
     """
-    Recibe las coordenadas de un polígono que representa la parcela.
-    Por ahora solo valida y retorna las coordenadas recibidas.
+    Entrena el modelo de floración de una parcela.
+    Con el id de una parcela registrada no hace falta enviar el polígono; si se envía
+    el polígono de una parcela nueva, se registra con ese id. Su historial se guarda en
+    el feature store y el modelo se entrena leyendo solo las filas de esa parcela.
+    Con fine_tune=true el modelo parte del modelo base compartido y solo
+    se ajustan unas pocas épocas con el historial de la parcela.
+    El entrenamiento bloquea durante minutos: se ejecuta fuera del event loop.
     """
-    if not request.coordinates or len(request.coordinates) < 3:
-        raise HTTPException(status_code=400, detail="Se requieren al menos 3 puntos para formar un polígono")
-    for point in request.coordinates:
-        if len(point) != 2:
-            raise HTTPException(status_code=400, detail="Cada punto debe tener formato [lon, lat]")
+    if fine_tune and not modelo_base_disponible():
+        raise HTTPException(status_code=409, detail="No hay modelo base para fine_tune: entrénelo antes o use fine_tune=false")
+    parcela = await asyncio.to_thread(_resolver_parcela, id, request)
+    # Sin id, un polígono que coincide con una parcela registrada usa su id (y su historial)
+    parcel_id = id if id is not None else parcela.get("id")
     gee_service_available = gee_service.is_available()
     if not gee_service_available:
         raise HTTPException(status_code=503, detail="Google Earth Engine service not available")
-    data_history: dict = gee_service.get_history_parcel(request.coordinates)
-    response = entrenar_modelo_floracion(demo_mode=False, path_features_nuevos=data_history)
+    data_history: dict = await gee_service.get_history_parcel(parcela["coordinates"], parcel_id=parcel_id,
+                                                              geometry_hash=parcela["geometry_hash"])
+    if "error" in data_history:
+        raise HTTPException(status_code=500, detail=data_history["error"])
+    if parcel_id is not None:
+        response = await asyncio.to_thread(entrenar_modelo_floracion, demo_mode=False, use_feature_store=True,
+                                           parcel_ids=[parcel_id], fine_tune=fine_tune, parcel_id=parcel_id)
+        if response.get("manifest"):
+            await asyncio.to_thread(_registrar_version_modelo, parcel_id, response["manifest"]["version"])
+    else:
+        response = await asyncio.to_thread(entrenar_modelo_floracion, demo_mode=False,
+                                           features_nuevos=data_history["history"], fine_tune=fine_tune)
     return {
         "message": "Coordenadas recibidas correctamente",
-        "polygon": request.coordinates,
+        "parcel_id": parcel_id,
+        "polygon": parcela["coordinates"],
         "model_status": response
     }
-def find_file_by_id(folder_path, file_id):
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if str(file_id) in file:
-                return os.path.join(root, file)
-    return None
+@router.post("/parcel-history")
+async def get_parcel_history(
+    request: Optional[PolygonRequest] = None,
+    id: Optional[int] = None,
+    format: str = Query("columns", pattern="^(columns|arrow)$", description="columns: JSON por columnas, arrow: Arrow IPC")
+):
+    """
+    Historial de features de la parcela en formato columnar.
+    Si la parcela ya tiene datos en el feature store se sirven desde ahí sin consultar Earth Engine.
+    """
+    # Lectura de Parquet: fuera del event loop
+    history = await asyncio.to_thread(_historial_guardado, id) if id is not None else None
+    if history is None:
+        parcela = await asyncio.to_thread(_resolver_parcela, id, request)
+        if not gee_service.is_available():
+            raise HTTPException(status_code=503, detail="Google Earth Engine service not available")
+        data_history = await gee_service.get_history_parcel(parcela["coordinates"], parcel_id=id,
+                                                            geometry_hash=parcela["geometry_hash"])
+        if "error" in data_history:
+            raise HTTPException(status_code=500, detail=data_history["error"])
+        history = data_history["history"]
+
+    if format == "arrow":
+        return Response(content=history_to_arrow(history), media_type="application/vnd.apache.arrow.stream")
+    return {"parcel_id": id, "rows": len(history), **history_to_columns(history)}
 
-async def generate_ai_analysis(days_until_bloom: int, confidence: str, current_data: dict) -> dict:
+def _historial_guardado(id: int):
+    """Historial compacto de la parcela en el feature store (None si no tiene filas). Bloquea."""
+    stored = feature_store.read(parcel_ids=[id])
+    if stored.empty:
+        return None
+    return compact_history(stored.sort_values('date'))
+
+def _indicadores_actuales(current_data: dict) -> Tuple[float, float, float, float]:
+    """NDVI, temperatura (°C), precipitación 7d (mm) y área (ha) de los datos actuales de la parcela."""
+    indices = current_data.get('indices', {})
+    ndvi = indices.get('NDVI', current_data.get('NDVI')) or 0.0
+    temperature = indices.get('temperature')
+    if temperature is None and current_data.get('LST_mean') is not None:
+        # LST de MODIS en Kelvin
+        temperature = current_data['LST_mean'] - 273.15
+    precipitation = indices.get('precipitation_7d', current_data.get('precip_7d')) or 0.0
+    area = current_data.get('area_hectares', 0.0) or 0.0
+    return float(ndvi), float(temperature or 0.0), float(precipitation), float(area)
+
+async def generate_ai_analysis(days_until_bloom: int, confidence: str, current_data: dict,
+                               explanation: Optional[dict] = None) -> dict:
     """
-    Genera análisis explicativo usando IA basado en días hasta floración y nivel de confianza
+    Genera análisis explicativo usando IA basado en días hasta floración y nivel de confianza.
+    `explanation` (atribuciones locales del modelo) se usa en el análisis contextual de respaldo.
     """
-    import httpx
-    import os
+    analysis = await request_llm_analysis(days_until_bloom, confidence, current_data)
+    if analysis is not None:
+        return analysis
     
-    # Obtener datos actuales
-    ndvi = current_data.get('indices', {}).get('NDVI', 0.0)
-    temperature = current_data.get('indices', {}).get('temperature', 0.0)
-    precipitation = current_data.get('indices', {}).get('precipitation_7d', 0.0)
-    area = current_data.get('area_hectares', 0.0)
+    # Fallback: análisis basado en reglas contextuales
+    return generate_contextual_analysis(days_until_bloom, confidence, current_data, explanation)
+
+async def request_llm_analysis(days_until_bloom: int, confidence: str, current_data: dict) -> Optional[dict]:
+    """
+    Pide el análisis al LLM; devuelve None si no está disponible o no responde con JSON válido.
+    Las entradas se agrupan en intervalos (ver bucket_inputs): predicciones parecidas reutilizan
+    la misma explicación cacheada en lugar de pedir una nueva al LLM. El LLM escribe marcadores
+    en lugar de cifras y se rellenan con los valores exactos de esta predicción, así el texto
+    cita los mismos números que la respuesta. No depende de la explicación del modelo, así que
+    puede lanzarse en cuanto hay predicción.
+    """
+    ndvi, temperature, precipitation, area = _indicadores_actuales(current_data)
+    b = bucket_inputs(days_until_bloom, confidence, ndvi, temperature, precipitation, area)
     
-    # Crear prompt contextual
+    # Crear prompt contextual (con los valores agrupados, válido para todo el intervalo)
     prompt = f"""Eres un experto agrónomo especializado en predicción de floración de cultivos.
 
-DATOS DE LA PREDICCIÓN:
-- Días hasta floración: {days_until_bloom} días
-- Nivel de confianza: {confidence}
-- NDVI actual: {ndvi:.3f}
-- Temperatura: {temperature:.1f}°C
-- Precipitación (7 días): {precipitation:.1f}mm
-- Área de la parcela: {area:.2f} hectáreas
+DATOS DE LA PREDICCIÓN (valores aproximados):
+- Días hasta floración: unos {b['days_until_bloom']} días
+- Nivel de confianza: {b['confidence']}
+- NDVI actual: {b['ndvi']:.3f}
+- Temperatura: {b['temperature']:.1f}°C
+- Precipitación (7 días): {b['precipitation']:.1f}mm
+- Área de la parcela: {b['area']:.2f} hectáreas
+
+IMPORTANTE: no escribas ninguna de estas cifras. Cuando te refieras a ellas usa exactamente estos
+marcadores, que se sustituirán por los valores exactos: {{dias}} (días hasta floración),
+{{confianza}} (nivel de confianza, incluye el %), {{ndvi}}, {{temperatura}} (°C),
+{{precipitacion}} (mm en 7 días) y {{area}} (hectáreas).
 
 Tu tarea es generar un análisis profesional y explicativo en español para agricultores. Responde ÚNICAMENTE en formato JSON con esta estructura exacta:
 
 {{
   "key_indicators": [
-    "Indicador 1 explicando por qué la floración será en {days_until_bloom} días",
-    "Indicador 2 sobre el nivel de confianza de {confidence}",
+    "Indicador 1 explicando por qué la floración será en {{dias}} días",
+    "Indicador 2 sobre el nivel de confianza de {{confianza}}",
     "Indicador 3 sobre las condiciones ambientales actuales"
   ],
   "recommendations": [
-    "Recomendación específica 1 considerando que faltan {days_until_bloom} días",
+    "Recomendación específica 1 considerando que faltan {{dias}} días",
     "Recomendación específica 2 basada en el nivel de confianza",
     "Recomendación específica 3 sobre preparación para la floración"
   ],
@@ -371,53 +546,28 @@ Tu tarea es generar un análisis profesional y explicativo en español para agri
   ]
 }}
 
-Enfócate en explicar por qué la predicción indica {days_until_bloom} días y qué significa el nivel de confianza de {confidence}. Sé específico, práctico y usa los datos satelitales para fundamentar tu análisis."""
+Enfócate en explicar por qué la predicción indica {{dias}} días y qué significa el nivel de confianza de {{confianza}}. Sé específico, práctico y usa los datos satelitales para fundamentar tu análisis."""
 
-    try:
-        # Intentar usar OpenRouter AI
-        api_key = os.getenv('OPENROUTER_API_KEY')
-        
-        if api_key:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "meta-llama/llama-3.1-8b-instruct:free",
-                        "messages": [
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.7,
-                        "max_tokens": 800
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result['choices'][0]['message']['content']
-                    
-                    # Extraer JSON de la respuesta
-                    import json
-                    import re
-                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                    if json_match:
-                        return json.loads(json_match.group())
-    except Exception as e:
-        logger.warning(f"AI analysis failed, using fallback: {e}")
-    
-    # Fallback: análisis basado en reglas contextuales
-    return generate_contextual_analysis(days_until_bloom, confidence, current_data)
+    plantilla = await llm_service.complete_json(tuple(sorted(b.items())), prompt)
+    if plantilla is None:
+        return None
+    return fill_placeholders(plantilla, {
+        "dias": str(days_until_bloom),
+        "confianza": str(confidence),
+        "ndvi": f"{ndvi:.3f}",
+        "temperatura": f"{temperature:.1f}",
+        "precipitacion": f"{precipitation:.1f}",
+        "area": f"{area:.2f}",
+    })
 
-def generate_contextual_analysis(days_until_bloom: int, confidence: str, current_data: dict) -> dict:
+def generate_contextual_analysis(days_until_bloom: int, confidence: str, current_data: dict,
+                                 explanation: Optional[dict] = None) -> dict:
     """
-    Genera análisis contextual cuando IA no está disponible
+    Genera análisis contextual cuando IA no está disponible.
+    Con `explanation` (ver explanation_service) los indicadores de la predicción salen de las
+    atribuciones del modelo en lugar de la plantilla fija.
     """
-    ndvi = current_data.get('indices', {}).get('NDVI', 0.0)
-    temperature = current_data.get('indices', {}).get('temperature', 0.0)
-    precipitation = current_data.get('indices', {}).get('precipitation_7d', 0.0)
+    ndvi, temperature, precipitation, _ = _indicadores_actuales(current_data)
     
     # Indicadores clave enfocados en días y confianza
     key_indicators = [
@@ -425,6 +575,9 @@ def generate_contextual_analysis(days_until_bloom: int, confidence: str, current
         f"El nivel de confianza de {confidence} indica {'alta precisión' if confidence.replace('%','').strip() == '95' else 'buena precisión' if int(confidence.replace('%','').strip()) >= 75 else 'precisión moderada'} en la predicción, calculado mediante el modelo de machine learning entrenado con datos históricos de floración.",
         f"Las condiciones ambientales actuales (temperatura: {temperature:.1f}°C, precipitación: {precipitation:.1f}mm/7días) {'favorecen' if temperature > 15 and precipitation > 10 else 'requieren atención para'} el desarrollo óptimo hacia la floración."
     ]
+    if explanation is not None:
+        # Factores que realmente mueven la predicción, más el indicador de confianza
+        key_indicators = indicators_from_drivers(explanation) + key_indicators[1:2]
     
     # Recomendaciones específicas según días restantes
     recommendations = []
@@ -479,12 +632,12 @@ def generate_contextual_analysis(days_until_bloom: int, confidence: str, current
         "risk_factors": risk_factors
     }
 
-async def generate_flowering_analysis(days_until_bloom: float, current_data: dict) -> dict:
+def resumir_prediccion(days_until_bloom: float, uncertainty: Optional[dict] = None) -> dict:
     """
-    Genera un análisis completo de la predicción de floración con indicadores y recomendaciones
+    Parte numérica de la predicción: fecha, probabilidad, estado e intervalo (sin análisis de IA).
+    Si se pasa la incertidumbre MC-dropout del modelo, la probabilidad sale de su confianza
+    y se incluye el intervalo de predicción.
     """
-    from datetime import datetime, timedelta
-    
     # Calcular fecha de floración
     days_int = int(days_until_bloom)
     prediction_date = datetime.now() + timedelta(days=days_int)
@@ -506,47 +659,396 @@ async def generate_flowering_analysis(days_until_bloom: float, current_data: dic
         probability = "70%"
         status = "Fase Vegetativa - Planificación Adelantada"
         color = "green"
+    if uncertainty is not None:
+        probability = f"{round(uncertainty['confidence'] * 100)}%"
     
-    # Generar análisis con IA o fallback contextual
-    ai_analysis = await generate_ai_analysis(days_int, probability, current_data)
-    
-    return {
+    result = {
         "prediction_date": prediction_date.strftime("%Y-%m-%d"),
         "days_until_bloom": days_int,
         "probability": probability,
         "status": status,
         "color": color,
-        "ai_analysis": ai_analysis
     }
+    if uncertainty is not None:
+        low, high = uncertainty["interval"]
+        result["prediction_interval"] = {
+            "low_days": round(low, 1),
+            "high_days": round(high, 1),
+            "level": uncertainty["interval_level"],
+            "earliest_date": (datetime.now() + timedelta(days=max(0, int(low)))).strftime("%Y-%m-%d"),
+            "latest_date": (datetime.now() + timedelta(days=max(0, int(high)))).strftime("%Y-%m-%d"),
+        }
+        result["uncertainty"] = uncertainty
+    return result
 
-@router.post("/predict-bloom")
-async def predict_bloom_polygon(request: PolygonRequest,id:int):
+async def generate_flowering_analysis(days_until_bloom: float, current_data: dict,
+                                      uncertainty: Optional[dict] = None) -> dict:
+    """
+    Genera un análisis completo de la predicción de floración con indicadores y recomendaciones.
+    """
+    result = resumir_prediccion(days_until_bloom, uncertainty)
+    # Generar análisis con IA o fallback contextual
+    result["ai_analysis"] = await generate_ai_analysis(result["days_until_bloom"], result["probability"], current_data)
+    return result
+
+def _resolver_modelo_propio(id: int) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Parte de la resolución que no depende de los datos actuales: modelo propio ('packed'/'keras')
+    o embedding conocido por el modelo global. Deja el modelo elegido cargado en memoria.
+    Devuelve (None, None) si la parcela necesita vecinos o el fallback global.
+    """
+    entry = None
+    if settings.FLOWERING_MODEL_MODE != "global":
+        entry = model_registry.get(id)
+    if entry is not None:
+        if packed_model_store.version_of(id) == entry["version"]:
+            packed_model_store.get(id)
+            return "packed", entry
+        precargar_modelo(entry)
+        return "keras", entry
+    if global_flowering_model.is_available() and global_flowering_model.knows(id):
+        return "global", None
+    return None, None
+
+def _resolver_modelo_floracion(id: int, current_data: dict,
+                               propio: Optional[Tuple[Optional[str], Optional[dict]]] = None
+                               ) -> Tuple[str, Optional[dict], List[dict]]:
+    """
+    Decide qué modelo atiende a la parcela: 'keras'/'packed' (modelo propio), 'global'
+    o 'similar' (mezcla de las parcelas entrenadas más parecidas, mientras no tenga modelo).
+    En modo FLOWERING_MODEL_MODE='global' solo se usa el modelo global (nunca la mezcla).
+    `propio` es el resultado ya calculado de _resolver_modelo_propio, si lo hay.
+    Devuelve (fuente, entrada del manifest, vecinos); lanza 404 si no hay ninguno disponible.
+    """
+    fuente, entry = propio if propio is not None else _resolver_modelo_propio(id)
+    if fuente is not None:
+        return fuente, entry, []
+    if settings.FLOWERING_MODEL_MODE != "global":
+        vecinos = parcel_similarity_index.neighbors(current_data, parcel_id=id)
+        if vecinos:
+            return "similar", None, vecinos
+    if global_flowering_model.is_available():
+        # Embedding de parcela desconocida
+        return "global", None, []
+    raise HTTPException(status_code=404, detail=f"No hay modelo entrenado para la parcela {id}")
+
+def _predecir_distribucion(id: int, current_data: dict,
+                           propio: Optional[Tuple[Optional[str], Optional[dict]]] = None) -> dict:
+    """Distribución de días hasta floración (MC-dropout o mezcla de vecinos) con el modelo que atiende a la parcela."""
+    fuente, entry, vecinos = _resolver_modelo_floracion(id, current_data, propio)
+    samples = settings.MC_DROPOUT_SAMPLES
+    if fuente == "similar":
+        uncertainty = blended_distribution(current_data, vecinos, samples=samples)
+        uncertainty["similar_parcels"] = vecinos
+    elif fuente == "global":
+        # Modelo global residente: parcelas sin embedding propio usan el fallback
+        uncertainty = cached_prediction(
+            f"global:{id}", model_file_version(global_flowering_model.model_path), current_data,
+            lambda: global_flowering_model.predict_distribution(current_data, parcel_id=id, samples=samples),
+            samples=samples
+        )
+    elif fuente == "packed":
+        # Pesos compartidos entre workers vía mmap (solo si el pack tiene la última versión)
+        uncertainty = cached_prediction(
+            f"packed:{id}", version_servida(packed_model_store.path, entry), current_data,
+            lambda: packed_model_store.get(id).predict_distribution(current_data, samples=samples),
+            samples=samples
+        )
+    else:
+        uncertainty = predict_flowering_distribution(current_data, entry=entry, samples=samples)
+    return {**uncertainty, "model_source": fuente}
+
+def _predictor_lotes(id: int, fuente: str, entry: Optional[dict], vecinos: List[dict]):
+    """Función filas -> días hasta floración (una sola llamada al modelo) para la fuente resuelta."""
+    if fuente == "similar":
+        return lambda rows: predict_blended(rows, vecinos)
+    if fuente == "global":
+        return lambda rows: global_flowering_model.predict_batch(rows, [id] * len(rows))
+    if fuente == "packed":
+        modelo = packed_model_store.get(id)
+        return modelo.predict_days
+    return lambda rows: predict_flowering_batch(rows, entry=entry)
+
+def _predecir_trayectoria(id: int, current_data: dict, days: int, climate: str) -> Tuple[str, List[dict], List[dict]]:
+    """
+    Resuelve el modelo (manifiesto y carga) y predice la trayectoria en un batch.
+    Bloquea: desde las rutas async se llama con asyncio.to_thread.
+    Devuelve (fuente, vecinos, curva).
     """
-    Recibe las coordenadas de un polígono que representa la parcela.
-    Por ahora solo valida y retorna las coordenadas recibidas.
+    fuente, entry, vecinos = _resolver_modelo_floracion(id, current_data)
+    trayectoria = construir_trayectoria(current_data, days, clima=climate)
+    rows = trayectoria.drop(columns=["date"]).to_dict("records")
+    try:
+        dias_pred = _predictor_lotes(id, fuente, entry, vecinos)(rows)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return fuente, vecinos, curva_trayectoria(trayectoria, dias_pred)
+
+def _explicar_prediccion(id: int, current_data: dict,
+                         propio: Optional[Tuple[Optional[str], Optional[dict]]] = None) -> Optional[dict]:
     """
-    if not request.coordinates or len(request.coordinates) < 3:
+    Atribuciones locales de la predicción (ver explanation_service). Es un complemento:
+    si falla (sin historial de referencia, columnas faltantes...) devuelve None.
+    """
+    try:
+        fuente, entry, vecinos = _resolver_modelo_floracion(id, current_data, propio)
+        return explanation_engine.explain(current_data, _predictor_lotes(id, fuente, entry, vecinos), parcel_id=id)
+    except Exception as e:
+        logger.warning(f"No se pudo explicar la predicción de la parcela {id}: {e}")
+        return None
+
+def _validar_poligono(coordinates: List[List[float]]) -> dict:
+    """
+    400 si el polígono no se puede convertir en un anillo válido; si no, devuelve el resultado
+    de geometry.prepare_polygon para reutilizarlo en el resto de la petición.
+    """
+    if not coordinates or len(coordinates) < 3:
         raise HTTPException(status_code=400, detail="Se requieren al menos 3 puntos para formar un polígono")
-    for point in request.coordinates:
+    for point in coordinates:
         if len(point) != 2:
             raise HTTPException(status_code=400, detail="Cada punto debe tener formato [lon, lat]")
-    gee_service_available = gee_service.is_available()
-    if not gee_service_available:
+    try:
+        return prepare_polygon(coordinates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _resolver_parcela(id: Optional[int], request: Optional[PolygonRequest]) -> dict:
+    """
+    Parcela de la petición: la registrada con ese id (geometría y metadatos precalculados) o,
+    si no está registrada, el polígono del cuerpo, que queda registrado con ese id.
+    Sin id se busca una parcela registrada con la misma geometría canónica; si no la hay
+    (o no hay base de datos) se usan los metadatos calculados al vuelo.
+    El polígono del cuerpo se prepara una sola vez. Bloquea (base de datos y geometría):
+    desde las rutas async se llama con asyncio.to_thread.
+    """
+    parcela = parcel_registry.get(id) if id is not None else None
+    if request is None:
+        if parcela is not None:
+            return parcela
+        if id is not None:
+            raise HTTPException(status_code=404, detail=f"Parcela {id} no registrada: envíe su polígono o regístrela en /parcels")
+        raise HTTPException(status_code=400, detail="Se requiere el id de una parcela registrada o su polígono")
+    prepared = _validar_poligono(request.coordinates)
+    if parcela is not None:
+        _comprobar_misma_geometria(parcela, prepared)
+        return parcela
+    if id is None:
+        parcela = parcel_registry.describe(request.coordinates, prepared=prepared)
+        # Mismo polígono (canónico) que una parcela registrada: se reutilizan sus datos
+        return parcel_registry.find_by_geometry(parcela["geometry_hash"]) or parcela
+    try:
+        return parcel_registry.create(request.coordinates, parcel_id=id, prepared=prepared)
+    except Exception as e:
+        # Alta concurrente del mismo id o base de datos no disponible
+        logger.warning(f"No se pudo registrar la parcela {id}: {e}")
+        parcela = parcel_registry.get(id)
+        if parcela is not None:
+            _comprobar_misma_geometria(parcela, prepared)
+            return parcela
+        return parcel_registry.describe(request.coordinates, parcel_id=id, prepared=prepared)
+
+def _comprobar_misma_geometria(parcela: dict, prepared: dict):
+    """409 si el polígono enviado no es (en forma canónica) el de la parcela registrada con ese id."""
+    if prepared["hash"] != parcela["geometry_hash"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"La parcela {parcela['id']} ya está registrada con otro polígono: actualícelo con PUT /parcels/{parcela['id']}"
+        )
+
+def _registrar_version_modelo(id: int, version: int):
+    try:
+        parcel_registry.update(id, model_version=version)
+    except Exception as e:
+        logger.warning(f"No se pudo guardar la versión del modelo de la parcela {id}: {e}")
+
+def _datos_actuales(parcela: dict) -> dict:
+    """
+    Extracción de GEE para hilos de trabajo: los métodos del servicio son async pero bloquean
+    en getInfo(), así que se ejecutan en su propio event loop fuera del loop de la API.
+    """
+    current_data = asyncio.run(gee_service.get_current_parcel_data(parcela["coordinates"],
+                                                                   geometry_hash=parcela["geometry_hash"]))
+    if "error" in current_data:
+        raise HTTPException(status_code=500, detail=current_data["error"])
+    current_data["area_hectares"] = parcela["area_hectares"]
+    return completar_calendario(current_data)
+
+@router.post("/predict-bloom")
+async def predict_bloom_polygon(
+    id: int,
+    request: Optional[PolygonRequest] = None,
+    deadline: Optional[float] = Query(None, gt=0, le=120, description="Presupuesto total en segundos (por defecto PREDICT_BLOOM_DEADLINE_SECONDS)")
+):
+    """
+    Predicción de floración de una parcela registrada (el polígono solo hace falta la primera vez).
+
+    Las etapas forman un pequeño grafo con un único plazo de extremo a extremo:
+    datos actuales (GEE) y carga del modelo arrancan a la vez; la predicción espera a
+    ambas y el análisis de IA a la predicción. Lo que no termina dentro del plazo se
+    cancela: la respuesta sale igualmente con `partial: true` y el estado de cada etapa
+    en `pipeline`. Si la IA no llega a tiempo se usa el análisis contextual por reglas.
+    """
+    parcela = await asyncio.to_thread(_resolver_parcela, id, request)
+    if not gee_service.is_available():
         raise HTTPException(status_code=503, detail="Google Earth Engine service not available")
-    current_data = gee_service.get_current_parcel_data(request.coordinates)
-    folder_path = "app/datamodels/features"  
-    file_path = find_file_by_id(folder_path, id)
 
-    days_until_bloom = predict_flowering_days(current_data,file_path)
-    
-    # Generar análisis completo con IA
-    flowering_prediction = await generate_flowering_analysis(days_until_bloom, current_data)
+    async def prediccion(current_data: dict, propio: tuple) -> dict:
+        uncertainty = await asyncio.to_thread(_predecir_distribucion, id, current_data, propio)
+        return resumir_prediccion(uncertainty["mean_days"], uncertainty)
+
+    async def explicacion(current_data: dict, propio: tuple) -> Optional[dict]:
+        return await asyncio.to_thread(_explicar_prediccion, id, current_data, propio)
+
+    async def analisis(current_data: dict, prediction: dict) -> Optional[dict]:
+        return await request_llm_analysis(prediction["days_until_bloom"], prediction["probability"], current_data)
+
+    pipeline = Pipeline(deadline or settings.PREDICT_BLOOM_DEADLINE_SECONDS)
+    pipeline.add("current_data", lambda: asyncio.to_thread(_datos_actuales, parcela))
+    pipeline.add("model", lambda: asyncio.to_thread(_resolver_modelo_propio, id))
+    pipeline.add("prediction", prediccion, after=("current_data", "model"))
+    pipeline.add("explanation", explicacion, after=("current_data", "model"))
+    # El LLM no espera a la explicación: solo la usa el análisis por reglas de respaldo
+    pipeline.add("ai_analysis", analisis, after=("current_data", "prediction"),
+                 timeout=settings.AI_ANALYSIS_TIMEOUT_SECONDS)
+    await pipeline.run()
+    try:
+        pipeline.raise_errors()
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    current_data = pipeline.result("current_data")
+    flowering_prediction = pipeline.result("prediction")
+    if flowering_prediction is not None:
+        explanation = pipeline.result("explanation")
+        flowering_prediction["explanation"] = explanation
+        analysis = pipeline.result("ai_analysis")
+        fuente_analisis = "ai"
+        if analysis is None:
+            # Sin LLM o sin tiempo para él: análisis por reglas (inmediato) con la explicación
+            analysis = generate_contextual_analysis(
+                flowering_prediction["days_until_bloom"], flowering_prediction["probability"], current_data,
+                explanation
+            )
+            fuente_analisis = "contextual"
+        flowering_prediction["ai_analysis"] = analysis
+        flowering_prediction["ai_analysis_source"] = fuente_analisis
 
     return {
         "message": "Coordenadas recibidas correctamente",
-        "polygon": request.coordinates,
+        "parcel_id": id,
+        "polygon": parcela["coordinates"],
         "current_data": current_data,
-        "flowering_prediction": flowering_prediction
+        "flowering_prediction": flowering_prediction,
+        "partial": pipeline.partial,
+        "pipeline": pipeline.summary()
     }
 
+def _json_default(valor):
+    # Escalares de numpy / pandas que json no serializa por sí solo
+    if hasattr(valor, "item"):
+        return valor.item()
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+def _evento_sse(evento: str, datos) -> str:
+    """Formatea un evento Server-Sent Events con datos JSON."""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False, default=_json_default)}\n\n"
+
+@router.post("/predict-bloom/stream")
+async def predict_bloom_stream(id: int, request: Optional[PolygonRequest] = None):
+    """
+    Variante en streaming (Server-Sent Events) de /predict-bloom.
+    Eventos, en orden: current_data, prediction (parte numérica, en cuanto el modelo responde),
+    explanation (atribuciones locales del modelo, si hay historial de referencia), ai_analysis (cuando llega del LLM; si supera AI_ANALYSIS_TIMEOUT_SECONDS se envía el análisis
+    contextual por reglas) y done. Cualquier fallo se emite como evento error.
+    """
+    parcela = await asyncio.to_thread(_resolver_parcela, id, request)
+    if not gee_service.is_available():
+        raise HTTPException(status_code=503, detail="Google Earth Engine service not available")
+
+    async def eventos():
+        try:
+            current_data = await asyncio.to_thread(_datos_actuales, parcela)
+        except HTTPException as e:
+            yield _evento_sse("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            logger.error(f"Error obteniendo datos actuales de la parcela {id}: {e}")
+            yield _evento_sse("error", {"status_code": 500, "detail": str(e)})
+            return
+        yield _evento_sse("current_data", current_data)
+
+        try:
+            # Inferencia fuera del event loop, como en /predict-bloom
+            uncertainty = await asyncio.to_thread(_predecir_distribucion, id, current_data)
+        except HTTPException as e:
+            yield _evento_sse("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+        except ValueError as e:
+            yield _evento_sse("error", {"status_code": 422, "detail": str(e)})
+            return
+        except Exception as e:
+            logger.error(f"Error en la predicción de la parcela {id}: {e}")
+            yield _evento_sse("error", {"status_code": 500, "detail": str(e)})
+            return
+        prediction = resumir_prediccion(uncertainty["mean_days"], uncertainty)
+        yield _evento_sse("prediction", prediction)
+
+        # El LLM arranca ya; la explicación se calcula mientras tanto en un hilo
+        llm = asyncio.create_task(asyncio.wait_for(
+            request_llm_analysis(prediction["days_until_bloom"], prediction["probability"], current_data),
+            timeout=settings.AI_ANALYSIS_TIMEOUT_SECONDS
+        ))
+        try:
+            explanation = await asyncio.to_thread(_explicar_prediccion, id, current_data)
+            if explanation is not None:
+                yield _evento_sse("explanation", explanation)
+
+            try:
+                analysis = await llm
+            except asyncio.TimeoutError:
+                analysis = None
+        finally:
+            # Si el cliente se desconecta no se deja la petición al LLM colgando
+            llm.cancel()
+        fuente_analisis = "ai"
+        if analysis is None:
+            analysis = generate_contextual_analysis(prediction["days_until_bloom"], prediction["probability"],
+                                                    current_data, explanation)
+            fuente_analisis = "contextual"
+        yield _evento_sse("ai_analysis", {"source": fuente_analisis, "ai_analysis": analysis})
+        yield _evento_sse("done", {"parcel_id": id, "polygon": parcela["coordinates"]})
 
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/predict-bloom/trajectory")
+async def predict_bloom_trajectory(
+    id: int,
+    request: Optional[PolygonRequest] = None,
+    days: int = Query(30, ge=1, le=365, description="Número de días futuros a evaluar"),
+    climate: str = Query("hold", pattern="^(hold|trend)$", description="hold: clima constante, trend: proyectar NDVI")
+):
+    """
+    Curva de días hasta floración para cada uno de los próximos `days` días.
+    Todas las filas futuras se transforman y predicen en un único batch.
+    """
+    parcela = await asyncio.to_thread(_resolver_parcela, id, request)
+    if not gee_service.is_available():
+        raise HTTPException(status_code=503, detail="Google Earth Engine service not available")
+    current_data = await asyncio.to_thread(_datos_actuales, parcela)
+    fuente, vecinos, curve = await asyncio.to_thread(_predecir_trayectoria, id, current_data, days, climate)
+    earliest = min(curve, key=lambda p: p["predicted_bloom_date"])
+    return {
+        "parcel_id": id,
+        "model_source": fuente,
+        "similar_parcels": vecinos,
+        "climate": climate,
+        "days": days,
+        "earliest_predicted_bloom_date": earliest["predicted_bloom_date"],
+        "trajectory": curve,
+    }
@@ -2,7 +2,7 @@
 Database models for BloomWatch application
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database.database import Base
@@ -48,6 +48,14 @@ class BloomDetection(Base):
     bloom_coordinates = Column(JSON)  # List of bloom area coordinates
     bounding_box = Column(JSON)  # Overall bounding box of bloom areas
     
+    # Same extent as plain columns for SQL filtering: the geohash of the smallest
+    # cell containing it narrows the scan, the bounds refine it
+    geohash = Column(String(12))
+    min_lon = Column(Float)
+    min_lat = Column(Float)
+    max_lon = Column(Float)
+    max_lat = Column(Float)
+    
     # Analysis results
     analysis_results = Column(JSON)  # Detailed analysis results
     recommendations = Column(JSON)  # Generated recommendations
@@ -59,6 +67,11 @@ class BloomDetection(Base):
     # Relationships
     satellite_image = relationship("SatelliteImage", back_populates="bloom_detections")
     bloom_clusters = relationship("BloomCluster", back_populates="bloom_detection")
+    
+    # Prefix (LIKE 'ab%') lookups on PostgreSQL need pattern ops whatever the database collation
+    __table_args__ = (
+        Index("ix_bloom_detections_geohash", "geohash", postgresql_ops={"geohash": "varchar_pattern_ops"}),
+    )
 
 class BloomCluster(Base):
     """Model for storing individual bloom clusters"""
@@ -90,6 +103,35 @@ class BloomCluster(Base):
     # Relationships
     bloom_detection = relationship("BloomDetection", back_populates="bloom_clusters")
 
+class Parcel(Base):
+    """Model for registered parcels and their precomputed geometry metadata"""
+    __tablename__ = "parcels"
+    
+    id = Column(Integer, primary_key=True, index=True)  # Same id as the feature store and model manifest
+    name = Column(String(255))
+    
+    # Geometry
+    coordinates = Column(JSON, nullable=False)  # Canonical polygon ring [[lon, lat], ...]
+    geometry_hash = Column(String(40), index=True)  # SHA-1 of the canonical ring
+    area_hectares = Column(Float, nullable=False)
+    min_lon = Column(Float, nullable=False)
+    min_lat = Column(Float, nullable=False)
+    max_lon = Column(Float, nullable=False)
+    max_lat = Column(Float, nullable=False)
+    centroid_lon = Column(Float, nullable=False)
+    centroid_lat = Column(Float, nullable=False)
+    
+    # Native grid membership: MODIS 250 m cells [[row, col], ...] and their tiles
+    modis_cells = Column(JSON)
+    modis_tiles = Column(JSON)
+    
+    # Latest flowering model version in the model manifest (None until trained)
+    model_version = Column(Integer)
+    
+    # Metadata
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
 class TemporalAnalysis(Base):
     """Model for storing temporal bloom analysis results"""
     __tablename__ = "temporal_analysis"
@@ -7,11 +7,14 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
+import asyncio
 import os
 from dotenv import load_dotenv
 
 from app.api.routes import bloom, nasa_data, visualization
 from app.core.config import settings
+from app.services.llm_service import llm_service
+from app.services.spatial_index import parcel_index
 from app.database.database import engine, Base
 
 # Load environment variables
@@ -50,6 +53,16 @@ app.include_router(visualization.router, prefix="/api/v1/viz", tags=["visualizat
 # Mount static files for serving generated visualizations
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.on_event("startup")
+async def startup():
+    """Load the parcel spatial index before serving, so no request pays for it on the event loop"""
+    await asyncio.to_thread(parcel_index.load)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close pooled HTTP clients"""
+    await llm_service.aclose()
+
 @app.get("/")
 async def root():
     """Endpoint raíz con información del proyecto"""
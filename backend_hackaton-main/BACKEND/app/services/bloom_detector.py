@@ -9,11 +9,14 @@ from datetime import datetime, timedelta
 import numpy as np
 import os
 import json
+from sqlalchemy import and_, func, insert, or_, select
 
 from app.services.gee_service import gee_service
 from app.services.data_processor import data_processor
 from app.database.models import SatelliteImage, BloomDetection, BloomCluster, AnalysisJob
-from app.database.database import SessionLocal
+from app.database.database import AsyncSessionLocal
+from app.services.spatial_index import parcel_index
+from app.services.geometry import geohash_of_bbox, geohash_query_keys
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -90,8 +93,7 @@ class BloomDetector:
     
     async def _create_analysis_job(self, job_type: str, parameters: Dict) -> int:
         """Create a new analysis job record"""
-        db = SessionLocal()
-        try:
+        async with AsyncSessionLocal() as db:
             job = AnalysisJob(
                 job_type=job_type,
                 parameters=parameters,
@@ -99,11 +101,8 @@ class BloomDetector:
                 started_at=datetime.utcnow()
             )
             db.add(job)
-            db.commit()
-            db.refresh(job)
+            await db.commit()
             return job.id
-        finally:
-            db.close()
     
     async def _detect_blooms_gee(
         self,
@@ -211,8 +210,7 @@ class BloomDetector:
     
     async def _store_satellite_image_metadata(self, dataset: Dict, local_path: str) -> SatelliteImage:
         """Store satellite image metadata in database"""
-        db = SessionLocal()
-        try:
+        async with AsyncSessionLocal() as db:
             # Extract metadata
             temporal_coverage = self.nasa_service.get_temporal_coverage(dataset)
             start_date = temporal_coverage[0] if temporal_coverage else datetime.utcnow()
@@ -232,13 +230,9 @@ class BloomDetector:
             )
             
             db.add(satellite_image)
-            db.commit()
-            db.refresh(satellite_image)
+            await db.commit()
             
             return satellite_image
-            
-        finally:
-            db.close()
     
     def _extract_satellite_name(self, dataset: Dict) -> str:
         """Extract satellite name from dataset metadata"""
@@ -401,54 +395,67 @@ class BloomDetector:
             return {"error": str(e)}
     
     async def _store_detection_results(self, results: Dict, job_id: int):
-        """Store detection results in database"""
-        db = SessionLocal()
-        try:
-            summary = results.get("summary", {})
-            individual_results = results.get("individual_results", [])
-            
-            for result in individual_results:
-                # Create bloom detection record
-                bloom_detection = BloomDetection(
-                    satellite_image_id=result.get("satellite_image_id"),
-                    detection_method=result.get("detection_method", "unknown"),
-                    bloom_areas_count=result.get("bloom_areas_count", 0),
-                    total_bloom_area=result.get("total_bloom_area", 0),
-                    max_ndvi_value=result.get("max_ndvi", 0),
-                    avg_ndvi_value=result.get("avg_ndvi", 0),
-                    confidence_score=result.get("confidence_score", 0),
-                    bloom_coordinates=self._extract_bloom_coordinates(result.get("clusters", [])),
-                    analysis_results=result.get("analysis_results", {}),
-                    recommendations=self._generate_recommendations(result)
-                )
+        """Store detection results in database (bulk inserts, one transaction)"""
+        individual_results = results.get("individual_results", [])
+        if not individual_results:
+            return
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                # One multi-row INSERT for the detections, ids returned in input order
+                detection_rows = [self._detection_row(result) for result in individual_results]
+                detection_ids = (await db.scalars(
+                    insert(BloomDetection).returning(BloomDetection.id, sort_by_parameter_order=True),
+                    detection_rows
+                )).all()
                 
-                db.add(bloom_detection)
-                db.flush()  # Get the ID
+                # One executemany for all their clusters
+                cluster_rows = [
+                    self._cluster_row(detection_id, cluster)
+                    for detection_id, result in zip(detection_ids, individual_results)
+                    for cluster in result.get("clusters", [])
+                ]
+                if cluster_rows:
+                    await db.execute(insert(BloomCluster), cluster_rows)
+                await db.commit()
                 
-                # Store bloom clusters
-                for cluster in result.get("clusters", []):
-                    bloom_cluster = BloomCluster(
-                        bloom_detection_id=bloom_detection.id,
-                        cluster_id=cluster.get("id", 0),
-                        area=cluster.get("area", 0),
-                        centroid_lat=cluster.get("centroid", [0, 0])[1],
-                        centroid_lon=cluster.get("centroid", [0, 0])[0],
-                        min_lat=cluster.get("bounding_box", {}).get("y", 0),
-                        max_lat=cluster.get("bounding_box", {}).get("y", 0) + cluster.get("bounding_box", {}).get("height", 0),
-                        min_lon=cluster.get("bounding_box", {}).get("x", 0),
-                        max_lon=cluster.get("bounding_box", {}).get("x", 0) + cluster.get("bounding_box", {}).get("width", 0),
-                        avg_ndvi=cluster.get("avg_ndvi"),
-                        max_ndvi=cluster.get("max_ndvi")
-                    )
-                    db.add(bloom_cluster)
-            
-            db.commit()
-            
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Error storing detection results: {e}")
-        finally:
-            db.close()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Error storing detection results: {e}")
+    
+    def _detection_row(self, result: Dict) -> Dict:
+        """Column values of a BloomDetection row"""
+        return {
+            "satellite_image_id": result.get("satellite_image_id"),
+            "detection_method": result.get("detection_method", "unknown"),
+            "bloom_areas_count": result.get("bloom_areas_count", 0),
+            "total_bloom_area": result.get("total_bloom_area", 0),
+            "max_ndvi_value": result.get("max_ndvi", 0),
+            "avg_ndvi_value": result.get("avg_ndvi", 0),
+            "confidence_score": result.get("confidence_score", 0),
+            "bloom_coordinates": self._extract_bloom_coordinates(result.get("clusters", [])),
+            **self._extent_columns(self._detection_bounding_box(result)),
+            "analysis_results": result.get("analysis_results", {}),
+            "recommendations": self._generate_recommendations(result),
+        }
+    
+    def _cluster_row(self, detection_id: int, cluster: Dict) -> Dict:
+        """Column values of a BloomCluster row"""
+        centroid = cluster.get("centroid", [0, 0])
+        bbox = cluster.get("bounding_box", {})
+        return {
+            "bloom_detection_id": detection_id,
+            "cluster_id": cluster.get("id", 0),
+            "area": cluster.get("area", 0),
+            "centroid_lat": centroid[1],
+            "centroid_lon": centroid[0],
+            "min_lat": bbox.get("y", 0),
+            "max_lat": bbox.get("y", 0) + bbox.get("height", 0),
+            "min_lon": bbox.get("x", 0),
+            "max_lon": bbox.get("x", 0) + bbox.get("width", 0),
+            "avg_ndvi": cluster.get("avg_ndvi"),
+            "max_ndvi": cluster.get("max_ndvi"),
+        }
     
     def _extract_bloom_coordinates(self, clusters: List[Dict]) -> List[Dict]:
         """Extract coordinates from bloom clusters"""
@@ -462,6 +469,26 @@ class BloomDetector:
             })
         return coordinates
     
+    def _detection_bounding_box(self, result: Dict) -> Optional[List[float]]:
+        """
+        Geographic extent of a detection: the analysed area (min_lon, min_lat, max_lon, max_lat)
+        Cluster bounding boxes are pixel offsets from the raster and are never used as degrees
+        """
+        box = result.get("bbox")
+        return [float(v) for v in box] if box is not None and len(box) == 4 else None
+    
+    def _extent_columns(self, box: Optional[List[float]]) -> Dict:
+        """bounding_box plus the indexed geohash/bounds columns"""
+        if box is None:
+            # Same keys either way: bulk inserts need homogeneous rows
+            return {"bounding_box": None, "geohash": None,
+                    "min_lon": None, "min_lat": None, "max_lon": None, "max_lat": None}
+        return {
+            "bounding_box": box,
+            "geohash": geohash_of_bbox(box),
+            "min_lon": box[0], "min_lat": box[1], "max_lon": box[2], "max_lat": box[3],
+        }
+    
     def _generate_recommendations(self, result: Dict) -> List[str]:
         """Generate recommendations based on detection results"""
         recommendations = []
@@ -489,9 +516,8 @@ class BloomDetector:
     
     async def _complete_job(self, job_id: int, status: str, result: Dict = None, error: str = None) -> Dict:
         """Complete an analysis job"""
-        db = SessionLocal()
-        try:
-            job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+        async with AsyncSessionLocal() as db:
+            job = await db.get(AnalysisJob, job_id)
             if job:
                 job.status = status
                 job.completed_at = datetime.utcnow()
@@ -500,7 +526,7 @@ class BloomDetector:
                 if error:
                     job.error_message = error
                 
-                db.commit()
+                await db.commit()
             
             return {
                 "job_id": job_id,
@@ -509,9 +535,6 @@ class BloomDetector:
                 "error": error,
                 "completed_at": datetime.utcnow().isoformat()
             }
-            
-        finally:
-            db.close()
     
     async def get_bloom_history(
         self,
@@ -519,25 +542,52 @@ class BloomDetector:
         days_back: int = 365
     ) -> Dict:
         """Get historical bloom detection data for an area"""
-        db = SessionLocal()
-        try:
+        async with AsyncSessionLocal() as db:
             start_date = datetime.utcnow() - timedelta(days=days_back)
             
-            # Query bloom detections in the area
-            detections = db.query(BloomDetection).join(SatelliteImage).filter(
-                SatelliteImage.acquisition_date >= start_date
-            ).all()
+            # Geohash keys narrow the scan through the index (prefix LIKE, see the
+            # varchar_pattern_ops index on PostgreSQL); the bounds make it exact
+            exact, prefixes = geohash_query_keys(bbox)
+            in_area = and_(
+                or_(BloomDetection.geohash.in_(exact), *[BloomDetection.geohash.startswith(p) for p in prefixes]),
+                BloomDetection.min_lon <= bbox[2], BloomDetection.max_lon >= bbox[0],
+                BloomDetection.min_lat <= bbox[3], BloomDetection.max_lat >= bbox[1],
+            )
+            filters = (in_area, SatelliteImage.acquisition_date >= start_date)
+            
+            # Only the columns the response needs
+            rows = (await db.execute(
+                select(
+                    BloomDetection.id, SatelliteImage.acquisition_date, BloomDetection.bloom_areas_count,
+                    BloomDetection.total_bloom_area, BloomDetection.max_ndvi_value, BloomDetection.confidence_score,
+                    BloomDetection.detection_method, BloomDetection.min_lon, BloomDetection.min_lat,
+                    BloomDetection.max_lon, BloomDetection.max_lat
+                ).join(SatelliteImage).where(*filters).order_by(SatelliteImage.acquisition_date)
+            )).all()
+            total, avg_areas, max_area = (await db.execute(
+                select(
+                    func.count(BloomDetection.id), func.avg(BloomDetection.bloom_areas_count),
+                    func.max(BloomDetection.total_bloom_area)
+                ).join(SatelliteImage).where(*filters)
+            )).one()
+            
+            # Parcels under each detection: exact polygon tests (and the index's first load) run off the event loop
+            extents = [[row.min_lon, row.min_lat, row.max_lon, row.max_lat] for row in rows]
+            parcel_ids = await asyncio.to_thread(lambda: [parcel_index.intersecting(extent) for extent in extents])
             
             # Format results
             history = []
-            for detection in detections:
+            for row, extent, parcels in zip(rows, extents, parcel_ids):
                 history.append({
-                    "date": detection.satellite_image.acquisition_date.isoformat(),
-                    "bloom_areas_count": detection.bloom_areas_count,
-                    "total_bloom_area": detection.total_bloom_area,
-                    "max_ndvi": detection.max_ndvi_value,
-                    "confidence_score": detection.confidence_score,
-                    "detection_method": detection.detection_method
+                    "id": row.id,
+                    "date": row.acquisition_date.isoformat(),
+                    "bbox": extent,
+                    "parcel_ids": parcels,
+                    "bloom_areas_count": row.bloom_areas_count,
+                    "total_bloom_area": row.total_bloom_area,
+                    "max_ndvi": row.max_ndvi_value,
+                    "confidence_score": row.confidence_score,
+                    "detection_method": row.detection_method
                 })
             
             return {
@@ -545,14 +595,11 @@ class BloomDetector:
                 "period_days": days_back,
                 "detections": history,
                 "summary": {
-                    "total_detections": len(history),
-                    "avg_bloom_areas": np.mean([d["bloom_areas_count"] for d in history]) if history else 0,
-                    "max_bloom_area": max([d["total_bloom_area"] for d in history]) if history else 0
+                    "total_detections": total,
+                    "avg_bloom_areas": float(avg_areas) if avg_areas is not None else 0,
+                    "max_bloom_area": max_area or 0
                 }
             }
-            
-        finally:
-            db.close()
 
 # Create global instance
 bloom_detector = BloomDetector()
@@ -0,0 +1,187 @@
+"""
+Local explanations for flowering predictions
+Per-feature attributions computed by occluding each feature group with
+values drawn from a background sample, all evaluated in one batched model
+call; the strongest drivers are turned into readable indicators
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import COLS_X
+
+# Features that only make sense together are occluded as one group
+FEATURE_GROUPS: List[Tuple[str, ...]] = [
+    ('year', 'month', 'day_of_year'),
+] + [(c,) for c in COLS_X if c not in ('year', 'month', 'day_of_year')]
+
+# Readable (Spanish) names for the indicators, keyed by the group's first column
+FEATURE_LABELS = {
+    'year': 'la época del año',
+    'NDVI': 'el NDVI',
+    'EVI': 'el EVI',
+    'LST_day': 'la temperatura diurna de superficie',
+    'LST_night': 'la temperatura nocturna de superficie',
+    'LST_range': 'la amplitud térmica día-noche',
+    'LST_mean': 'la temperatura media de superficie',
+    'NDVI_EVI_ratio': 'la relación NDVI/EVI',
+    'thermal_stress': 'el estrés térmico',
+    'NDVI_change': 'el cambio reciente de NDVI',
+    'NDVI_rolling_mean_30d': 'el NDVI medio de los últimos 30 días',
+    'ET_estimate': 'la evapotranspiración',
+    **{f'precip_{w}d': f'la precipitación acumulada de {w} días' for w in (7, 15, 30, 60, 90)},
+    **{f'water_balance_{w}d': f'el balance hídrico de {w} días' for w in (7, 15, 30, 60, 90)},
+}
+
+# Background rows per explanation: the batch has 1 + len(FEATURE_GROUPS) * BACKGROUND_ROWS rows
+BACKGROUND_ROWS = 16
+# Parcels read for the store-wide background (evenly spread over the store's parcel ids)
+GLOBAL_BACKGROUND_PARCELS = 8
+BACKGROUND_TTL_SECONDS = 3600
+BACKGROUND_CACHE_SIZE = 256
+
+
+class ExplanationEngine:
+    """
+    Occlusion attributions against a per-parcel background
+
+    The attribution of a group is the prediction for the actual reading minus
+    the mean prediction when that group takes the values of the background
+    rows (the parcel's own stored history, or a sample of a few parcels of the
+    store for parcels without one). Positive values push flowering later.
+    """
+
+    def __init__(self, store=feature_store, background_rows: int = BACKGROUND_ROWS):
+        self.store = store
+        self.background_rows = background_rows
+        self._lock = threading.Lock()
+        # parcel id (None = whole store) -> (expiry, background frame)
+        self._backgrounds: "OrderedDict[Optional[int], Tuple[float, pd.DataFrame]]" = OrderedDict()
+
+    def _sample(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Evenly spaced rows (by date when available) so the background spans the seasons"""
+        df = df.dropna(subset=[c for c in COLS_X if c in df.columns], how='any')
+        if 'date' in df.columns:
+            df = df.sort_values('date', kind='mergesort')
+        if len(df) > self.background_rows:
+            df = df.iloc[np.linspace(0, len(df) - 1, self.background_rows).round().astype(int)]
+        return df[[c for c in COLS_X if c in df.columns]].reset_index(drop=True)
+
+    def background(self, parcel_id: Optional[int] = None) -> pd.DataFrame:
+        """Background sample for a parcel, cached for BACKGROUND_TTL_SECONDS"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._backgrounds.get(parcel_id)
+            if cached is not None and cached[0] > now:
+                self._backgrounds.move_to_end(parcel_id)
+                return cached[1]
+
+        columns = ['date'] + list(COLS_X)
+        if parcel_id is None:
+            # A partition sample: only a few parcels' last three years are read, never the whole store
+            year = pd.Timestamp.utcnow().year
+            ids = self.store.parcel_ids()
+            if len(ids) > GLOBAL_BACKGROUND_PARCELS:
+                ids = [ids[i] for i in np.linspace(0, len(ids) - 1, GLOBAL_BACKGROUND_PARCELS).round().astype(int)]
+            df = self._sample(self.store.read(columns=columns, parcel_ids=ids, years=(year - 2, year))
+                              if ids else pd.DataFrame(columns=columns))
+        else:
+            df = self._sample(self.store.read(columns=columns, parcel_ids=[parcel_id]))
+            if df.empty:
+                df = self.background(None)
+
+        with self._lock:
+            self._backgrounds[parcel_id] = (now + BACKGROUND_TTL_SECONDS, df)
+            self._backgrounds.move_to_end(parcel_id)
+            while len(self._backgrounds) > BACKGROUND_CACHE_SIZE:
+                self._backgrounds.popitem(last=False)
+        return df
+
+    def attributions(self, input_dict: dict, predict_rows: Callable[[List[dict]], np.ndarray],
+                     background: pd.DataFrame,
+                     groups: Sequence[Tuple[str, ...]] = FEATURE_GROUPS) -> Dict:
+        """
+        Attribution of every feature group from a single batched prediction
+
+        Args:
+            input_dict: Current feature reading of the parcel
+            predict_rows: Batched predictor (rows -> days to flowering), dropout off
+            background: Reference rows the occluded values are drawn from
+            groups: Feature groups to occlude
+
+        Returns:
+            Prediction for the reading and the groups sorted by absolute effect (days)
+        """
+        groups = [g for g in groups if all(c in input_dict and c in background.columns for c in g)]
+        if background.empty or not groups:
+            raise ValueError("No hay datos de referencia para explicar la predicción")
+        k = len(background)
+        n = 1 + len(groups) * k
+        # Row 0 is the reading itself; then k rows per group with that group replaced
+        columns = {c: np.full(n, np.nan if v is None else v, dtype=np.float64)
+                   for c, v in input_dict.items() if c in COLS_X}
+        for i, group in enumerate(groups):
+            start = 1 + i * k
+            for c in group:
+                columns[c][start:start + k] = background[c].to_numpy(dtype=np.float64)
+        days = np.asarray(predict_rows(pd.DataFrame(columns).to_dict('records')), dtype=np.float64)
+
+        prediction = float(days[0])
+        occluded = days[1:].reshape(len(groups), k).mean(axis=1)
+        drivers = []
+        for group, ref_days in zip(groups, occluded):
+            col = group[0]
+            value = input_dict[col]
+            reference = float(background[col].median())
+            drivers.append({
+                "features": list(group),
+                "label": FEATURE_LABELS.get(col, col),
+                "value": None if value is None else float(value),
+                "reference": reference,
+                "effect_days": round(prediction - float(ref_days), 2),
+            })
+        drivers.sort(key=lambda d: abs(d["effect_days"]), reverse=True)
+        return {"predicted_days": prediction, "background_rows": k, "drivers": drivers}
+
+    def explain(self, input_dict: dict, predict_rows: Callable[[List[dict]], np.ndarray],
+                parcel_id: Optional[int] = None) -> Dict:
+        """Attributions against the parcel's cached background"""
+        return self.attributions(input_dict, predict_rows, self.background(parcel_id))
+
+
+def _nivel(driver: Dict) -> str:
+    value, reference = driver["value"], driver["reference"]
+    # Calendar group: the date is not "high" or "low"
+    if len(driver["features"]) > 1 or value is None or not np.isfinite(reference):
+        return ""
+    scale = max(abs(reference), 1e-6)
+    if abs(value - reference) / scale < 0.05:
+        return " (en su nivel habitual)"
+    return " (por encima de lo habitual)" if value > reference else " (por debajo de lo habitual)"
+
+
+def indicators_from_drivers(explanation: Dict, top: int = 3, min_effect_days: float = 0.5) -> List[str]:
+    """Sentences for the strongest drivers (Spanish, like the rest of the analysis)"""
+    indicators = []
+    for driver in explanation["drivers"][:top]:
+        effect = driver["effect_days"]
+        if abs(effect) < min_effect_days:
+            break
+        sentido = "retrasa" if effect > 0 else "adelanta"
+        indicators.append(
+            f"Según el modelo, {driver['label']}{_nivel(driver)} {sentido} la floración "
+            f"unos {abs(effect):.1f} días respecto a las condiciones de referencia de la parcela."
+        )
+    if not indicators:
+        indicators.append("Ningún indicador se aparta lo suficiente de lo habitual como para mover la predicción más de medio día.")
+    return indicators
+
+
+# Create global instance
+explanation_engine = ExplanationEngine()
@@ -0,0 +1,212 @@
+"""
+Derived features for the flowering model
+One vectorized pass over a parcel's raw satellite series, shared by history
+(training) and current-data (serving) extraction so both see the same logic
+"""
+
+import io
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Accumulation windows (days) for precipitation, ET and water balance
+WINDOWS = (7, 15, 30, 60, 90)
+
+# LST_Day_1km above this value (Kelvin) counts as thermal stress
+THERMAL_STRESS_K = 305
+
+NDVI_ROLLING_WINDOW = '30D'
+
+# Raw values read from Earth Engine; everything else is derived from these
+RAW_COLUMNS = (
+    ['date', 'NDVI', 'EVI', 'LST_day', 'LST_night', 'ET_estimate']
+    + [f'precip_{w}d' for w in WINDOWS]
+    + [f'et_{w}d' for w in WINDOWS]
+)
+
+DERIVED_COLUMNS = (
+    ['timestamp', 'year', 'month', 'day_of_year', 'season', 'LST_range', 'LST_mean', 'NDVI_EVI_ratio',
+     'thermal_stress', 'NDVI_change', 'NDVI_rolling_mean_30d']
+    + [f'water_balance_{w}d' for w in WINDOWS]
+)
+
+# Field order of the records returned by get_history_parcel
+HISTORY_COLUMNS = (
+    ['date', 'timestamp', 'NDVI', 'EVI', 'LST_day', 'LST_night']
+    + [f'precip_{w}d' for w in WINDOWS]
+    + ['LST_range', 'LST_mean', 'NDVI_EVI_ratio', 'year', 'month', 'day_of_year', 'season', 'thermal_stress',
+       'NDVI_change', 'NDVI_rolling_mean_30d', 'ET_estimate']
+    + [f'water_balance_{w}d' for w in WINDOWS]
+)
+
+# Field order of the dict returned by get_current_parcel_data
+CURRENT_COLUMNS = (
+    ['NDVI', 'EVI', 'NDVI_EVI_ratio', 'LST_day', 'LST_night', 'LST_range', 'LST_mean', 'thermal_stress']
+    + [f'precip_{w}d' for w in WINDOWS]
+    + ['NDVI_change', 'NDVI_rolling_mean_30d', 'ET_estimate']
+    + [f'water_balance_{w}d' for w in WINDOWS]
+    + ['year', 'month', 'day_of_year']
+)
+
+# Compact in-memory dtypes for a parcel history (every other numeric column is float32)
+_COMPACT_DTYPES = {'timestamp': 'int64', 'year': 'int16', 'month': 'int8', 'day_of_year': 'int16'}
+SEASONS = ['winter', 'spring', 'summer', 'autumn']
+
+# Month -> season lookup (northern hemisphere meteorological seasons)
+_SEASON_BY_MONTH = np.array(
+    [None, 'winter', 'winter', 'spring', 'spring', 'spring', 'summer',
+     'summer', 'summer', 'autumn', 'autumn', 'autumn', 'winter'],
+    dtype=object
+)
+
+
+def season_for_month(month: int) -> str:
+    """Meteorological season of a calendar month"""
+    return _SEASON_BY_MONTH[int(month)]
+
+
+def _has(df: pd.DataFrame, *cols: str) -> bool:
+    return all(c in df.columns for c in cols)
+
+
+def _numeric(df: pd.DataFrame, col: str) -> pd.Series:
+    return pd.to_numeric(df[col], errors='coerce').astype('float64')
+
+
+def _grouped(df: pd.DataFrame, group_col: Optional[str]):
+    """The frame itself, or its groupby when it holds several independent series"""
+    if group_col is None or group_col not in df.columns:
+        return df
+    return df.groupby(group_col, sort=False, dropna=False)
+
+
+def derive_features(raw: pd.DataFrame, group_col: Optional[str] = 'parcel_id') -> pd.DataFrame:
+    """
+    Compute every derived model feature from raw series in one vectorized pass
+
+    A derived column is only (re)computed when its inputs are present, so the
+    function can also be applied to stored histories that lack e.g. the raw
+    ET window sums (their existing water balance columns are kept).
+
+    Args:
+        raw: One row per observation date; needs a ``date`` column
+        group_col: Column identifying independent series (rolling windows and
+            differences never cross groups); ignored if absent
+
+    Returns:
+        A new DataFrame sorted by (group, date) with the derived columns added
+    """
+    df = raw.copy()
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    sort_cols = [group_col, 'date'] if group_col and group_col in df.columns else ['date']
+    df = df.sort_values(sort_cols, kind='mergesort').reset_index(drop=True)
+
+    # Calendar
+    dates = df['date'].dt
+    df['timestamp'] = (df['date'] - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    df['year'] = dates.year
+    df['month'] = dates.month
+    df['day_of_year'] = dates.dayofyear
+    df['season'] = _SEASON_BY_MONTH[df['month'].to_numpy()]
+
+    # Temperature
+    if _has(df, 'LST_day', 'LST_night'):
+        lst_day, lst_night = _numeric(df, 'LST_day'), _numeric(df, 'LST_night')
+        df['LST_range'] = lst_day - lst_night
+        df['LST_mean'] = (lst_day + lst_night) / 2
+    if _has(df, 'LST_day'):
+        lst_day = _numeric(df, 'LST_day')
+        df['thermal_stress'] = np.where(lst_day.isna(), np.nan, (lst_day > THERMAL_STRESS_K).astype('float64'))
+
+    # Vegetation
+    if _has(df, 'NDVI', 'EVI'):
+        evi = _numeric(df, 'EVI')
+        df['NDVI_EVI_ratio'] = _numeric(df, 'NDVI') / evi.where(evi != 0)
+    if _has(df, 'NDVI'):
+        df['NDVI'] = _numeric(df, 'NDVI')
+        df['NDVI_change'] = _grouped(df, group_col)['NDVI'].diff()
+        # Time-aware window: mean of the observations in (date - 30 days, date]
+        # (rows are sorted by group then date, so the result lines up positionally)
+        rolling = _grouped(df, group_col).rolling(NDVI_ROLLING_WINDOW, on='date', min_periods=1)['NDVI'].mean()
+        df['NDVI_rolling_mean_30d'] = rolling.to_numpy()
+
+    # Water balance = accumulated precipitation - accumulated ET over the same window
+    for w in WINDOWS:
+        if _has(df, f'precip_{w}d', f'et_{w}d'):
+            df[f'water_balance_{w}d'] = _numeric(df, f'precip_{w}d') - _numeric(df, f'et_{w}d')
+
+    return df
+
+
+def to_records(df: pd.DataFrame, columns: Optional[Sequence[str]] = None) -> List[Dict]:
+    """Serialize derived features as JSON-friendly dicts (ISO dates, NaN -> None)"""
+    out = df if columns is None else df[[c for c in columns if c in df.columns]]
+    out = out.astype(object).where(out.notna(), None)
+    if 'date' in out.columns:
+        out['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    return out.to_dict('records')
+
+
+def latest_features(raw: pd.DataFrame, columns: Sequence[str] = CURRENT_COLUMNS) -> Dict:
+    """Derive features over a recent raw series and return the most recent row"""
+    df = derive_features(raw, group_col=None)
+    if df.empty:
+        return {}
+    return to_records(df.tail(1), columns)[0]
+
+
+def compact_history(df: pd.DataFrame, columns: Sequence[str] = HISTORY_COLUMNS) -> pd.DataFrame:
+    """
+    Column-oriented parcel history: DatetimeIndex named ``date``, float32
+    feature columns, small ints for the calendar and a categorical season
+
+    Roughly a quarter of the memory of the equivalent list of dicts.
+    """
+    out = df[[c for c in columns if c in df.columns]].copy()
+    out = out.set_index(pd.DatetimeIndex(pd.to_datetime(out.pop('date')), name='date'))
+    for col in out.columns:
+        if col == 'season':
+            out[col] = pd.Categorical(out[col], categories=SEASONS)
+        elif col in _COMPACT_DTYPES:
+            out[col] = out[col].astype(_COMPACT_DTYPES[col])
+        else:
+            out[col] = pd.to_numeric(out[col], errors='coerce').astype('float32')
+    return out
+
+
+def flatten_history(history: Union[List[Dict], pd.DataFrame]) -> pd.DataFrame:
+    """Accept records or a compact history and return a flat frame with a ``date`` column"""
+    if isinstance(history, pd.DataFrame):
+        if 'date' not in history.columns and history.index.name == 'date':
+            return history.reset_index()
+        return history.copy()
+    return pd.DataFrame(history)
+
+
+def history_to_columns(history: pd.DataFrame) -> Dict:
+    """Column-oriented JSON: one list per column plus the shared date index"""
+    columns = {}
+    for col in history.columns:
+        values = history[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        elif pd.api.types.is_float_dtype(values):
+            # Widen, then round: float32 noise (0.10000000149...) stays out of the JSON
+            values = values.astype('float64').round(6)
+        columns[col] = values.astype(object).where(values.notna(), None).tolist()
+    return {
+        "index": history.index.strftime('%Y-%m-%d').tolist(),
+        "columns": columns,
+    }
+
+
+def history_to_arrow(history: pd.DataFrame) -> bytes:
+    """Serialize a compact history as an Arrow IPC stream"""
+    table = pa.Table.from_pandas(history.reset_index(), preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
@@ -0,0 +1,250 @@
+"""
+Columnar feature store for flowering model training data
+Parcel histories are stored as Parquet files partitioned by parcel and year
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from app.core.config import settings
+from app.services.feature_engineering import flatten_history
+
+logger = logging.getLogger(__name__)
+
+# Columnas numéricas de entrada del modelo (todas se guardan como float32)
+FEATURE_COLUMNS = [
+    'NDVI', 'EVI', 'LST_day', 'LST_night', 'precip_7d', 'precip_15d', 'precip_30d', 'precip_60d', 'precip_90d',
+    'LST_range', 'LST_mean', 'NDVI_EVI_ratio', 'thermal_stress', 'NDVI_change', 'NDVI_rolling_mean_30d',
+    'ET_estimate', 'water_balance_7d', 'water_balance_15d', 'water_balance_30d', 'water_balance_60d',
+    'water_balance_90d'
+]
+
+SEASONS = ['winter', 'spring', 'summer', 'autumn']
+
+SCHEMA = pa.schema(
+    [
+        ('date', pa.timestamp('ms')),
+        ('timestamp', pa.int64()),
+        ('month', pa.int8()),
+        ('day_of_year', pa.int16()),
+        ('season', pa.dictionary(pa.int8(), pa.string())),
+    ]
+    + [(col, pa.float32()) for col in FEATURE_COLUMNS]
+    # Ingestion sequence (ns since epoch of the append): the newest write wins on dedup
+    + [('written_at', pa.int64())]
+    # Partition keys are encoded in the directory layout (parcel_id=<id>/year=<yyyy>)
+    + [('parcel_id', pa.int64()), ('year', pa.int16())]
+)
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('parcel_id', pa.int64()), ('year', pa.int16())]),
+    flavor='hive'
+)
+
+SEQUENCE_COLUMN = 'written_at'
+# Columns returned by default (the ingestion sequence is bookkeeping)
+DATA_COLUMNS = [name for name in SCHEMA.names if name != SEQUENCE_COLUMN]
+
+Filters = Union[ds.Expression, None]
+
+_sequence_lock = threading.Lock()
+_last_sequence = 0
+
+
+def _next_sequence() -> int:
+    """Wall-clock nanoseconds, strictly increasing within the process"""
+    global _last_sequence
+    with _sequence_lock:
+        _last_sequence = max(time.time_ns(), _last_sequence + 1)
+        return _last_sequence
+
+
+class FeatureStore:
+    """Append-only Parquet store of per-parcel feature histories"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.FEATURE_STORE_DIR
+
+    def _to_table(self, records: Union[List[Dict], pd.DataFrame], parcel_id: int) -> pa.Table:
+        """Cast raw history records to the typed store schema"""
+        df = flatten_history(records)
+        if df.empty:
+            return SCHEMA.empty_table()
+
+        df['parcel_id'] = int(parcel_id)
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df = df.dropna(subset=['date'])
+        if 'timestamp' not in df:
+            df['timestamp'] = df['date'].astype('int64') // 10**6
+        df['year'] = df['date'].dt.year
+        df['month'] = df['date'].dt.month
+        df['day_of_year'] = df['date'].dt.dayofyear
+        if 'season' not in df:
+            df['season'] = None
+        df['season'] = pd.Categorical(df['season'], categories=SEASONS)
+
+        for col in FEATURE_COLUMNS:
+            if col not in df:
+                df[col] = None
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+        df[SEQUENCE_COLUMN] = _next_sequence()
+
+        return pa.Table.from_pandas(df[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+
+    def append(self, parcel_id: int, records: Union[List[Dict], pd.DataFrame]) -> int:
+        """
+        Append history records for a parcel
+
+        Every call writes new files (one per touched year partition); existing
+        files are never rewritten. Rows carry the append's ingestion sequence,
+        so a re-appended (parcel, date) replaces the older row on read.
+
+        Args:
+            parcel_id: Parcel identifier used as partition key
+            records: History rows or the compact history returned by ``get_history_parcel``
+
+        Returns:
+            Number of rows written
+        """
+        table = self._to_table(records, parcel_id)
+        if table.num_rows == 0:
+            return 0
+
+        os.makedirs(self.root, exist_ok=True)
+        ds.write_dataset(
+            table,
+            self.root,
+            format='parquet',
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        logger.info(f"Feature store: appended {table.num_rows} rows for parcel {parcel_id}")
+        return table.num_rows
+
+    def dataset(self) -> Optional[ds.Dataset]:
+        """Open the store as a pyarrow dataset (None if it is still empty)"""
+        if not os.path.isdir(self.root):
+            return None
+        return ds.dataset(self.root, format='parquet', schema=SCHEMA, partitioning=PARTITIONING)
+
+    @staticmethod
+    def build_filter(
+        parcel_ids: Optional[Sequence[int]] = None,
+        years: Optional[Tuple[int, int]] = None,
+        start_date: Optional[pd.Timestamp] = None,
+        end_date: Optional[pd.Timestamp] = None
+    ) -> Filters:
+        """Build a predicate that prunes partitions and row groups"""
+        expr = None
+
+        def _and(a, b):
+            return b if a is None else a & b
+
+        if parcel_ids is not None:
+            expr = _and(expr, ds.field('parcel_id').isin([int(p) for p in parcel_ids]))
+        if years is not None:
+            expr = _and(expr, (ds.field('year') >= years[0]) & (ds.field('year') <= years[1]))
+        if start_date is not None:
+            expr = _and(expr, ds.field('date') >= pa.scalar(pd.Timestamp(start_date), pa.timestamp('ms')))
+        if end_date is not None:
+            expr = _and(expr, ds.field('date') <= pa.scalar(pd.Timestamp(end_date), pa.timestamp('ms')))
+        return expr
+
+    def read(
+        self,
+        columns: Optional[List[str]] = None,
+        parcel_ids: Optional[Sequence[int]] = None,
+        years: Optional[Tuple[int, int]] = None,
+        start_date: Optional[pd.Timestamp] = None,
+        end_date: Optional[pd.Timestamp] = None,
+        deduplicate: bool = True
+    ) -> pd.DataFrame:
+        """
+        Read a column-pruned, predicate-filtered slice of the store
+
+        Args:
+            columns: Columns to load (None loads every column)
+            parcel_ids: Only load these parcels
+            years: Inclusive (first_year, last_year) range
+            start_date: Only rows on or after this date
+            end_date: Only rows on or before this date
+            deduplicate: Drop repeated (parcel_id, date) rows left by re-appends, keeping the newest
+
+        Returns:
+            DataFrame with the requested columns
+        """
+        dataset = self.dataset()
+        if dataset is None:
+            return SCHEMA.empty_table().to_pandas()[columns or DATA_COLUMNS]
+
+        load_cols = list(columns) if columns else list(DATA_COLUMNS)
+        # The keys are needed to drop duplicates even if the caller didn't ask for them
+        extra = [c for c in ('parcel_id', 'date', SEQUENCE_COLUMN) if deduplicate and c not in load_cols]
+        table = dataset.to_table(
+            columns=load_cols + extra,
+            filter=self.build_filter(parcel_ids, years, start_date, end_date)
+        )
+        df = table.to_pandas()
+        if deduplicate and not df.empty:
+            # File order is arbitrary: order by write (files from before the
+            # sequence column count as oldest) and keep the newest row
+            df = df.sort_values(SEQUENCE_COLUMN, kind='mergesort', na_position='first')
+            df = df.drop_duplicates(subset=['parcel_id', 'date'], keep='last').sort_index(kind='mergesort')
+        return df[load_cols].reset_index(drop=True)
+
+    def iter_parcels(
+        self,
+        columns: Optional[List[str]] = None,
+        parcel_ids: Optional[Sequence[int]] = None,
+        years: Optional[Tuple[int, int]] = None,
+        parcels_per_chunk: int = 64
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Stream the store in chunks of whole parcels
+
+        Each chunk holds the complete (deduplicated) series of up to
+        ``parcels_per_chunk`` parcels, so per-parcel computations such as
+        rolling windows never see a truncated history while memory stays
+        bounded by the chunk size.
+        """
+        ids = list(parcel_ids) if parcel_ids is not None else self.parcel_ids()
+        for start in range(0, len(ids), parcels_per_chunk):
+            chunk = self.read(columns=columns, parcel_ids=ids[start:start + parcels_per_chunk], years=years)
+            if not chunk.empty:
+                yield chunk
+
+    def parcel_version(self, parcel_id: int) -> Optional[int]:
+        """
+        Cheap change token for one parcel's history (None if it has none)
+
+        Appends only ever add files, so the newest year-directory mtime moves
+        whenever the parcel gets new rows; callers can cache derived values on it.
+        """
+        parcel_dir = os.path.join(self.root, f"parcel_id={int(parcel_id)}")
+        try:
+            with os.scandir(parcel_dir) as entries:
+                return max((e.stat().st_mtime_ns for e in entries if e.is_dir()), default=None)
+        except FileNotFoundError:
+            return None
+
+    def parcel_ids(self) -> List[int]:
+        """List the parcels that have data in the store (from the partition directories, no file is read)"""
+        if not os.path.isdir(self.root):
+            return []
+        prefix = 'parcel_id='
+        with os.scandir(self.root) as entries:
+            return sorted(int(e.name[len(prefix):]) for e in entries
+                          if e.is_dir() and e.name.startswith(prefix) and e.name[len(prefix):].isdigit())
+
+
+# Create global instance
+feature_store = FeatureStore()
@@ -6,11 +6,17 @@ This service uses GEE to access Landsat, MODIS, VIIRS data directly from NASA
 import ee
 import logging
 import numpy as np
+import pandas as pd
 from typing import Dict, List, Optional, Tuple, Any
 from datetime import datetime, timedelta
 import json
 import os
 from app.core.config import settings
+from app.services.feature_store import feature_store
+from app.services.feature_engineering import (
+    WINDOWS, RAW_COLUMNS, compact_history, derive_features, latest_features
+)
+from app.services.geometry import prepare_polygon
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +25,8 @@ class GEEService:
     
     def __init__(self):
         self.initialized = False
+        # Current parcel data by canonical geometry hash: hash -> (expiry, data)
+        self._current_cache: Dict[str, Tuple[datetime, Dict]] = {}
         self._initialize_ee()
     
     def _initialize_ee(self):
@@ -615,22 +623,28 @@ class GEEService:
         ]
         
         return collections
-    async def get_history_parcel(self, coordinates: List[List[float]]) -> Dict:
+    async def get_history_parcel(self, coordinates: List[List[float]], parcel_id: Optional[int] = None,
+                                 geometry_hash: Optional[str] = None) -> Dict:
         """
         Get historical bloom data for a specific parcel
         
         Args:
             coordinates: List of coordinates defining the parcel polygon
+            parcel_id: If given, the history is also appended to the feature store
+            geometry_hash: Canonical hash when coordinates are already canonical (registered parcels)
             
         Returns:
-            List of dicts with fields:
-            date, timestamp, NDVI, EVI, LST_day, LST_night, precip_7d, precip_15d, precip_30d, precip_60d, precip_90d,
+            Dict with "history": compact DataFrame indexed by date (see compact_history) with columns:
+            timestamp, NDVI, EVI, LST_day, LST_night, precip_7d, precip_15d, precip_30d, precip_60d, precip_90d,
             LST_range, LST_mean, NDVI_EVI_ratio, year, month, day_of_year, season, thermal_stress, NDVI_change,
             NDVI_rolling_mean_30d, ET_estimate, water_balance_7d, water_balance_15d, water_balance_30d, water_balance_60d, water_balance_90d
         """
         try:
             if not self.initialized:
                 raise Exception("Google Earth Engine not initialized")
+            # Canonical, simplified ring: smaller payload and cheaper server-side clipping
+            if geometry_hash is None:
+                coordinates = prepare_polygon(coordinates)["coordinates"]
             parcel_geom = ee.Geometry.Polygon(coordinates)
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=5*365)
@@ -656,128 +670,71 @@ class GEEService:
                 .select(['ET'])
             # Prepare dates
             dates = modis.aggregate_array('system:time_start').getInfo()
-            results = []
-            prev_ndvi = None
-            ndvi_rolling = []
+            # Collect only raw values here; derived features are computed afterwards in one pass
+            raw = []
             for ts in dates:
                 date = datetime.utcfromtimestamp(ts/1000)
-                year = date.year
-                month = date.month
-                day_of_year = date.timetuple().tm_yday
-                # Season
-                if month in [12,1,2]:
-                    season = 'winter'
-                elif month in [3,4,5]:
-                    season = 'spring'
-                elif month in [6,7,8]:
-                    season = 'summer'
-                else:
-                    season = 'autumn'
                 # Get NDVI/EVI
                 img = modis.filterDate(date.strftime('%Y-%m-%d'), (date+timedelta(days=16)).strftime('%Y-%m-%d')).first()
-                ndvi = img.reduceRegion(ee.Reducer.mean(), parcel_geom, 250).get('NDVI').getInfo()
-                evi = img.reduceRegion(ee.Reducer.mean(), parcel_geom, 250).get('EVI').getInfo()
+                vi = img.reduceRegion(ee.Reducer.mean(), parcel_geom, 250).getInfo()
                 # Get LST
                 img_lst = lst.filterDate(date.strftime('%Y-%m-%d'), (date+timedelta(days=8)).strftime('%Y-%m-%d')).first()
-                lst_day = img_lst.reduceRegion(ee.Reducer.mean(), parcel_geom, 1000).get('LST_Day_1km').getInfo()
-                lst_night = img_lst.reduceRegion(ee.Reducer.mean(), parcel_geom, 1000).get('LST_Night_1km').getInfo()
-                # Precipitation sums
-                def sum_precip(days):
-                    precip_imgs = chirps.filterDate((date-timedelta(days=days)).strftime('%Y-%m-%d'), date.strftime('%Y-%m-%d'))
-                    return precip_imgs.reduce(ee.Reducer.sum()).reduceRegion(ee.Reducer.mean(), parcel_geom, 5000).get('precipitation').getInfo()
-                precip_7d = sum_precip(7)
-                precip_15d = sum_precip(15)
-                precip_30d = sum_precip(30)
-                precip_60d = sum_precip(60)
-                precip_90d = sum_precip(90)
-                # LST stats
-                lst_range = None
-                lst_mean = None
-                if lst_day is not None and lst_night is not None:
-                    lst_range = lst_day - lst_night
-                    lst_mean = (lst_day + lst_night) / 2
-                # NDVI/EVI ratio
-                ndvi_evi_ratio = None
-                if ndvi is not None and evi is not None and evi != 0:
-                    ndvi_evi_ratio = ndvi / evi
-                # NDVI change
-                ndvi_change = None
-                if prev_ndvi is not None and ndvi is not None:
-                    ndvi_change = ndvi - prev_ndvi
-                prev_ndvi = ndvi
-                # NDVI rolling mean 30d
-                ndvi_rolling.append(ndvi if ndvi is not None else 0)
-                if len(ndvi_rolling) > 2:
-                    ndvi_rolling_mean_30d = np.mean(ndvi_rolling[-2:])
-                else:
-                    ndvi_rolling_mean_30d = ndvi
+                lst_stats = img_lst.reduceRegion(ee.Reducer.mean(), parcel_geom, 1000).getInfo()
                 # ET
                 img_et = et.filterDate(date.strftime('%Y-%m-%d'), (date+timedelta(days=8)).strftime('%Y-%m-%d')).first()
                 et_estimate = img_et.reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo() if img_et else None
-                # Water balance = precip - ET
-                def water_balance(days):
-                    precip = sum_precip(days)
-                    et_imgs = et.filterDate((date-timedelta(days=days)).strftime('%Y-%m-%d'), date.strftime('%Y-%m-%d'))
-                    et_sum = et_imgs.reduce(ee.Reducer.sum()).reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo()
-                    if precip is not None and et_sum is not None:
-                        return precip - et_sum
-                    return None
-                water_balance_7d = water_balance(7)
-                water_balance_15d = water_balance(15)
-                water_balance_30d = water_balance(30)
-                water_balance_60d = water_balance(60)
-                water_balance_90d = water_balance(90)
-                # Thermal stress (simple: LST_day > 305K)
-                thermal_stress = lst_day > 305 if lst_day is not None else None
-                results.append({
-                    "date": date.strftime('%Y-%m-%d'),
-                    "timestamp": ts,
-                    "NDVI": ndvi,
-                    "EVI": evi,
-                    "LST_day": lst_day,
-                    "LST_night": lst_night,
-                    "precip_7d": precip_7d,
-                    "precip_15d": precip_15d,
-                    "precip_30d": precip_30d,
-                    "precip_60d": precip_60d,
-                    "precip_90d": precip_90d,
-                    "LST_range": lst_range,
-                    "LST_mean": lst_mean,
-                    "NDVI_EVI_ratio": ndvi_evi_ratio,
-                    "year": year,
-                    "month": month,
-                    "day_of_year": day_of_year,
-                    "season": season,
-                    "thermal_stress": thermal_stress,
-                    "NDVI_change": ndvi_change,
-                    "NDVI_rolling_mean_30d": ndvi_rolling_mean_30d,
+                row = {
+                    "date": date,
+                    "NDVI": vi.get('NDVI'),
+                    "EVI": vi.get('EVI'),
+                    "LST_day": lst_stats.get('LST_Day_1km'),
+                    "LST_night": lst_stats.get('LST_Night_1km'),
                     "ET_estimate": et_estimate,
-                    "water_balance_7d": water_balance_7d,
-                    "water_balance_15d": water_balance_15d,
-                    "water_balance_30d": water_balance_30d,
-                    "water_balance_60d": water_balance_60d,
-                    "water_balance_90d": water_balance_90d
-                })
-            return {"history": results}
+                }
+                # Precipitation and ET sums per window (water balance is derived from both)
+                for days in WINDOWS:
+                    window_start = (date-timedelta(days=days)).strftime('%Y-%m-%d')
+                    precip_imgs = chirps.filterDate(window_start, date.strftime('%Y-%m-%d'))
+                    et_imgs = et.filterDate(window_start, date.strftime('%Y-%m-%d'))
+                    row[f"precip_{days}d"] = precip_imgs.reduce(ee.Reducer.sum()) \
+                        .reduceRegion(ee.Reducer.mean(), parcel_geom, 5000).get('precipitation').getInfo()
+                    row[f"et_{days}d"] = et_imgs.reduce(ee.Reducer.sum()) \
+                        .reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo()
+                raw.append(row)
+            history = compact_history(derive_features(pd.DataFrame(raw, columns=RAW_COLUMNS), group_col=None))
+            if parcel_id is not None:
+                feature_store.append(parcel_id, history)
+            return {"history": history}
         except Exception as e:
             logger.error(f"Error getting history for parcel: {e}")
             return {"error": str(e)}
     
-    async def get_current_parcel_data(self, coordinates: List[List[float]]) -> Dict:
+    async def get_current_parcel_data(self, coordinates: List[List[float]],
+                                      geometry_hash: Optional[str] = None) -> Dict:
         """
         Get current (latest available) data for a specific parcel
         Args:
             coordinates: List of coordinates defining the parcel polygon
+            geometry_hash: Canonical hash when coordinates are already canonical (registered parcels)
         Returns:
             Dict with fields:
             NDVI, EVI, NDVI_EVI_ratio, LST_day, LST_night, LST_range, LST_mean, thermal_stress,
             precip_7d, precip_15d, precip_30d, precip_60d, precip_90d, NDVI_change, NDVI_rolling_mean_30d,
-            ET_estimate, water_balance_7d, water_balance_15d, water_balance_30d, water_balance_60d, water_balance_90d
+            ET_estimate, water_balance_7d, water_balance_15d, water_balance_30d, water_balance_60d, water_balance_90d,
+            year, month, day_of_year (of the latest MODIS composite)
+            Cached for GEE_CURRENT_DATA_TTL_SECONDS per canonical geometry (see prepare_polygon)
         """
         try:
             if not self.initialized:
                 raise Exception("Google Earth Engine not initialized")
-            parcel_geom = ee.Geometry.Polygon(coordinates)
+            if geometry_hash is not None:
+                prepared = {"coordinates": coordinates, "hash": geometry_hash}
+            else:
+                prepared = prepare_polygon(coordinates)
+            cached = self._current_cache.get(prepared["hash"])
+            if cached is not None and cached[0] > datetime.utcnow():
+                return dict(cached[1])
+            parcel_geom = ee.Geometry.Polygon(prepared["coordinates"])
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=90)
             # MODIS Vegetation Indices
@@ -785,84 +742,62 @@ class GEEService:
                 .filterDate(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
                 .filterBounds(parcel_geom) \
                 .select(['NDVI', 'EVI'])
-            latest_img = modis.sort('system:time_start', False).first()
-            ndvi = latest_img.reduceRegion(ee.Reducer.mean(), parcel_geom, 250).get('NDVI').getInfo()
-            evi = latest_img.reduceRegion(ee.Reducer.mean(), parcel_geom, 250).get('EVI').getInfo()
-            ndvi_evi_ratio = ndvi / evi if ndvi is not None and evi is not None and evi != 0 else None
+            # NDVI/EVI for every composite in the window: change and 30-day mean need the recent series
+            def _vi_feature(img):
+                stats = img.reduceRegion(ee.Reducer.mean(), parcel_geom, 250)
+                return ee.Feature(None, stats).set('system:time_start', img.get('system:time_start'))
+            vi_series = ee.FeatureCollection(modis.map(_vi_feature)).getInfo()['features']
+            raw = pd.DataFrame([
+                {
+                    "date": datetime.utcfromtimestamp(f['properties']['system:time_start']/1000),
+                    "NDVI": f['properties'].get('NDVI'),
+                    "EVI": f['properties'].get('EVI'),
+                }
+                for f in vi_series
+            ], columns=['date', 'NDVI', 'EVI'])
+            if raw.empty:
+                raise Exception("No MODIS composites available for the last 90 days")
             # LST
             lst = ee.ImageCollection("MODIS/061/MOD11A2") \
                 .filterDate(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
                 .filterBounds(parcel_geom) \
                 .select(['LST_Day_1km', 'LST_Night_1km'])
             latest_lst = lst.sort('system:time_start', False).first()
-            lst_day = latest_lst.reduceRegion(ee.Reducer.mean(), parcel_geom, 1000).get('LST_Day_1km').getInfo()
-            lst_night = latest_lst.reduceRegion(ee.Reducer.mean(), parcel_geom, 1000).get('LST_Night_1km').getInfo()
-            lst_range = lst_day - lst_night if lst_day is not None and lst_night is not None else None
-            lst_mean = (lst_day + lst_night) / 2 if lst_day is not None and lst_night is not None else None
-            thermal_stress = lst_day > 305 if lst_day is not None else None
+            lst_stats = latest_lst.reduceRegion(ee.Reducer.mean(), parcel_geom, 1000).getInfo()
             # Precipitación
             chirps = ee.ImageCollection("UCSB-CHG/CHIRPS/DAILY") \
                 .filterDate((end_date-timedelta(days=90)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
                 .filterBounds(parcel_geom) \
                 .select(['precipitation'])
-            def sum_precip(days):
-                precip_imgs = chirps.filterDate((end_date-timedelta(days=days)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-                return precip_imgs.reduce(ee.Reducer.sum()).reduceRegion(ee.Reducer.mean(), parcel_geom, 5000).get('precipitation').getInfo()
-            precip_7d = sum_precip(7)
-            precip_15d = sum_precip(15)
-            precip_30d = sum_precip(30)
-            precip_60d = sum_precip(60)
-            precip_90d = sum_precip(90)
-            # NDVI rolling mean 30d y cambio
-            ndvi_imgs = modis.sort('system:time_start', False).limit(2)
-            ndvi_list = ndvi_imgs.aggregate_array('NDVI').getInfo()
-            ndvi_change = None
-            if len(ndvi_list) == 2 and ndvi_list[0] is not None and ndvi_list[1] is not None:
-                ndvi_change = ndvi_list[0] - ndvi_list[1]
-            ndvi_rolling_mean_30d = np.mean(ndvi_list) if ndvi_list else None
             # ET
             et = ee.ImageCollection("MODIS/061/MOD16A2") \
-                .filterDate((end_date-timedelta(days=30)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
+                .filterDate((end_date-timedelta(days=90)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
                 .filterBounds(parcel_geom) \
                 .select(['ET'])
             latest_et = et.sort('system:time_start', False).first()
-            et_estimate = latest_et.reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo() if latest_et else None
-            # Water balance
-            def water_balance(days):
-                precip = sum_precip(days)
-                et_imgs = et.filterDate((end_date-timedelta(days=days)).strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-                et_sum = et_imgs.reduce(ee.Reducer.sum()).reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo()
-                if precip is not None and et_sum is not None:
-                    return precip - et_sum
-                return None
-            water_balance_7d = water_balance(7)
-            water_balance_15d = water_balance(15)
-            water_balance_30d = water_balance(30)
-            water_balance_60d = water_balance(60)
-            water_balance_90d = water_balance(90)
-            return {
-                "NDVI": ndvi,
-                "EVI": evi,
-                "NDVI_EVI_ratio": ndvi_evi_ratio,
-                "LST_day": lst_day,
-                "LST_night": lst_night,
-                "LST_range": lst_range,
-                "LST_mean": lst_mean,
-                "thermal_stress": thermal_stress,
-                "precip_7d": precip_7d,
-                "precip_15d": precip_15d,
-                "precip_30d": precip_30d,
-                "precip_60d": precip_60d,
-                "precip_90d": precip_90d,
-                "NDVI_change": ndvi_change,
-                "NDVI_rolling_mean_30d": ndvi_rolling_mean_30d,
-                "ET_estimate": et_estimate,
-                "water_balance_7d": water_balance_7d,
-                "water_balance_15d": water_balance_15d,
-                "water_balance_30d": water_balance_30d,
-                "water_balance_60d": water_balance_60d,
-                "water_balance_90d": water_balance_90d
+            latest = {
+                "LST_day": lst_stats.get('LST_Day_1km'),
+                "LST_night": lst_stats.get('LST_Night_1km'),
+                "ET_estimate": latest_et.reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo() if latest_et else None,
             }
+            for days in WINDOWS:
+                window_start = (end_date-timedelta(days=days)).strftime('%Y-%m-%d')
+                latest[f"precip_{days}d"] = chirps.filterDate(window_start, end_date.strftime('%Y-%m-%d')) \
+                    .reduce(ee.Reducer.sum()).reduceRegion(ee.Reducer.mean(), parcel_geom, 5000).get('precipitation').getInfo()
+                latest[f"et_{days}d"] = et.filterDate(window_start, end_date.strftime('%Y-%m-%d')) \
+                    .reduce(ee.Reducer.sum()).reduceRegion(ee.Reducer.mean(), parcel_geom, 500).get('ET').getInfo()
+            # Latest-only raw values go on the most recent composite row
+            raw = raw.sort_values('date').reset_index(drop=True)
+            for col, value in latest.items():
+                raw[col] = None
+                raw.at[len(raw) - 1, col] = value
+            current = latest_features(raw)
+            # Composites are 8-16 days apart, so the same parcel can be served from cache for a while
+            self._current_cache = {k: v for k, v in self._current_cache.items() if v[0] > end_date}
+            self._current_cache[prepared["hash"]] = (
+                end_date + timedelta(seconds=settings.GEE_CURRENT_DATA_TTL_SECONDS), current
+            )
+            return dict(current)
         except Exception as e:
             logger.error(f"Error getting current data for parcel: {e}")
             return {"error": str(e)}
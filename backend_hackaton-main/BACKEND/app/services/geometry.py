@@ -0,0 +1,404 @@
+"""
+Parcel geometry helpers
+Validation, canonicalization and simplification of [lon, lat] polygons
+before they reach Earth Engine, plus area, bounding box, centroid and
+MODIS native-grid cell membership computed on the sinusoidal grid MODIS
+products use, and geohash keys for indexing extents in plain B-trees
+"""
+
+import hashlib
+import json
+import logging
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# MODIS sinusoidal projection (equal-area, so planar areas are true areas)
+EARTH_RADIUS_M = 6371007.181
+SINUSOIDAL_X_MIN = -20015109.354
+SINUSOIDAL_Y_MAX = 10007554.677
+MODIS_TILE_SIZE_M = 1111950.5197665
+# MOD13Q1 (250 m product): 4800 x 4800 pixels per 10° tile
+MODIS_250M_PIXELS_PER_TILE = 4800
+MODIS_250M_PIXEL_M = MODIS_TILE_SIZE_M / MODIS_250M_PIXELS_PER_TILE
+
+# Native scale of MOD13Q1, the finest product reduced over parcels
+MOD13Q1_SCALE_M = 250
+# Douglas-Peucker tolerance as a fraction of the native scale, and the area
+# change above which the tolerance is halved (small parcels keep their shape)
+SIMPLIFY_FRACTION = 0.125
+MAX_AREA_CHANGE = 0.02
+# Decimal places kept in canonical coordinates (~0.1 m)
+COORDINATE_DECIMALS = 6
+# Largest hand-drawn ring accepted, and the edges tested per block in is_simple
+# (keeps the pairwise crossing test at a few MB instead of n x n)
+MAX_VERTICES = 2000
+EDGE_BLOCK = 256
+
+# Geohash keys of stored extents (12 characters ~ 4 cm) and the cell budget of a query
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_MAX_PRECISION = 12
+GEOHASH_MAX_QUERY_CELLS = 32
+
+Coordinates = Sequence[Sequence[float]]
+
+logger = logging.getLogger(__name__)
+
+
+def open_ring(coordinates: Coordinates) -> np.ndarray:
+    """Vertices as an (n, 2) float array without the repeated closing point"""
+    ring = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+    return ring
+
+
+def to_sinusoidal(lon: np.ndarray, lat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Project degrees to MODIS sinusoidal metres"""
+    lat_r = np.radians(lat)
+    return EARTH_RADIUS_M * np.radians(lon) * np.cos(lat_r), EARTH_RADIUS_M * lat_r
+
+
+def _shoelace(x: np.ndarray, y: np.ndarray) -> float:
+    """Signed planar area (positive for counter-clockwise rings)"""
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def polygon_area_m2(coordinates: Coordinates) -> float:
+    """Area of a [lon, lat] polygon in square metres"""
+    ring = open_ring(coordinates)
+    x, y = to_sinusoidal(ring[:, 0], ring[:, 1])
+    return abs(_shoelace(x, y))
+
+
+def bounding_box(coordinates: Coordinates) -> List[float]:
+    """[min_lon, min_lat, max_lon, max_lat]"""
+    ring = open_ring(coordinates)
+    return [float(ring[:, 0].min()), float(ring[:, 1].min()), float(ring[:, 0].max()), float(ring[:, 1].max())]
+
+
+def centroid(coordinates: Coordinates) -> List[float]:
+    """Area-weighted centroid [lon, lat] (vertex mean for degenerate rings)"""
+    ring = open_ring(coordinates)
+    x, y = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x, -1), np.roll(y, -1)
+    cross = x * y1 - x1 * y
+    area = cross.sum() / 2
+    if abs(area) < 1e-15:
+        return [float(x.mean()), float(y.mean())]
+    return [float(((x + x1) * cross).sum() / (6 * area)), float(((y + y1) * cross).sum() / (6 * area))]
+
+
+def points_in_polygon(px: np.ndarray, py: np.ndarray, ring_x: np.ndarray, ring_y: np.ndarray) -> np.ndarray:
+    """Even-odd rule for many points at once (vectorized over the points, looped over the edges)"""
+    inside = np.zeros(px.shape, dtype=bool)
+    for x0, y0, x1, y1 in zip(ring_x, ring_y, np.roll(ring_x, -1), np.roll(ring_y, -1)):
+        crosses = (y0 > py) != (y1 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_at = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (px < x_at)
+    return inside
+
+
+def _convex_hull(points: np.ndarray) -> np.ndarray:
+    """Monotone chain hull, counter-clockwise"""
+    pts = sorted(map(tuple, points))
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def is_simple(ring: np.ndarray, block: int = EDGE_BLOCK) -> bool:
+    """True if no two non-adjacent edges of the (open) ring intersect (tested block x n at a time)"""
+    n = len(ring)
+    if n < 4:
+        return True
+    ends = np.roll(ring, -1, axis=0)
+    j = np.arange(n)[None, :]
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        crossing = _segments_cross(ring[start:stop], ends[start:stop], ring, ends)
+        gap = np.abs(np.arange(start, stop)[:, None] - j)
+        if np.any(crossing & (gap > 1) & (gap != n - 1)):
+            return False
+    return True
+
+
+def _segments_cross(a0: np.ndarray, a1: np.ndarray, b0: np.ndarray, b1: np.ndarray) -> np.ndarray:
+    """(n, m) matrix: whether segment i of the first set properly crosses segment j of the second"""
+    ax, ay = a0[:, 0][:, None], a0[:, 1][:, None]
+    bx, by = a1[:, 0][:, None], a1[:, 1][:, None]
+    cx, cy = b0[:, 0][None, :], b0[:, 1][None, :]
+    dx, dy = b1[:, 0][None, :], b1[:, 1][None, :]
+    d1 = np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+    d2 = np.sign((bx - ax) * (dy - ay) - (by - ay) * (dx - ax))
+    d3 = np.sign((dx - cx) * (ay - cy) - (dy - cy) * (ax - cx))
+    d4 = np.sign((dx - cx) * (by - cy) - (dy - cy) * (bx - cx))
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+def bbox_ring(bbox: Sequence[float]) -> np.ndarray:
+    """Counter-clockwise ring of a [min_lon, min_lat, max_lon, max_lat] box"""
+    x0, y0, x1, y1 = bbox
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float64)
+
+
+def polygon_intersects_bbox(coordinates: Coordinates, bbox: Sequence[float]) -> bool:
+    """Exact test of a [lon, lat] polygon against a bounding box (touching counts)"""
+    ring = open_ring(coordinates)
+    x0, y0, x1, y1 = bbox
+    if np.any((ring[:, 0] >= x0) & (ring[:, 0] <= x1) & (ring[:, 1] >= y0) & (ring[:, 1] <= y1)):
+        return True
+    box = bbox_ring(bbox)
+    if np.any(points_in_polygon(box[:, 0], box[:, 1], ring[:, 0], ring[:, 1])):
+        return True
+    return bool(np.any(_segments_cross(ring, np.roll(ring, -1, axis=0), box, np.roll(box, -1, axis=0))))
+
+
+def _douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """Indices kept by Douglas-Peucker on an open chain (iterative)"""
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        sx, sy = x[end] - x[start], y[end] - y[start]
+        seg = math.hypot(sx, sy)
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        if seg == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(sx * py - sy * px) / seg
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            mid = start + 1 + k
+            keep[mid] = True
+            stack.extend([(start, mid), (mid, end)])
+    return np.flatnonzero(keep)
+
+
+def simplify_ring(ring: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker on a closed ring in sinusoidal metres
+
+    The ring is split at its first vertex and the vertex farthest from it so
+    both anchors survive; the result keeps at least a triangle.
+    """
+    x, y = to_sinusoidal(ring[:, 0], ring[:, 1])
+    far = int(np.argmax(np.hypot(x - x[0], y - y[0])))
+    first = _douglas_peucker(x[:far + 1], y[:far + 1], tolerance_m)
+    cx, cy = np.append(x[far:], x[0]), np.append(y[far:], y[0])
+    second = _douglas_peucker(cx, cy, tolerance_m)[1:-1] + far
+    keep = np.concatenate([first, second])
+    return ring[keep] if len(keep) >= 3 else ring
+
+
+def canonical_hash(ring: np.ndarray) -> str:
+    """SHA-1 of a canonical ring (fixed precision, start vertex and orientation)"""
+    payload = json.dumps(np.round(ring, COORDINATE_DECIMALS).tolist(), separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def prepare_polygon(coordinates: Coordinates, scale_m: float = MOD13Q1_SCALE_M) -> Dict:
+    """
+    Validate, repair, orient, simplify and canonicalize a hand-drawn polygon
+
+    Steps: coordinate range checks; rounding to COORDINATE_DECIMALS; repeated
+    vertices removed; self-intersecting rings replaced by their convex hull;
+    counter-clockwise orientation starting at the smallest (lon, lat) vertex;
+    Douglas-Peucker with a tolerance of SIMPLIFY_FRACTION * scale_m (halved
+    while the area changes by more than MAX_AREA_CHANGE). The same shape drawn
+    with a different start vertex, winding or redundant vertices yields the same hash.
+
+    Args:
+        coordinates: Polygon ring [[lon, lat], ...] (closed or open)
+        scale_m: Native scale of the product the polygon will be reduced over
+
+    Returns:
+        Dict with the canonical open ring ("coordinates"), "hash", vertex counts
+        and whether the ring had to be repaired
+
+    Raises:
+        ValueError: If the polygon cannot be turned into a valid ring or has more than MAX_VERTICES vertices
+    """
+    try:
+        points = np.asarray(coordinates, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("Cada punto debe tener formato [lon, lat]")
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError("Cada punto debe tener formato [lon, lat]")
+    ring = open_ring(points)
+    vertices_in = len(ring)
+    if vertices_in > MAX_VERTICES:
+        raise ValueError(f"El polígono tiene demasiados vértices ({vertices_in}); máximo {MAX_VERTICES}")
+    if not np.all(np.isfinite(ring)):
+        raise ValueError("Las coordenadas deben ser números finitos")
+    if np.any(np.abs(ring[:, 0]) > 180) or np.any(np.abs(ring[:, 1]) > 90):
+        raise ValueError("Coordenadas fuera de rango: se esperan puntos [lon, lat] en grados")
+
+    ring = np.round(ring, COORDINATE_DECIMALS)
+    # Consecutive duplicates (double clicks) and the wrap-around duplicate
+    ring = ring[np.any(ring != np.roll(ring, 1, axis=0), axis=1)] if len(ring) > 1 else ring
+    if len(np.unique(ring, axis=0)) < 3:
+        raise ValueError("Se requieren al menos 3 puntos distintos para formar un polígono")
+
+    repaired = False
+    if not is_simple(ring):
+        ring = _convex_hull(ring)
+        repaired = True
+        logger.info("Self-intersecting polygon replaced by its convex hull")
+    area = polygon_area_m2(ring)
+    if area < 1.0 or len(ring) < 3:
+        raise ValueError("El polígono no tiene área")
+
+    # Orient and pick the start vertex first, so simplification (anchored at
+    # the start vertex) is the same however the ring was drawn
+    x, y = to_sinusoidal(ring[:, 0], ring[:, 1])
+    if _shoelace(x, y) < 0:
+        ring = ring[::-1]
+    start = np.lexsort((ring[:, 1], ring[:, 0]))[0]
+    ring = np.roll(ring, -start, axis=0)
+
+    tolerance = SIMPLIFY_FRACTION * scale_m
+    simplified = simplify_ring(ring, tolerance)
+    while abs(polygon_area_m2(simplified) - area) > MAX_AREA_CHANGE * area and tolerance > 0.01:
+        tolerance /= 2
+        simplified = simplify_ring(ring, tolerance)
+    if is_simple(simplified):
+        ring = simplified
+    return {
+        "coordinates": ring.tolist(),
+        "hash": canonical_hash(ring),
+        "vertices_in": vertices_in,
+        "vertices_out": len(ring),
+        "repaired": repaired,
+    }
+
+
+def modis_cells(coordinates: Coordinates, pixel_m: float = MODIS_250M_PIXEL_M) -> List[List[int]]:
+    """
+    Global (row, col) indices of the MODIS grid cells whose centre lies inside the polygon
+
+    Parcels smaller than a cell get the cell containing their centroid, so every
+    parcel maps to at least one native pixel.
+    """
+    ring = open_ring(coordinates)
+    x, y = to_sinusoidal(ring[:, 0], ring[:, 1])
+    col_min = math.floor((x.min() - SINUSOIDAL_X_MIN) / pixel_m)
+    col_max = math.floor((x.max() - SINUSOIDAL_X_MIN) / pixel_m)
+    row_min = math.floor((SINUSOIDAL_Y_MAX - y.max()) / pixel_m)
+    row_max = math.floor((SINUSOIDAL_Y_MAX - y.min()) / pixel_m)
+    rows, cols = np.mgrid[row_min:row_max + 1, col_min:col_max + 1]
+    cx = SINUSOIDAL_X_MIN + (cols + 0.5) * pixel_m
+    cy = SINUSOIDAL_Y_MAX - (rows + 0.5) * pixel_m
+    inside = points_in_polygon(cx.ravel(), cy.ravel(), x, y)
+    cells = np.column_stack([rows.ravel()[inside], cols.ravel()[inside]])
+    if len(cells) == 0:
+        lon, lat = centroid(coordinates)
+        x0, y0 = to_sinusoidal(np.array([lon]), np.array([lat]))
+        cells = np.array([[math.floor((SINUSOIDAL_Y_MAX - y0[0]) / pixel_m),
+                           math.floor((x0[0] - SINUSOIDAL_X_MIN) / pixel_m)]])
+    return cells.astype(int).tolist()
+
+
+def modis_tile(cell: Sequence[int], pixels_per_tile: int = MODIS_250M_PIXELS_PER_TILE) -> str:
+    """MODIS tile name (e.g. 'h17v04') of a global (row, col) cell"""
+    return f"h{cell[1] // pixels_per_tile:02d}v{cell[0] // pixels_per_tile:02d}"
+
+
+def describe(coordinates: Coordinates, prepared: Optional[Dict] = None) -> Dict:
+    """
+    Canonical geometry (see prepare_polygon) and the metadata stored with a parcel;
+    `prepared` is the prepare_polygon result when the caller already has it
+    """
+    prepared = prepared if prepared is not None else prepare_polygon(coordinates)
+    coordinates = prepared["coordinates"]
+    cells = modis_cells(coordinates)
+    return {
+        "coordinates": coordinates,
+        "geometry_hash": prepared["hash"],
+        "area_hectares": polygon_area_m2(coordinates) / 10_000,
+        "bbox": bounding_box(coordinates),
+        "centroid": centroid(coordinates),
+        "modis_cells": cells,
+        "modis_tiles": sorted({modis_tile(c) for c in cells}),
+    }
+
+
+def _geohash_bits(precision: int) -> Tuple[int, int]:
+    """Longitude and latitude bits of a geohash (longitude takes the odd extra bit)"""
+    return (5 * precision + 1) // 2, 5 * precision // 2
+
+
+def _geohash_cell_index(lon: float, lat: float, precision: int) -> Tuple[int, int]:
+    lon_bits, lat_bits = _geohash_bits(precision)
+    ix = min(int((lon + 180) / 360 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    iy = min(int((lat + 90) / 180 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    return max(ix, 0), max(iy, 0)
+
+
+def _geohash_from_index(ix: int, iy: int, precision: int) -> str:
+    lon_bits, lat_bits = _geohash_bits(precision)
+    value = 0
+    # Bits interleave starting with the most significant longitude bit
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            lon_bits -= 1
+            value = (value << 1) | ((ix >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((iy >> lat_bits) & 1)
+    return "".join(GEOHASH_BASE32[(value >> (5 * (precision - 1 - i))) & 31] for i in range(precision))
+
+
+def geohash_encode(lon: float, lat: float, precision: int = GEOHASH_MAX_PRECISION) -> str:
+    return _geohash_from_index(*_geohash_cell_index(lon, lat, precision), precision)
+
+
+def geohash_of_bbox(bbox: Sequence[float], max_precision: int = GEOHASH_MAX_PRECISION) -> str:
+    """Smallest geohash cell containing the whole [min_lon, min_lat, max_lon, max_lat] box ('' = the world)"""
+    low = geohash_encode(bbox[0], bbox[1], max_precision)
+    high = geohash_encode(bbox[2], bbox[3], max_precision)
+    n = 0
+    while n < max_precision and low[n] == high[n]:
+        n += 1
+    return low[:n]
+
+
+def geohash_cover(bbox: Sequence[float], max_cells: int = GEOHASH_MAX_QUERY_CELLS) -> List[str]:
+    """Cells of the finest precision for which at most max_cells cover the box"""
+    for precision in range(GEOHASH_MAX_PRECISION, 0, -1):
+        x0, y0 = _geohash_cell_index(bbox[0], bbox[1], precision)
+        x1, y1 = _geohash_cell_index(bbox[2], bbox[3], precision)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_cells:
+            return [_geohash_from_index(ix, iy, precision)
+                    for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1)]
+    return [""]
+
+
+def geohash_query_keys(bbox: Sequence[float], max_cells: int = GEOHASH_MAX_QUERY_CELLS) -> Tuple[List[str], List[str]]:
+    """
+    Geohash keys of the stored extents that may intersect a box
+
+    An extent stored under key k intersects the box only if k is a prefix of
+    one of the covering cells (a larger cell) or starts with one of them (a
+    smaller cell inside). Returns (exact keys, prefixes for range scans); the
+    candidates still have to be refined against their bounding box.
+    """
+    cover = geohash_cover(bbox, max_cells)
+    exact = sorted({cell[:n] for cell in cover for n in range(len(cell) + 1)})
+    return exact, sorted(cover)
@@ -0,0 +1,240 @@
+"""
+Modelo global de floración con embeddings de parcela.
+Un único modelo residente sirve a todas las parcelas en lugar de un .keras por parcela.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import PowerTransformer, RobustScaler
+from tensorflow import keras
+
+from app.services.feature_engineering import derive_features
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import (
+    COLS_X, CYCLIC, HIPERPARAMETROS_BASE, _callbacks, _transformar_X, preparar_con_fechas_reales,
+    resumir_incertidumbre
+)
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_MODEL_DIR = 'app/datamodels/global'
+
+# Índice 0 del embedding: parcela desconocida (fallback para parcelas sin historial)
+UNKNOWN_PARCEL = 0
+
+
+def build_global_model(nf: int, n_parcels: int, embedding_dim: int = 8, lr: float = 5e-4,
+                       units: Tuple[int, ...] = (128, 64), dropout: float = 0.3, l2: float = 1e-3) -> keras.Model:
+    """MLP que concatena las features con un embedding aprendido de la parcela."""
+    x_in = keras.layers.Input(shape=(nf,), name="features")
+    p_in = keras.layers.Input(shape=(1,), dtype="int32", name="parcel")
+    emb = keras.layers.Embedding(n_parcels + 1, embedding_dim, name="parcel_embedding")(p_in)
+    h = keras.layers.Concatenate()([x_in, keras.layers.Flatten()(emb)])
+    for n in units:
+        h = keras.layers.Dense(n, activation='relu', kernel_regularizer=keras.regularizers.l2(l2))(h)
+        h = keras.layers.Dropout(dropout)(h)
+    out = keras.layers.Dense(1, activation='linear')(h)
+    m = keras.Model([x_in, p_in], out)
+    m.compile(optimizer=keras.optimizers.Adam(lr), loss='mse', metrics=['mae'])
+    return m
+
+
+def entrenar_modelo_global(
+    path_fechas: str = "fechas_floracion.csv",
+    parcel_ids: Optional[List[int]] = None,
+    years: Optional[Tuple[int, int]] = None,
+    embedding_dim: int = 8,
+    unknown_rate: float = 0.1,
+    seed: int = 42,
+    epochs: int = 200,
+    batch_size: int = 64,
+    output_dir: str = GLOBAL_MODEL_DIR,
+) -> Dict:
+    """
+    Entrena un modelo único para todas las parcelas del feature store.
+
+    Cada parcela recibe un índice de embedding; una fracción `unknown_rate` de las
+    filas de entrenamiento se asigna al índice UNKNOWN_PARCEL para que ese embedding
+    aprenda el comportamiento medio y sirva como fallback para parcelas nuevas.
+
+    Guarda modelo, transformadores y vocabulario parcel_id -> índice en output_dir.
+    Returns: dict con métricas y rutas guardadas.
+    """
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+    df_feat = feature_store.read(columns=['parcel_id', 'date'] + COLS_X, parcel_ids=parcel_ids, years=years)
+    if df_feat.empty:
+        raise ValueError("El feature store no tiene datos para las parcelas solicitadas.")
+    df_feat = derive_features(df_feat)
+    if not os.path.exists(path_fechas):
+        raise FileNotFoundError(f"No se encontró: {path_fechas}")
+    df = preparar_con_fechas_reales(df_feat, pd.read_csv(path_fechas))
+
+    X_cols = list(COLS_X)
+    vocab = {int(p): i + 1 for i, p in enumerate(sorted(df['parcel_id'].unique()))}
+
+    pt_x = PowerTransformer(method='yeo-johnson', standardize=True)
+    robust = RobustScaler()
+    cols_pt = [c for c in X_cols if c not in CYCLIC]
+    pt_x.fit(df[cols_pt])
+    pt_y = PowerTransformer(method='yeo-johnson', standardize=True)
+    Y = df['days_to_flowering'].values.reshape(-1, 1)
+    y_t = pt_y.fit_transform(Y).flatten()
+
+    X = _transformar_X(df, X_cols, pt_x, robust)
+    P = df['parcel_id'].map(vocab).values.astype('int32')
+
+    X_tr, X_te, P_tr, P_te, y_tr, y_te = train_test_split(X, P, y_t, test_size=0.2, random_state=seed, shuffle=True)
+    rng = np.random.default_rng(seed)
+    P_tr = np.where(rng.random(len(P_tr)) < unknown_rate, UNKNOWN_PARCEL, P_tr).astype('int32')
+
+    cfg = HIPERPARAMETROS_BASE
+    model = build_global_model(X.shape[1], len(vocab), embedding_dim=embedding_dim, lr=cfg["lr"],
+                               units=cfg["units"], dropout=cfg["dropout"], l2=cfg["l2"])
+    print(f"🚀 Entrenando modelo global ({len(vocab)} parcelas)...")
+    hist = model.fit([X_tr, P_tr], y_tr, validation_data=([X_te, P_te], y_te), epochs=epochs,
+                     batch_size=batch_size, callbacks=_callbacks(epochs), verbose=1)
+
+    def _mae_r2(p_eval: np.ndarray) -> Tuple[float, float]:
+        y_pred = pt_y.inverse_transform(model.predict([X_te, p_eval], verbose=0).reshape(-1, 1)).flatten()
+        y_true = pt_y.inverse_transform(y_te.reshape(-1, 1)).flatten()
+        return float(mean_absolute_error(y_true, y_pred)), float(r2_score(y_true, y_pred))
+
+    mae_days, r2 = _mae_r2(P_te)
+    mae_unknown, _ = _mae_r2(np.full_like(P_te, UNKNOWN_PARCEL))
+    print(f"R2:  {r2:.4f}")
+    print(f"MAE: {mae_days:.2f} días (parcela desconocida: {mae_unknown:.2f} días)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "model": os.path.join(output_dir, "modelo_global.keras"),
+        "pt_x": os.path.join(output_dir, "pt_x.joblib"),
+        "robust": os.path.join(output_dir, "robust_scaler.joblib"),
+        "pt_y": os.path.join(output_dir, "pt_y.joblib"),
+        "x_cols": os.path.join(output_dir, "x_cols.json"),
+        "vocab": os.path.join(output_dir, "parcel_vocab.json"),
+    }
+    model.save(paths["model"])
+    joblib.dump(pt_x, paths["pt_x"])
+    joblib.dump(robust, paths["robust"])
+    joblib.dump(pt_y, paths["pt_y"])
+    with open(paths["x_cols"], 'w', encoding="utf-8") as f:
+        json.dump(X_cols, f, ensure_ascii=False, indent=2)
+    with open(paths["vocab"], 'w', encoding="utf-8") as f:
+        json.dump({str(k): v for k, v in vocab.items()}, f, indent=2)
+    print(f"\n✅ Guardado modelo global en: {paths['model']}")
+
+    return {
+        "status": "trained global model",
+        "metrics": {"r2": r2, "mae_days": mae_days, "mae_days_unknown": mae_unknown,
+                    "epochs_run": len(hist.history['loss'])},
+        "parcels": len(vocab),
+        "paths": paths,
+    }
+
+
+class GlobalFloweringModel:
+    """Modelo global residente: se carga una vez por proceso y sirve a todas las parcelas"""
+
+    def __init__(self, model_dir: str = GLOBAL_MODEL_DIR):
+        self.model_dir = model_dir
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self.model = None
+        self.pt_x = None
+        self.robust = None
+        self.pt_y = None
+        self.x_cols: List[str] = []
+        self.vocab: Dict[int, int] = {}
+
+    @property
+    def model_path(self) -> str:
+        return os.path.join(self.model_dir, "modelo_global.keras")
+
+    def is_available(self) -> bool:
+        return os.path.exists(self.model_path)
+
+    def _ensure_loaded(self):
+        """Carga (o recarga si el archivo cambió) el modelo y sus transformadores"""
+        mtime = os.path.getmtime(self.model_path)
+        if self.model is not None and mtime == self._loaded_mtime:
+            return
+        with self._lock:
+            if self.model is not None and mtime == self._loaded_mtime:
+                return
+            self.model = keras.models.load_model(self.model_path)
+            self.pt_x = joblib.load(os.path.join(self.model_dir, "pt_x.joblib"))
+            self.robust = joblib.load(os.path.join(self.model_dir, "robust_scaler.joblib"))
+            self.pt_y = joblib.load(os.path.join(self.model_dir, "pt_y.joblib"))
+            with open(os.path.join(self.model_dir, "x_cols.json"), encoding="utf-8") as f:
+                self.x_cols = json.load(f)
+            with open(os.path.join(self.model_dir, "parcel_vocab.json"), encoding="utf-8") as f:
+                self.vocab = {int(k): v for k, v in json.load(f).items()}
+            self._loaded_mtime = mtime
+            logger.info(f"Global flowering model loaded ({len(self.vocab)} parcels)")
+
+    def knows(self, parcel_id: Optional[int]) -> bool:
+        """True si la parcela tiene embedding propio (si no, se usa el fallback)"""
+        self._ensure_loaded()
+        return parcel_id is not None and int(parcel_id) in self.vocab
+
+    def predict_batch(self, rows: List[dict], parcel_ids: Sequence[Optional[int]]) -> np.ndarray:
+        """
+        Predice días hasta floración para varias parcelas en una sola llamada al modelo.
+
+        Args:
+            rows: Un diccionario de features (COLS_X) por parcela
+            parcel_ids: Id de cada parcela; None o ids no vistos usan el embedding desconocido
+
+        Returns:
+            Array con los días hasta floración por fila
+        """
+        if not self.is_available():
+            raise FileNotFoundError(f"Global model not found: {self.model_path}")
+        if len(rows) != len(parcel_ids):
+            raise ValueError("rows y parcel_ids deben tener la misma longitud")
+        self._ensure_loaded()
+
+        X_df = pd.DataFrame(rows)
+        missing = [col for col in self.x_cols if col not in X_df.columns]
+        if missing:
+            raise ValueError(f"Faltan columnas: {missing}")
+        X = _transformar_X(X_df, self.x_cols, self.pt_x, self.robust)
+        P = np.array([self.vocab.get(int(p), UNKNOWN_PARCEL) if p is not None else UNKNOWN_PARCEL
+                      for p in parcel_ids], dtype='int32')
+        y_t = self.model.predict([X, P], batch_size=max(len(rows), 32), verbose=0)
+        return self.pt_y.inverse_transform(y_t.reshape(-1, 1)).flatten()
+
+    def predict(self, input_dict: dict, parcel_id: Optional[int] = None) -> float:
+        """Predicción para una sola parcela"""
+        return float(self.predict_batch([input_dict], [parcel_id])[0])
+
+    def predict_distribution(self, input_dict: dict, parcel_id: Optional[int] = None, samples: int = 50) -> Dict:
+        """MC-dropout: la fila se replica `samples` veces y se evalúa en un batch con dropout activo"""
+        if not self.is_available():
+            raise FileNotFoundError(f"Global model not found: {self.model_path}")
+        self._ensure_loaded()
+        X_df = pd.DataFrame([input_dict])
+        missing = [col for col in self.x_cols if col not in X_df.columns]
+        if missing:
+            raise ValueError(f"Faltan columnas: {missing}")
+        X = np.repeat(_transformar_X(X_df, self.x_cols, self.pt_x, self.robust), samples, axis=0)
+        idx = self.vocab.get(int(parcel_id), UNKNOWN_PARCEL) if parcel_id is not None else UNKNOWN_PARCEL
+        P = np.full((samples,), idx, dtype='int32')
+        y_t = np.asarray(self.model([X, P], training=True))
+        return resumir_incertidumbre(self.pt_y.inverse_transform(y_t.reshape(-1, 1)).flatten())
+
+
+# Create global instance
+global_flowering_model = GlobalFloweringModel()
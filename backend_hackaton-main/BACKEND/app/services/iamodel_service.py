@@ -4,15 +4,26 @@ import numpy as np
 from sklearn.preprocessing import PowerTransformer, RobustScaler
 import joblib # Se usa para cargar los transformadores
 import os, json
+from datetime import datetime
 import numpy as np
 import pandas as pd
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 from sklearn.preprocessing import PowerTransformer, RobustScaler
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import r2_score, mean_absolute_error
+from sklearn.model_selection import GroupKFold, KFold, train_test_split
+from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 from tensorflow import keras
 import tensorflow as tf
 import joblib
+import multiprocessing
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from app.services.feature_engineering import derive_features, flatten_history
+from app.services.feature_store import feature_store
+from app.services.model_registry import model_registry
+from app.core.config import settings
 # Rutas de los archivos
 MODEL_PATH = 'app/api/modelo_florecimiento.keras'
 PT_X_PATH = 'app/api/pt_x.save'
@@ -40,45 +51,673 @@ def _load_transformers():
     return pt_x is not None and pt_y is not None
 
 # --------------------------------------------------------------------------------
+# Caché de predicciones
 
-def predict_flowering_days(input_dict: dict,file_path:str = "app/api/modelo_florecimiento.keras") -> float:
+def model_file_version(path: str) -> str:
+    """Versión de un archivo de modelo: cambia en cuanto el archivo se reescribe."""
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+def version_servida(path: str, entry: Optional[dict] = None) -> str:
+    """Versión del modelo que atiende una predicción: la del manifiesto (si la hay) más la del archivo."""
+    archivo = model_file_version(path)
+    if entry and entry.get("version") is not None:
+        return f"v{entry['version']}-{archivo}"
+    return archivo
+
+class PredictionCache:
     """
-    Recibe un diccionario con las columnas de entrada y devuelve la predicción de días hasta la floración.
+    Caché LRU de predicciones.
+
+    Clave: (namespace del modelo, versión del modelo servido, muestras MC, hash del vector
+    COLS_X redondeado). Además, cuando la versión de un namespace cambia, la siguiente
+    consulta de ese namespace descarta todas sus entradas anteriores.
+    """
+
+    def __init__(self, max_entries: int = 2048, decimals: int = 4):
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, object]" = OrderedDict()
+        self._versions: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def feature_hash(self, input_dict: dict) -> str:
+        valores = np.array([input_dict.get(c) if input_dict.get(c) is not None else np.nan for c in COLS_X],
+                           dtype=np.float64)
+        return hashlib.sha1(np.round(valores, self.decimals).tobytes()).hexdigest()
+
+    def _key(self, namespace: str, version: str, input_dict: dict, samples: Optional[int]) -> tuple:
+        return (namespace, version, samples, self.feature_hash(input_dict))
+
+    def _check_version(self, namespace: str, version: str):
+        """Descarta las entradas del namespace si la versión del modelo cambió"""
+        if self._versions.get(namespace) != version:
+            for key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[key]
+            self._versions[namespace] = version
+
+    def get(self, namespace: str, version: str, input_dict: dict, samples: Optional[int] = None):
+        key = self._key(namespace, version, input_dict, samples)
+        with self._lock:
+            self._check_version(namespace, version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, namespace: str, version: str, input_dict: dict, value, samples: Optional[int] = None):
+        key = self._key(namespace, version, input_dict, samples)
+        with self._lock:
+            self._check_version(namespace, version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+prediction_cache = PredictionCache(max_entries=settings.PREDICTION_CACHE_SIZE)
+
+def cached_prediction(namespace: str, version: str, input_dict: dict, compute, samples: Optional[int] = None):
+    """
+    Devuelve la predicción cacheada o la calcula con compute() y la guarda.
+    version es la del modelo servido (ver version_servida) y samples el número de muestras MC, si aplica.
+    """
+    valor = prediction_cache.get(namespace, version, input_dict, samples)
+    if valor is None:
+        valor = compute()
+        prediction_cache.put(namespace, version, input_dict, valor, samples)
+    return valor
+
+# --------------------------------------------------------------------------------
+
+class _CacheArtefactos:
+    """LRU de artefactos cargados desde disco: ruta -> (versión del archivo, objeto)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, object]]" = OrderedDict()
+
+    def get(self, path: str, cargar):
+        """Devuelve el objeto de la ruta; cargar(path) solo se llama si falta o el archivo cambió."""
+        version = model_file_version(path)
+        with self._lock:
+            cargado = self._entries.get(path)
+            if cargado is not None and cargado[0] == version:
+                self._entries.move_to_end(path)
+                return cargado[1]
+        valor = cargar(path)
+        with self._lock:
+            self._entries[path] = (version, valor)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return valor
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Modelos keras y transformadores ya cargados, con el mismo límite LRU
+MAX_MODELOS_CARGADOS = 32
+_modelos_cargados = _CacheArtefactos(MAX_MODELOS_CARGADOS)
+_transformadores_por_modelo = _CacheArtefactos(MAX_MODELOS_CARGADOS)
+
+def cargar_modelo(file_path: str) -> keras.Model:
+    """
+    Devuelve el modelo keras de la ruta, cargándolo solo la primera vez o cuando el archivo
+    cambia de versión (reentrenamiento).
+    """
+    return _modelos_cargados.get(file_path, keras.models.load_model)
+
+def precargar_modelo(entry: dict) -> None:
+    """Carga por adelantado el modelo y los transformadores de una entrada del manifiesto."""
+    _load_entry_transformers(entry)
+    cargar_modelo(entry["model_path"])
+
+def _load_entry_transformers(entry: dict) -> Optional[tuple]:
+    """
+    Carga (una vez por ruta y versión del archivo) los transformadores registrados en el manifiesto.
+    Devuelve None para modelos antiguos que no tienen transformadores propios.
+    """
+    if not entry or not entry.get("pt_x_path"):
+        return None
+
+    def cargar(_path: str) -> tuple:
+        with open(entry["x_cols_path"], encoding="utf-8") as f:
+            x_cols = json.load(f)
+        return (
+            joblib.load(entry["pt_x_path"]),
+            joblib.load(entry["robust_path"]),
+            joblib.load(entry["pt_y_path"]),
+            x_cols,
+        )
+    return _transformadores_por_modelo.get(entry["pt_x_path"], cargar)
+
+def _preparar_prediccion(input_dict, file_path: str, entry: Optional[dict]) -> tuple:
     """
+    Carga modelo y transformadores y transforma la(s) fila(s) de entrada (dict o lista de dicts).
+    Devuelve (modelo, X transformada, función inversa de y -> días).
+    """
+    if entry is not None:
+        file_path = entry["model_path"]
+    propios = _load_entry_transformers(entry)
+
     # Verificar que los transformadores estén cargados
-    if not _load_transformers():
+    if propios is None and not _load_transformers():
         raise FileNotFoundError("Model transformers not found. Please train the model first.")
     
     # Verificar que el modelo existe
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Model file not found: {file_path}")
     
-    model = keras.models.load_model(file_path)
+    model = cargar_modelo(file_path)
 
+    x_cols = propios[3] if propios else COLS_X
+    # Crear DataFrame
+    X_df = pd.DataFrame([input_dict] if isinstance(input_dict, dict) else list(input_dict))
     # Verificar columnas
-    missing = [col for col in COLS_X if col not in input_dict]
+    missing = [col for col in x_cols if col not in X_df.columns]
     if missing:
         raise ValueError(f"Faltan columnas: {missing}")
-    # Crear DataFrame
-    X_df = pd.DataFrame([input_dict])[COLS_X]
+    X_df = X_df[x_cols]
     # Transformar X
-    X_trans = pt_x.transform(X_df)
-    # Predecir
-    y_pred_trans = model.predict(X_trans)
+    if propios:
+        X_trans = _transformar_X(X_df, x_cols, propios[0], propios[1])
+        transformador_y = propios[2]
+    else:
+        X_trans = pt_x.transform(X_df)
+        transformador_y = pt_y
     # Inversa de la transformación de y
-    y_pred = pt_y.inverse_transform(y_pred_trans.reshape(-1, 1)).flatten()[0]
-    return float(y_pred)
+    def inversa(y_t: np.ndarray) -> np.ndarray:
+        return transformador_y.inverse_transform(np.asarray(y_t).reshape(-1, 1)).flatten()
+    return model, np.asarray(X_trans, dtype=np.float32), inversa
 
+def predict_flowering_days(input_dict: dict,file_path:str = "app/api/modelo_florecimiento.keras",
+                           entry: Optional[dict] = None) -> float:
+    """
+    Recibe un diccionario con las columnas de entrada y devuelve la predicción de días hasta la floración.
+    Si se pasa la entrada del manifiesto (model_registry), se usan su modelo y sus transformadores.
+    """
+    def calcular() -> float:
+        model, X_trans, inversa = _preparar_prediccion(input_dict, file_path, entry)
+        # Predecir
+        y_pred_trans = model.predict(X_trans, verbose=0)
+        return float(inversa(y_pred_trans)[0])
+
+    ruta = entry["model_path"] if entry is not None else file_path
+    if not os.path.exists(ruta):
+        return calcular()
+    return cached_prediction(f"days:{ruta}", version_servida(ruta, entry), input_dict, calcular)
+
+def predict_flowering_batch(rows: List[dict], file_path: str = "app/api/modelo_florecimiento.keras",
+                            entry: Optional[dict] = None) -> np.ndarray:
+    """Predice días hasta floración para varias filas con una única llamada al modelo."""
+    model, X_trans, inversa = _preparar_prediccion(rows, file_path, entry)
+    # Llamada directa (sin el pipeline de model.predict): el batch cabe entero en memoria
+    return inversa(np.asarray(model(X_trans, training=False)))
+
+def completar_calendario(input_dict: dict, fecha: Optional[datetime] = None) -> dict:
+    """Añade year/month/day_of_year (de `fecha`, por defecto hoy) si la fila no los trae."""
+    fecha = fecha or datetime.utcnow()
+    fila = dict(input_dict)
+    fila.setdefault("year", fecha.year)
+    fila.setdefault("month", fecha.month)
+    fila.setdefault("day_of_year", fecha.timetuple().tm_yday)
+    return fila
+
+# Días entre composiciones MOD13Q1: NDVI_change es el cambio entre dos composiciones
+DIAS_COMPOSICION_NDVI = 16
+
+def construir_trayectoria(input_dict: dict, dias: int, inicio: Optional[datetime] = None,
+                          clima: str = "hold") -> pd.DataFrame:
+    """
+    Genera en una sola matriz las filas de features de los próximos `dias` días.
 
+    Las variables de calendario (year, month, day_of_year) avanzan día a día.
+    clima='hold'  -> el resto de variables se mantienen en su valor actual.
+    clima='trend' -> NDVI se proyecta linealmente con NDVI_change (por composición de 16 días),
+                     EVI conserva la relación NDVI/EVI actual y NDVI_EVI_ratio se mantiene.
+    """
+    if clima not in ("hold", "trend"):
+        raise ValueError(f"Modo de clima no soportado: {clima}")
+    inicio = inicio or datetime.utcnow()
+    fechas = pd.date_range(pd.Timestamp(inicio).normalize(), periods=dias, freq="D")
+    base = {c: input_dict.get(c) for c in COLS_X if c not in ("year", "month", "day_of_year")}
+    df = pd.DataFrame([base] * dias)
+    df["year"] = fechas.year
+    df["month"] = fechas.month
+    df["day_of_year"] = fechas.dayofyear
+
+    if clima == "trend" and input_dict.get("NDVI") is not None and input_dict.get("NDVI_change") is not None:
+        pendiente = float(input_dict["NDVI_change"]) / DIAS_COMPOSICION_NDVI
+        ndvi = np.clip(float(input_dict["NDVI"]) + pendiente * np.arange(dias), -1.0, 1.0)
+        df["NDVI"] = ndvi
+        ratio = input_dict.get("NDVI_EVI_ratio")
+        if ratio:
+            df["EVI"] = ndvi / float(ratio)
+    df.insert(0, "date", fechas)
+    return df
+
+def curva_trayectoria(df: pd.DataFrame, dias_pred: np.ndarray) -> List[Dict]:
+    """Convierte las predicciones de la trayectoria en la curva que devuelve la API."""
+    return [
+        {
+            "date": fecha.strftime("%Y-%m-%d"),
+            "days_until_bloom": round(float(d), 1),
+            "predicted_bloom_date": (fecha + pd.Timedelta(days=max(0, int(round(float(d)))))).strftime("%Y-%m-%d"),
+        }
+        for fecha, d in zip(df["date"], dias_pred)
+    ]
+
+def resumir_incertidumbre(dias: np.ndarray, nivel: float = 0.9) -> Dict:
+    """
+    Resume las muestras Monte-Carlo de días hasta floración.
+
+    confidence = 1 - (semiancho del intervalo / días previstos), con un mínimo de 7 días
+    en el denominador para que horizontes muy cortos no disparen la incertidumbre relativa.
+    """
+    dias = np.asarray(dias, dtype=np.float64).flatten()
+    alpha = (1.0 - nivel) / 2.0
+    bajo, alto = np.quantile(dias, [alpha, 1.0 - alpha])
+    media = float(np.mean(dias))
+    semiancho = (alto - bajo) / 2.0
+    confianza = float(np.clip(1.0 - semiancho / max(abs(media), 7.0), 0.0, 1.0))
+    return {
+        "mean_days": media,
+        "std_days": float(np.std(dias)),
+        "interval": [float(bajo), float(alto)],
+        "interval_level": nivel,
+        "confidence": confianza,
+        "samples": int(dias.size),
+    }
+
+def predict_flowering_distribution(input_dict: dict, file_path: str = "app/api/modelo_florecimiento.keras",
+                                   entry: Optional[dict] = None, samples: int = 50) -> Dict:
+    """
+    Incertidumbre predictiva con MC-dropout: la fila se replica `samples` veces en un
+    único batch y el modelo se evalúa con dropout activo (training=True) en una sola
+    llamada vectorizada; la dispersión de las salidas da el intervalo y la confianza.
+    """
+    def calcular() -> Dict:
+        model, X_trans, inversa = _preparar_prediccion(input_dict, file_path, entry)
+        X_rep = np.repeat(X_trans, samples, axis=0)
+        y_t = model(X_rep, training=True)
+        return resumir_incertidumbre(inversa(np.asarray(y_t)))
+
+    ruta = entry["model_path"] if entry is not None else file_path
+    if not os.path.exists(ruta):
+        return calcular()
+    return cached_prediction(f"mc:{ruta}", version_servida(ruta, entry), input_dict, calcular, samples=samples)
+
+# --------------------------------------------------------------------------------
+# Arquitectura y búsqueda de hiperparámetros
+
+# Hiperparámetros por defecto del modelo de floración
+HIPERPARAMETROS_BASE = {"lr": 5e-4, "units": (128, 64), "dropout": 0.3, "l2": 1e-3, "batch_size": 32}
+
+# Espacio de búsqueda: rangos continuos (min, max) u opciones discretas [..]
+ESPACIO_BUSQUEDA = {
+    "lr": (1e-4, 3e-3),
+    "units": [(64, 32), (128, 64), (256, 128), (128, 64, 32)],
+    "dropout": (0.1, 0.5),
+    "l2": (1e-5, 1e-2),
+    "batch_size": [16, 32, 64],
+}
+
+def build_model(nf: int, lr: float = 5e-4, units: Tuple[int, ...] = (128, 64),
+                dropout: float = 0.3, l2: float = 1e-3) -> keras.Model:
+    """MLP de regresión: capas Dense+Dropout con regularización L2 y salida lineal."""
+    capas = [keras.layers.Input(shape=(nf,))]
+    for n in units:
+        capas.append(keras.layers.Dense(n, activation='relu', kernel_regularizer=keras.regularizers.l2(l2)))
+        capas.append(keras.layers.Dropout(dropout))
+    capas.append(keras.layers.Dense(1, activation='linear'))
+    m = keras.Sequential(capas)
+    m.compile(optimizer=keras.optimizers.Adam(lr), loss='mse', metrics=['mae'])
+    return m
+
+def _callbacks(epochs: int) -> list:
+    """EarlyStopping + ReduceLROnPlateau con paciencia acotada por el presupuesto de épocas."""
+    paciencia = min(15, max(3, epochs // 5))
+    return [
+        keras.callbacks.EarlyStopping(monitor='val_loss', patience=paciencia, restore_best_weights=True),
+        keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=max(2, paciencia // 3), min_lr=1e-6)
+    ]
+
+def _muestrear_config(rng: np.random.Generator) -> Dict:
+    """Muestrea una configuración aleatoria de ESPACIO_BUSQUEDA (lr y l2 en escala log)."""
+    config = {}
+    for nombre, espacio in ESPACIO_BUSQUEDA.items():
+        if isinstance(espacio, list):
+            config[nombre] = espacio[rng.integers(len(espacio))]
+        elif nombre in ("lr", "l2"):
+            config[nombre] = float(np.exp(rng.uniform(np.log(espacio[0]), np.log(espacio[1]))))
+        else:
+            config[nombre] = float(rng.uniform(*espacio))
+    return config
+
+# Estado por proceso del pool de búsqueda/CV (se fija una vez en el initializer)
+_datos_trial = None
+
+def _init_trial_worker(threads: int, datos: tuple):
+    """Limita los hilos de TensorFlow del proceso y guarda los datos del trial o de los folds."""
+    global _datos_trial
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _datos_trial = datos
+
+def _entrenar_trial(config: Dict, epochs: int, seed: int, checkpoint: Optional[str] = None,
+                    initial_epoch: int = 0) -> Dict:
+    """
+    Entrena una configuración en el proceso actual y devuelve sus métricas de validación.
+    Con checkpoint el modelo (pesos y estado del optimizador) se guarda al terminar y, si
+    initial_epoch > 0, se reanuda desde ese archivo en lugar de empezar desde cero.
+    """
+    X_tr, y_tr, X_va, y_va, pt_y = _datos_trial
+    keras.utils.set_random_seed(seed)
+    if checkpoint and initial_epoch > 0 and os.path.exists(checkpoint):
+        model = keras.models.load_model(checkpoint)
+    else:
+        initial_epoch = 0
+        model = build_model(X_tr.shape[1], lr=config["lr"], units=config["units"],
+                            dropout=config["dropout"], l2=config["l2"])
+    hist = model.fit(X_tr, y_tr, validation_data=(X_va, y_va), epochs=epochs, initial_epoch=initial_epoch,
+                     batch_size=config["batch_size"], callbacks=_callbacks(epochs), verbose=0)
+    if checkpoint:
+        model.save(checkpoint)
+    y_pred_t = model.predict(X_va, verbose=0).flatten()
+    y_va_days = pt_y.inverse_transform(y_va.reshape(-1, 1)).flatten()
+    y_pred_days = pt_y.inverse_transform(y_pred_t.reshape(-1, 1)).flatten()
+    return {
+        "config": {**config, "units": list(config["units"])},
+        "epochs": epochs,
+        "epochs_run": initial_epoch + len(hist.history['loss']),
+        "resumed_from_epoch": initial_epoch,
+        # Sin la penalización L2 (val_loss la incluye y l2 varía entre trials)
+        "val_mse": float(mean_squared_error(y_va, y_pred_t)),
+        "mae_days": float(mean_absolute_error(y_va_days, y_pred_days)),
+    }
+
+def buscar_hiperparametros(
+    X_tr: np.ndarray,
+    y_tr: np.ndarray,
+    X_va: np.ndarray,
+    y_va: np.ndarray,
+    pt_y: PowerTransformer,
+    modo: str = "random",
+    n_trials: int = 16,
+    epochs: int = 200,
+    min_epochs: int = 10,
+    eta: int = 3,
+    n_jobs: Optional[int] = None,
+    seed: int = 42,
+) -> Dict:
+    """
+    Búsqueda de hiperparámetros en paralelo con un pool de procesos.
+
+    modo='random'  -> n_trials configuraciones aleatorias, cada una hasta `epochs` con early stopping.
+    modo='halving' -> successive halving: todas empiezan con `min_epochs`, sobrevive 1/eta en cada
+                      ronda y el presupuesto de épocas se multiplica por eta hasta llegar a `epochs`.
+                      Las supervivientes se reanudan desde su checkpoint de la ronda anterior
+                      (pesos y optimizador), así que cada ronda solo entrena las épocas nuevas.
+
+    Cada proceso limita sus hilos de TensorFlow a cpu_count // n_jobs para no sobresuscribir la CPU.
+    Los trials se ordenan por el MAE de validación en días: val_loss incluye la penalización L2
+    y favorecería a las configuraciones con l2 bajo.
+
+    Returns: dict con la mejor configuración, sus métricas y el detalle de todos los trials.
+    """
+    if modo not in ("random", "halving"):
+        raise ValueError(f"Modo de búsqueda no soportado: {modo}")
+    if modo == "halving" and (eta < 2 or min_epochs < 1):
+        raise ValueError("Successive halving necesita eta >= 2 y min_epochs >= 1")
+
+    cpus = os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs or cpus, n_trials))
+    threads = max(1, cpus // n_jobs)
+    rng = np.random.default_rng(seed)
+    # (id del trial, configuración): el id fija la semilla y el checkpoint entre rondas
+    candidatos = [(i, _muestrear_config(rng)) for i in range(n_trials)]
+
+    ctx = multiprocessing.get_context("spawn")
+    trials = []
+    with tempfile.TemporaryDirectory(prefix="halving_") as checkpoints, \
+            ProcessPoolExecutor(max_workers=n_jobs, mp_context=ctx, initializer=_init_trial_worker,
+                                initargs=(threads, (X_tr, y_tr, X_va, y_va, pt_y))) as pool:
+        presupuesto = epochs if modo == "random" else min(min_epochs, epochs)
+        anterior = 0
+        while True:
+            futuros = [
+                pool.submit(_entrenar_trial, c, presupuesto, seed + i,
+                            os.path.join(checkpoints, f"trial_{i}.keras") if modo == "halving" else None, anterior)
+                for i, c in candidatos
+            ]
+            ronda = sorted(({**f.result(), "trial": i} for (i, _), f in zip(candidatos, futuros)),
+                           key=lambda r: r["mae_days"])
+            trials.extend(ronda)
+            print(f"🔎 Ronda con {len(candidatos)} configuraciones x {presupuesto} épocas -> "
+                  f"mejor MAE {ronda[0]['mae_days']:.2f} días")
+            if modo == "random" or len(ronda) == 1 or presupuesto >= epochs:
+                break
+            supervivientes = ronda[:max(1, len(ronda) // eta)]
+            candidatos = [(r["trial"], {**r["config"], "units": tuple(r["config"]["units"])}) for r in supervivientes]
+            anterior, presupuesto = presupuesto, min(epochs, presupuesto * eta)
+
+    mejor = ronda[0]
+    return {
+        "mode": modo,
+        "best_config": mejor["config"],
+        "best_metrics": {k: mejor[k] for k in ("mae_days", "val_mse", "epochs_run")},
+        "trials": trials,
+        "n_jobs": n_jobs,
+        "threads_per_job": threads,
+    }
+
+
+def _entrenar_fold(config: Dict, idx_tr: np.ndarray, idx_va: np.ndarray, epochs: int, seed: int) -> Dict:
+    """
+    Entrena un fold de validación cruzada en el proceso actual.
+    Los transformadores se ajustan solo con las filas de entrenamiento del fold y el
+    early stopping usa un 10% interno de esas filas, así el fold evaluado no se ve nunca.
+    """
+    df_X, Y, X_cols = _datos_trial
+    keras.utils.set_random_seed(seed)
+    df_tr, df_va = df_X.iloc[idx_tr], df_X.iloc[idx_va]
+    pt_x = PowerTransformer(method='yeo-johnson', standardize=True)
+    robust = RobustScaler()
+    cols_pt = [c for c in X_cols if c not in CYCLIC]
+    cyc = [c for c in CYCLIC if c in X_cols]
+    if cols_pt:
+        pt_x.fit(df_tr[cols_pt])
+    if cyc:
+        robust.fit(df_tr[cyc])
+    pt_y = PowerTransformer(method='yeo-johnson', standardize=True)
+    y_tr = pt_y.fit_transform(Y[idx_tr]).flatten()
+    X_tr = _transformar_X(df_tr, X_cols, pt_x, robust)
+    X_va = _transformar_X(df_va, X_cols, pt_x, robust)
+
+    X_fit, X_es, y_fit, y_es = train_test_split(X_tr, y_tr, test_size=0.1, random_state=seed, shuffle=True)
+    model = build_model(X_tr.shape[1], lr=config["lr"], units=config["units"],
+                        dropout=config["dropout"], l2=config["l2"])
+    hist = model.fit(X_fit, y_fit, validation_data=(X_es, y_es), epochs=epochs,
+                     batch_size=config["batch_size"], callbacks=_callbacks(epochs), verbose=0)
+    y_pred_days = pt_y.inverse_transform(model.predict(X_va, verbose=0).reshape(-1, 1)).flatten()
+    y_va_days = Y[idx_va].flatten()
+    return {
+        "train_rows": int(len(idx_tr)),
+        "val_rows": int(len(idx_va)),
+        "epochs_run": len(hist.history['loss']),
+        "r2": float(r2_score(y_va_days, y_pred_days)) if len(idx_va) > 1 else float("nan"),
+        "mae_days": float(mean_absolute_error(y_va_days, y_pred_days)),
+    }
+
+def validacion_cruzada(
+    df: pd.DataFrame,
+    X_cols: List[str],
+    config: Dict,
+    k: int = 5,
+    grupo: Optional[str] = None,
+    epochs: int = 200,
+    n_jobs: Optional[int] = None,
+    seed: int = 42,
+) -> Dict:
+    """
+    Validación cruzada k-fold con los folds entrenados en paralelo (mismo pool que la búsqueda).
+
+    grupo=None      -> KFold con mezcla aleatoria de filas.
+    grupo='parcel'  -> GroupKFold por parcel_id: mide cómo generaliza a parcelas no vistas.
+    grupo='season'  -> GroupKFold por estación: ninguna estación aparece en train y test a la vez.
+
+    Returns: dict con métricas por fold y media/desviación de R2 y MAE.
+    """
+    if grupo not in (None, "parcel", "season"):
+        raise ValueError(f"Agrupación de CV no soportada: {grupo}")
+    Y = df['days_to_flowering'].values.reshape(-1, 1).astype(float)
+    if grupo is None:
+        splitter = KFold(n_splits=k, shuffle=True, random_state=seed)
+        folds = list(splitter.split(df))
+    else:
+        columna = "parcel_id" if grupo == "parcel" else "season"
+        grupos = df[columna].astype(str).values
+        n_grupos = len(np.unique(grupos))
+        if n_grupos < k:
+            raise ValueError(f"CV por {grupo} necesita al menos {k} grupos distintos y hay {n_grupos}")
+        folds = list(GroupKFold(n_splits=k).split(df, groups=grupos))
+
+    cpus = os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs or cpus, k))
+    threads = max(1, cpus // n_jobs)
+    datos = (df[X_cols].reset_index(drop=True), Y, list(X_cols))
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=ctx, initializer=_init_trial_worker,
+                             initargs=(threads, datos)) as pool:
+        futuros = [pool.submit(_entrenar_fold, config, tr, va, epochs, seed + i) for i, (tr, va) in enumerate(folds)]
+        resultados = [f.result() for f in futuros]
+
+    r2s = np.array([r["r2"] for r in resultados])
+    maes = np.array([r["mae_days"] for r in resultados])
+    print(f"📐 CV {k} folds ({grupo or 'filas'}): MAE {maes.mean():.2f} ± {maes.std():.2f} días, "
+          f"R2 {np.nanmean(r2s):.4f} ± {np.nanstd(r2s):.4f}")
+    return {
+        "k": k,
+        "group": grupo,
+        "folds": resultados,
+        "r2_mean": float(np.nanmean(r2s)),
+        "r2_std": float(np.nanstd(r2s)),
+        "mae_days_mean": float(maes.mean()),
+        "mae_days_std": float(maes.std()),
+        "n_jobs": n_jobs,
+        "threads_per_job": threads,
+    }
+
+
+# --------------------------------------------------------------------------------
+# Preprocesado compartido y modelo base
+
+# Columnas que nunca entran al modelo y columnas cíclicas (RobustScaler en lugar de PowerTransformer)
+EXCLUDED = ['date','flowering_date','timestamp','parcel_id','days_to_flowering','season']
+CYCLIC = ['day_sin','day_cos']
+
+# Directorio del modelo base compartido entre parcelas (para fine-tuning)
+BASE_MODEL_DIR = 'app/datamodels/base'
+ARTEFACTOS_BASE = ["modelo_florecimiento.keras", "pt_x.joblib", "robust_scaler.joblib", "pt_y.joblib", "x_cols.json"]
+
+def modelo_base_disponible(base_dir: str = BASE_MODEL_DIR) -> bool:
+    """True si base_dir tiene todos los artefactos que necesita el fine-tuning."""
+    return all(os.path.exists(os.path.join(base_dir, nombre)) for nombre in ARTEFACTOS_BASE)
+
+def _transformar_X(df: pd.DataFrame, X_cols: List[str], pt_x: PowerTransformer, robust: RobustScaler) -> np.ndarray:
+    """Aplica los transformadores ya ajustados a las columnas X_cols y limpia NaN/inf."""
+    cols_pt = [c for c in X_cols if c not in CYCLIC]
+    cyc = [c for c in CYCLIC if c in X_cols]
+    X = df[X_cols].copy()
+    if cols_pt:
+        X[cols_pt] = pt_x.transform(X[cols_pt])
+    if cyc:
+        X[cyc] = robust.transform(X[cyc])
+    return np.nan_to_num(X.values, nan=0.0, posinf=1e5, neginf=-1e5)
+
+def preparar_con_fechas_reales(df_feat: pd.DataFrame, df_fechas: pd.DataFrame) -> pd.DataFrame:
+    """Une features y fechas de floración por parcela y calcula 'days_to_flowering'."""
+    df = df_feat.copy()
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df_fechas = df_fechas.copy()
+    df_fechas['flowering_date'] = pd.to_datetime(df_fechas['flowering_date'], errors='coerce')
+    comb = pd.merge(df, df_fechas, on='parcel_id', how='left')
+    comb = comb.dropna(subset=['date','flowering_date'])
+    comb = comb[comb['date'] < comb['flowering_date']].copy()
+    comb['days_to_flowering'] = (comb['flowering_date'] - comb['date']).dt.days
+    return comb
+
+def _congelar_capas(model: keras.Model, n: int) -> None:
+    """Congela las primeras n capas Dense del modelo (las de extracción de rasgos)."""
+    densas = [l for l in model.layers if isinstance(l, keras.layers.Dense)]
+    for capa in densas[:n]:
+        capa.trainable = False
+
+def entrenar_modelo_base(
+    path_fechas: str = "fechas_floracion.csv",
+    parcel_ids: Optional[List[int]] = None,
+    years: Optional[Tuple[int, int]] = None,
+    output_dir: str = BASE_MODEL_DIR,
+    streaming: bool = False,
+    **kwargs,
+) -> Dict:
+    """
+    Entrena el modelo base con el historial de todas las parcelas del feature store.
+    Sus pesos y transformadores son el punto de partida del fine-tuning por parcela.
+    Con streaming=True se usa entrenar_modelo_streaming (tf.data, memoria acotada).
+    """
+    if streaming:
+        from app.services.streaming_training import entrenar_modelo_streaming
+        return entrenar_modelo_streaming(path_fechas=path_fechas, parcel_ids=parcel_ids, years=years,
+                                         output_dir=output_dir, **kwargs)
+    return entrenar_modelo_floracion(
+        demo_mode=False,
+        path_fechas=path_fechas,
+        use_feature_store=True,
+        parcel_ids=parcel_ids,
+        years=years,
+        output_dir=output_dir,
+        **kwargs,
+    )
 
 def entrenar_modelo_floracion(
     demo_mode: bool = True,
     path_features_base: str = "datos_nuevos_multi.csv",
     features_nuevos:dict = [],
     path_fechas: str = "fechas_floracion.csv",
+    use_feature_store: bool = False,
+    parcel_ids: Optional[List[int]] = None,
+    years: Optional[Tuple[int, int]] = None,
     seed: int = 42,
     epochs: int = 200,
     batch_size: int = 32,
+    search: Optional[str] = None,
+    n_trials: int = 16,
+    search_min_epochs: int = 10,
+    search_eta: int = 3,
+    n_jobs: Optional[int] = None,
+    fine_tune: bool = False,
+    base_dir: str = BASE_MODEL_DIR,
+    fine_tune_epochs: int = 20,
+    fine_tune_lr: float = 1e-4,
+    freeze_layers: int = 1,
+    output_dir: str = "",
+    parcel_id: Optional[int] = None,
+    quantize: Optional[str] = None,
+    max_mae_increase: float = 0.5,
+    cv_folds: int = 0,
+    cv_group: Optional[str] = None,
 ) -> Dict:
     """
     Entrena un modelo (DEMO o REAL) para predecir 'days_to_flowering' y guarda:
@@ -86,12 +725,38 @@ def entrenar_modelo_floracion(
       - Preprocesadores pt_x/robust/pt_y (.joblib)
       - Columnas X (x_cols.json)
 
+    Con use_feature_store=True las features se leen del feature store (Parquet)
+    filtrando por parcel_ids/years y cargando solo las columnas necesarias,
+    en lugar de releer el CSV base.
+
+    Con search='random' o search='halving' primero se buscan hiperparámetros en
+    paralelo (ver buscar_hiperparametros) sobre una partición de validación
+    separada del test, y el modelo final se entrena con la mejor configuración.
+    En modo halving, search_min_epochs y search_eta son el presupuesto de la primera
+    ronda y el factor de reducción (ver buscar_hiperparametros).
+
+    Con fine_tune=True no se entrena desde pesos aleatorios: se parte del modelo
+    base (ver entrenar_modelo_base), se reutilizan sus transformadores y columnas,
+    se congelan las primeras `freeze_layers` capas Dense y se entrenan solo
+    `fine_tune_epochs` épocas con un learning rate reducido.
+
+    Con parcel_id los artefactos se guardan en MODELS_DIR/parcel_<id>/v<versión>
+    y el modelo queda registrado en el manifiesto como la última versión de la parcela.
+
+    Con quantize='float16' o quantize='int8' se compara el MAE en días de los pesos
+    cuantizados contra el modelo float32 sobre el mismo split de test; el resultado
+    queda en metrics['quantization'] y el pack de modelos (que es quien sirve los
+    pesos cuantizados) usa float32 para las parcelas cuya cuantización no pasa el control.
+
+    Con cv_folds >= 2 se evalúa además la configuración elegida con validación cruzada
+    (ver validacion_cruzada, cv_group=None/'parcel'/'season'), entrenando los folds en
+    paralelo; el resultado queda en metrics['cv']. No aplica al fine-tuning.
+
     Returns: dict con métricas y rutas guardadas.
     """
 
-    # -------------------- Config locales --------------------
-    EXCLUDED = ['date','flowering_date','timestamp','parcel_id','days_to_flowering','season']
-    CYCLIC = ['day_sin','day_cos']
+    if fine_tune and not modelo_base_disponible(base_dir):
+        raise FileNotFoundError(f"No hay modelo base en {base_dir}: entrénelo antes con entrenar_modelo_base")
 
     # Semillas
     np.random.seed(seed)
@@ -99,40 +764,23 @@ def entrenar_modelo_floracion(
 
     # -------------------- Helpers internos --------------------
     def cargar_features() -> pd.DataFrame:
+        if use_feature_store:
+            df = feature_store.read(columns=['parcel_id', 'date'] + COLS_X, parcel_ids=parcel_ids, years=years)
+            if df.empty:
+                raise ValueError("El feature store no tiene datos para las parcelas solicitadas.")
+            return df
         if not os.path.exists(path_features_base):
             raise FileNotFoundError(f"No se encontró: {path_features_base}")
         df = pd.read_csv(path_features_base)
-        df_new = pd.DataFrame(features_nuevos)
+        df_new = flatten_history(features_nuevos)
         df = pd.concat([df, df_new], ignore_index=True)
         return df
 
     
 
-    def preparar_con_fechas_reales(df_feat: pd.DataFrame, df_fechas: pd.DataFrame) -> pd.DataFrame:
-        df = df_feat.copy()
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df_fechas = df_fechas.copy()
-        df_fechas['flowering_date'] = pd.to_datetime(df_fechas['flowering_date'], errors='coerce')
-        comb = pd.merge(df, df_fechas, on='parcel_id', how='left')
-        comb = comb.dropna(subset=['date','flowering_date'])
-        comb = comb[comb['date'] < comb['flowering_date']].copy()
-        comb['days_to_flowering'] = (comb['flowering_date'] - comb['date']).dt.days
-        return comb
-
-    def build_model(nf: int, lr: float = 5e-4) -> keras.Model:
-        m = keras.Sequential([
-            keras.layers.Input(shape=(nf,)),
-            keras.layers.Dense(128, activation='relu', kernel_regularizer=keras.regularizers.l2(1e-3)),
-            keras.layers.Dropout(0.3),
-            keras.layers.Dense(64, activation='relu', kernel_regularizer=keras.regularizers.l2(1e-3)),
-            keras.layers.Dropout(0.3),
-            keras.layers.Dense(1, activation='linear')
-        ])
-        m.compile(optimizer=keras.optimizers.Adam(lr), loss='mse', metrics=['mae'])
-        return m
-
     # -------------------- Carga y etiquetas --------------------
-    df_feat = cargar_features()
+    # Las variables derivadas se recalculan con el mismo código que usa la inferencia
+    df_feat = derive_features(cargar_features())
 
     usar_reales = (not demo_mode) and os.path.exists(path_fechas)
     if usar_reales:
@@ -143,40 +791,72 @@ def entrenar_modelo_floracion(
     
 
     # -------------------- X / y y prepro --------------------
-    X_cols = [c for c in df.columns if c not in EXCLUDED and pd.api.types.is_numeric_dtype(df[c])]
-    if len(X_cols) == 0:
-        raise ValueError("No hay columnas numéricas para entrenar. Revisa tu dataset.")
-
     Y = df['days_to_flowering'].values.reshape(-1,1)
 
-    pt_x = PowerTransformer(method='yeo-johnson', standardize=True)
-    robust = RobustScaler()
-    cols_pt = [c for c in X_cols if c not in CYCLIC]
-    cyc = [c for c in CYCLIC if c in X_cols]
-
-    X = df[X_cols].copy()
-    if cols_pt:
-        pt_x.fit(X[cols_pt]); X[cols_pt] = pt_x.transform(X[cols_pt])
-    if cyc:
-        robust.fit(X[cyc]); X[cyc] = robust.transform(X[cyc])
-
-    pt_y = PowerTransformer(method='yeo-johnson', standardize=True)
-    pt_y.fit(Y); y_t = pt_y.transform(Y).flatten()
-
-    X = np.nan_to_num(X.values, nan=0.0, posinf=1e5, neginf=-1e5)
+    if fine_tune:
+        # Transformadores y columnas del modelo base: la entrada debe escalarse igual
+        pt_x = joblib.load(os.path.join(base_dir, "pt_x.joblib"))
+        robust = joblib.load(os.path.join(base_dir, "robust_scaler.joblib"))
+        pt_y = joblib.load(os.path.join(base_dir, "pt_y.joblib"))
+        with open(os.path.join(base_dir, "x_cols.json"), encoding="utf-8") as f:
+            X_cols = json.load(f)
+        missing = [c for c in X_cols if c not in df.columns]
+        if missing:
+            raise ValueError(f"Faltan columnas del modelo base: {missing}")
+    else:
+        X_cols = [c for c in df.columns if c not in EXCLUDED and pd.api.types.is_numeric_dtype(df[c])]
+        if len(X_cols) == 0:
+            raise ValueError("No hay columnas numéricas para entrenar. Revisa tu dataset.")
+
+        pt_x = PowerTransformer(method='yeo-johnson', standardize=True)
+        robust = RobustScaler()
+        cols_pt = [c for c in X_cols if c not in CYCLIC]
+        cyc = [c for c in CYCLIC if c in X_cols]
+        if cols_pt:
+            pt_x.fit(df[cols_pt])
+        if cyc:
+            robust.fit(df[cyc])
+
+        pt_y = PowerTransformer(method='yeo-johnson', standardize=True)
+        pt_y.fit(Y)
+
+    y_t = pt_y.transform(Y).flatten()
+    X = _transformar_X(df, X_cols, pt_x, robust)
 
     # -------------------- Split / modelo / training --------------------
     X_tr, X_te, y_tr, y_te = train_test_split(X, y_t, test_size=0.2, random_state=seed, shuffle=True)
 
-    model = build_model(X_tr.shape[1], lr=5e-4)
-    callbacks = [
-        keras.callbacks.EarlyStopping(monitor='val_loss', patience=15, restore_best_weights=True),
-        keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=5, min_lr=1e-6)
-    ]
-
-    print("🚀 Entrenando...")
-    hist = model.fit(X_tr, y_tr, validation_data=(X_te, y_te), epochs=epochs, batch_size=batch_size,
-                     callbacks=callbacks, verbose=1)
+    config = {**HIPERPARAMETROS_BASE, "batch_size": batch_size}
+    busqueda = None
+    if fine_tune:
+        model = keras.models.load_model(os.path.join(base_dir, "modelo_florecimiento.keras"))
+        _congelar_capas(model, freeze_layers)
+        model.compile(optimizer=keras.optimizers.Adam(fine_tune_lr), loss='mse', metrics=['mae'])
+        epochs = fine_tune_epochs
+        config = {"lr": fine_tune_lr, "batch_size": batch_size, "fine_tune": True,
+                  "freeze_layers": freeze_layers, "base_dir": base_dir}
+    else:
+        if search:
+            X_fit, X_va, y_fit, y_va = train_test_split(X_tr, y_tr, test_size=0.2, random_state=seed, shuffle=True)
+            busqueda = buscar_hiperparametros(X_fit, y_fit, X_va, y_va, pt_y, modo=search, n_trials=n_trials,
+                                              epochs=epochs, min_epochs=search_min_epochs, eta=search_eta,
+                                              n_jobs=n_jobs, seed=seed)
+            config = {**busqueda["best_config"], "units": tuple(busqueda["best_config"]["units"])}
+            print(f"🏆 Mejor configuración: {config}")
+
+        model = build_model(X_tr.shape[1], lr=config["lr"], units=config["units"],
+                            dropout=config["dropout"], l2=config["l2"])
+
+    cv = None
+    if cv_folds >= 2:
+        if fine_tune:
+            raise ValueError("La validación cruzada no está disponible en modo fine_tune")
+        cv = validacion_cruzada(df, X_cols, config, k=cv_folds, grupo=cv_group, epochs=epochs,
+                                n_jobs=n_jobs, seed=seed)
+
+    print("🚀 Entrenando..." if not fine_tune else f"🚀 Fine-tuning desde {base_dir}...")
+    hist = model.fit(X_tr, y_tr, validation_data=(X_te, y_te), epochs=epochs, batch_size=config["batch_size"],
+                     callbacks=_callbacks(epochs), verbose=1)
 
     # -------------------- Métricas (escala original: días) --------------------
     y_pred_t = model.predict(X_te).flatten()
@@ -188,11 +868,17 @@ def entrenar_modelo_floracion(
     print(f"MAE: {mae_days:.2f} días")
 
     # -------------------- Guardados --------------------
-    modelo_path = f"modelo_florecimiento{suf}.keras"
-    pt_x_path   = f"pt_x{suf}.joblib"
-    robust_path = f"robust_scaler{suf}.joblib"
-    pt_y_path   = f"pt_y{suf}.joblib"
-    xcols_path  = f"x_cols{suf}.json"
+    version = None
+    if parcel_id is not None and not output_dir:
+        version = model_registry.next_version(parcel_id)
+        output_dir = os.path.join(settings.MODELS_DIR, f"parcel_{parcel_id}", f"v{version}")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    modelo_path = os.path.join(output_dir, f"modelo_florecimiento{suf}.keras")
+    pt_x_path   = os.path.join(output_dir, f"pt_x{suf}.joblib")
+    robust_path = os.path.join(output_dir, f"robust_scaler{suf}.joblib")
+    pt_y_path   = os.path.join(output_dir, f"pt_y{suf}.joblib")
+    xcols_path  = os.path.join(output_dir, f"x_cols{suf}.json")
 
     model.save(modelo_path)
     joblib.dump(pt_x, pt_x_path)
@@ -205,4 +891,34 @@ def entrenar_modelo_floracion(
     print(f"✅ Preprocesadores en: {pt_x_path}, {robust_path}, {pt_y_path}")
     print(f"✅ Columnas X en: {xcols_path}")
 
-    return "trained new model"
\ No newline at end of file
+    metrics = {"r2": r2, "mae_days": mae_days, "epochs_run": len(hist.history['loss'])}
+    if cv is not None:
+        metrics["cv"] = cv
+    paths = {
+        "model": modelo_path,
+        "pt_x": pt_x_path,
+        "robust": robust_path,
+        "pt_y": pt_y_path,
+        "x_cols": xcols_path,
+    }
+
+    # -------------------- Control de cuantización (opcional) --------------------
+    if quantize:
+        from app.services.packed_model_store import compare_quantized
+        check = compare_quantized(model, X_te, y_te, pt_y, quantize, max_mae_increase=max_mae_increase)
+        metrics["quantization"] = check
+        estado = "✅" if check["accepted"] else "⚠️ "
+        print(f"{estado} Cuantización {quantize}: MAE {check['mae_days_quantized']:.2f} días "
+              f"(float32: {check['mae_days_float32']:.2f})")
+    manifest_entry = None
+    if parcel_id is not None:
+        manifest_entry = model_registry.register(parcel_id, paths, metrics, version=version)
+
+    return {
+        "status": "trained new model",
+        "metrics": metrics,
+        "config": {**config, "units": list(config["units"])} if "units" in config else config,
+        "search": busqueda,
+        "paths": paths,
+        "manifest": manifest_entry,
+    }
\ No newline at end of file
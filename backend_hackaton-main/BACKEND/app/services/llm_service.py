@@ -0,0 +1,202 @@
+"""
+LLM client for the flowering analysis text
+One pooled HTTP client per process, a cap on in-flight completions and a TTL
+cache keyed by bucketed prediction inputs so similar parcels share an answer
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Upper edges of the days-until-bloom buckets; beyond the last one days are rounded to 30
+_DAY_STEPS = ((14, 1), (60, 5), (180, 15))
+
+
+def bucket_days(days: float) -> int:
+    """Round days to a step that grows with the horizon (exact near bloom, coarse far away)"""
+    for limit, step in _DAY_STEPS:
+        if days < limit:
+            return int(round(days / step) * step)
+    return int(round(days / 30) * 30)
+
+
+def _bucket(value: Optional[float], step: float) -> float:
+    return round(round((value or 0.0) / step) * step, 4)
+
+
+def bucket_inputs(days_until_bloom: float, confidence: str, ndvi: float, temperature: float,
+                  precipitation: float, area: float) -> Dict:
+    """
+    Snap the prompt inputs to coarse bins
+
+    The prompt only shows the binned values as context and asks for
+    placeholders instead of figures (see fill_placeholders), so a cached
+    explanation fits every prediction that falls in the same bins.
+    """
+    conf = int(str(confidence).replace('%', '').strip() or 0)
+    return {
+        "days_until_bloom": bucket_days(days_until_bloom),
+        "confidence": f"{int(round(conf / 5) * 5)}%",
+        "ndvi": _bucket(ndvi, 0.05),
+        "temperature": _bucket(temperature, 2.0),
+        "precipitation": _bucket(precipitation, 5.0),
+        "area": _bucket(area, 0.5),
+    }
+
+
+def fill_placeholders(answer: Any, values: Dict[str, str]) -> Any:
+    """Copy of a (cached) JSON answer with every ``{name}`` placeholder replaced by its exact value"""
+    if isinstance(answer, dict):
+        return {key: fill_placeholders(item, values) for key, item in answer.items()}
+    if isinstance(answer, list):
+        return [fill_placeholders(item, values) for item in answer]
+    if isinstance(answer, str):
+        for name, value in values.items():
+            answer = answer.replace(f"{{{name}}}", value)
+    return answer
+
+
+class TTLCache:
+    """Small LRU cache whose entries expire after a fixed time"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Tuple, Tuple[float, Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: Tuple, value: Dict):
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class LLMService:
+    """OpenRouter-compatible chat completion client shared by all requests"""
+
+    def __init__(self):
+        self.base_url = settings.OPENROUTER_BASE_URL.rstrip('/')
+        self.api_key = settings.OPENROUTER_API_KEY
+        self.model = settings.OPENROUTER_MODEL
+        self.cache = TTLCache(settings.LLM_CACHE_SIZE, settings.LLM_CACHE_TTL_SECONDS)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Completions in progress, so concurrent identical requests wait for the same call
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+
+    def is_available(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(settings.LLM_TIMEOUT_SECONDS, connect=5.0),
+                limits=httpx.Limits(max_connections=settings.LLM_MAX_CONCURRENCY,
+                                    max_keepalive_connections=settings.LLM_MAX_CONCURRENCY),
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            )
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        return self._semaphore
+
+    async def aclose(self):
+        """Close the pooled client (called on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _complete(self, prompt: str) -> Optional[Dict]:
+        semaphore = self._get_semaphore()
+        try:
+            # Don't queue behind a saturated provider for longer than the caller is willing to wait
+            await asyncio.wait_for(semaphore.acquire(), timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("LLM concurrency limit reached, skipping completion")
+            return None
+        try:
+            response = await self._get_client().post(
+                "/chat/completions",
+                json={
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.7,
+                    "max_tokens": 800
+                }
+            )
+        finally:
+            semaphore.release()
+        if response.status_code != 200:
+            logger.warning(f"LLM completion failed with status {response.status_code}")
+            return None
+        content = response.json()['choices'][0]['message']['content']
+        match = _JSON_RE.search(content)
+        return json.loads(match.group()) if match else None
+
+    async def complete_json(self, key: Tuple, prompt: str) -> Optional[Dict]:
+        """
+        JSON answer for a prompt, served from the cache when the key was seen recently
+
+        Args:
+            key: Cache key (bucketed inputs the prompt was built from)
+            prompt: Prompt sent on a cache miss
+
+        Returns:
+            Parsed JSON object, or None if the LLM is unavailable or failed
+        """
+        if not self.is_available():
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        result = None
+        try:
+            result = await self._complete(prompt)
+            if result is not None:
+                self.cache.put(key, result)
+        except Exception as e:
+            logger.warning(f"LLM completion failed: {e}")
+        finally:
+            future.set_result(result)
+            del self._inflight[key]
+        return result
+
+
+# Create global instance
+llm_service = LLMService()
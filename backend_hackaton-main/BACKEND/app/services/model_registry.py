@@ -0,0 +1,190 @@
+"""
+Model manifest for per-parcel flowering models
+Maps parcel id -> model artifacts, version, metrics and creation time in SQLite
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Legacy files are named like "modelo_florecimiento<parcel_id>.keras"
+_LEGACY_MODEL_RE = re.compile(r'(\d+)\.keras$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    parcel_id   INTEGER NOT NULL,
+    version     INTEGER NOT NULL,
+    model_path  TEXT NOT NULL,
+    pt_x_path   TEXT,
+    robust_path TEXT,
+    pt_y_path   TEXT,
+    x_cols_path TEXT,
+    metrics     TEXT,
+    created_at  TEXT NOT NULL,
+    PRIMARY KEY (parcel_id, version)
+)
+"""
+
+# One-off migrations already applied to this manifest (e.g. the legacy model import)
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+)
+"""
+
+
+class ModelRegistry:
+    """SQLite-backed manifest with an in-memory index of the latest model per parcel"""
+
+    def __init__(self, manifest_path: Optional[str] = None, models_dir: Optional[str] = None):
+        self.manifest_path = manifest_path or settings.MODEL_MANIFEST_PATH
+        self.models_dir = models_dir or settings.MODELS_DIR
+        self._lock = threading.Lock()
+        self._index: Dict[int, Dict] = {}
+        self._index_mtime = None
+        # Bumped on every change of _index so callers can cache what they derive from it
+        self._generation = 0
+        self._bootstrapped = False
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.manifest_path)
+        conn.row_factory = sqlite3.Row
+        conn.execute(_SCHEMA)
+        conn.execute(_META_SCHEMA)
+        if not self._bootstrapped:
+            self._bootstrap_once(conn)
+        return conn
+
+    def _bootstrap_once(self, conn: sqlite3.Connection):
+        """Import legacy models the first time any worker opens this manifest (flagged in meta)"""
+        # The write lock serializes workers racing to open a new manifest
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone() is None:
+                self._bootstrap_legacy(conn)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)",
+                             (datetime.utcnow().isoformat(),))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._bootstrapped = True
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict:
+        entry = dict(row)
+        entry["metrics"] = json.loads(entry["metrics"]) if entry["metrics"] else {}
+        return entry
+
+    def _refresh_index(self):
+        """Rebuild the in-memory index if the manifest changed on disk (e.g. written by another worker)"""
+        mtime = os.path.getmtime(self.manifest_path) if os.path.exists(self.manifest_path) else None
+        if mtime is not None and mtime == self._index_mtime:
+            return
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT m.* FROM models m JOIN ("
+                    "  SELECT parcel_id, MAX(version) AS version FROM models GROUP BY parcel_id"
+                    ") latest USING (parcel_id, version)"
+                ).fetchall()
+            finally:
+                conn.close()
+            self._index = {row["parcel_id"]: self._row_to_entry(row) for row in rows}
+            self._index_mtime = os.path.getmtime(self.manifest_path)
+            self._generation += 1
+
+    def _bootstrap_legacy(self, conn: sqlite3.Connection):
+        """Import models trained before the manifest existed, matching the parcel id exactly (caller commits)"""
+        if not os.path.isdir(self.models_dir):
+            return
+        now = datetime.utcnow().isoformat()
+        for root, _, files in os.walk(self.models_dir):
+            for file in files:
+                match = _LEGACY_MODEL_RE.search(file)
+                if not match:
+                    continue
+                conn.execute(
+                    "INSERT OR IGNORE INTO models (parcel_id, version, model_path, created_at) VALUES (?, 1, ?, ?)",
+                    (int(match.group(1)), os.path.join(root, file), now)
+                )
+
+    def next_version(self, parcel_id: int) -> int:
+        """Version number the next model for this parcel will get"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT MAX(version) FROM models WHERE parcel_id = ?", (int(parcel_id),)).fetchone()
+            return (row[0] or 0) + 1
+        finally:
+            conn.close()
+
+    def register(self, parcel_id: int, paths: Dict[str, str], metrics: Optional[Dict] = None,
+                 version: Optional[int] = None) -> Dict:
+        """
+        Register a newly trained model as the latest version for a parcel
+
+        Args:
+            parcel_id: Parcel identifier
+            paths: Artifact paths with keys model, pt_x, robust, pt_y, x_cols
+            metrics: Training metrics to keep alongside the model
+            version: Explicit version (defaults to the next free one)
+
+        Returns:
+            The stored manifest entry
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                if version is None:
+                    row = conn.execute("SELECT MAX(version) FROM models WHERE parcel_id = ?",
+                                       (int(parcel_id),)).fetchone()
+                    version = (row[0] or 0) + 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        int(parcel_id), version, paths["model"], paths.get("pt_x"), paths.get("robust"),
+                        paths.get("pt_y"), paths.get("x_cols"), json.dumps(metrics or {}),
+                        datetime.utcnow().isoformat()
+                    )
+                )
+                conn.commit()
+                row = conn.execute("SELECT * FROM models WHERE parcel_id = ? AND version = ?",
+                                   (int(parcel_id), version)).fetchone()
+            finally:
+                conn.close()
+            entry = self._row_to_entry(row)
+            self._index[int(parcel_id)] = entry
+            self._generation += 1
+        logger.info(f"Registered model v{version} for parcel {parcel_id}")
+        return entry
+
+    def get(self, parcel_id: int) -> Optional[Dict]:
+        """Latest manifest entry for a parcel (None if it has no model)"""
+        self._refresh_index()
+        return self._index.get(int(parcel_id))
+
+    def generation(self) -> int:
+        """Counter that changes whenever the latest-model index does (no copy of the index)"""
+        self._refresh_index()
+        return self._generation
+
+    def list(self) -> List[Dict]:
+        """Latest entry for every parcel"""
+        self._refresh_index()
+        return list(self._index.values())
+
+
+# Create global instance
+model_registry = ModelRegistry()
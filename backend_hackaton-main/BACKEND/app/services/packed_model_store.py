@@ -0,0 +1,423 @@
+"""
+Packed, memory-mapped store of per-parcel flowering models
+All parcels' MLP weights live in one file as contiguous arrays plus an offset
+index. Every uvicorn worker maps the file read-only, so the weights are shared
+through the OS page cache and "loading" a model is a lookup into the mapping.
+
+File layout:
+    8 bytes   magic  b"ZVPACK01"
+    8 bytes   little-endian uint64 header length H
+    H bytes   JSON header (parcel index, array offsets relative to the data region)
+    padding   up to a 64-byte boundary
+    data      64-byte aligned arrays and transformer blobs
+
+Kernels can be stored as float32, float16 or int8 (symmetric, one scale per
+layer); the NumPy runtime multiplies by the quantized weights directly.
+"""
+
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from tensorflow import keras
+
+from app.core.config import settings
+from app.services.feature_engineering import derive_features
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import COLS_X, _transformar_X, resumir_incertidumbre
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ZVPACK01"
+ALIGN = 64
+PRECISIONS = ("float32", "float16", "int8")
+# Feature-store rows per parcel used by the pack-time quantization check
+CHECK_ROWS = 2048
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def extract_mlp_layers(model: keras.Model) -> List[Dict]:
+    """
+    Extract the Dense layers of a Sequential MLP as plain arrays
+
+    Dropout layers are recorded as the dropout rate of the preceding Dense layer;
+    any other layer type is rejected because the packed runtime can't execute it.
+    """
+    layers = []
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.Dense):
+            kernel, bias = layer.get_weights()
+            activation = layer.get_config().get("activation", "linear")
+            if activation not in ("relu", "linear"):
+                raise ValueError(f"Unsupported activation for packed store: {activation}")
+            layers.append({
+                "kernel": kernel.astype(np.float32),
+                "bias": bias.astype(np.float32),
+                "activation": activation,
+                "dropout": 0.0,
+            })
+        elif isinstance(layer, keras.layers.Dropout):
+            if layers:
+                layers[-1]["dropout"] = float(layer.rate)
+        elif not isinstance(layer, keras.layers.InputLayer):
+            raise ValueError(f"Unsupported layer for packed store: {layer.__class__.__name__}")
+    return layers
+
+
+def quantize_layers(layers: List[Dict], precision: str = "float32") -> List[Dict]:
+    """
+    Convert layer kernels to a reduced precision
+
+    float16 casts the kernel; int8 uses a symmetric per-layer scale
+    (kernel ~= kernel_q * scale). Biases stay float32, they are tiny.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision: {precision}")
+    quantized = []
+    for layer in layers:
+        q = dict(layer)
+        kernel = np.asarray(layer["kernel"], dtype=np.float32)
+        if precision == "float16":
+            q["kernel"] = kernel.astype(np.float16)
+        elif precision == "int8":
+            max_abs = float(np.max(np.abs(kernel))) if kernel.size else 0.0
+            scale = max_abs / 127.0 if max_abs > 0 else 1.0
+            q["kernel"] = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+            q["scale"] = scale
+        quantized.append(q)
+    return quantized
+
+
+def mlp_forward(layers: List[Dict], X: np.ndarray, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Forward pass over float32/float16/int8 layers
+
+    Inference mode by default; with an rng, dropout stays active (inverted
+    dropout with each layer's recorded rate) for Monte-Carlo sampling.
+    """
+    h = np.asarray(X, dtype=np.float32)
+    for layer in layers:
+        h = np.matmul(h, layer["kernel"], dtype=np.float32)
+        if layer.get("scale") is not None:
+            h *= layer["scale"]
+        h += layer["bias"]
+        if layer["activation"] == "relu":
+            np.maximum(h, 0.0, out=h)
+        rate = layer.get("dropout") or 0.0
+        if rng is not None and rate > 0:
+            h *= (rng.random(h.shape) >= rate) / np.float32(1.0 - rate)
+    return h
+
+
+def compare_quantized(model: keras.Model, X_te: np.ndarray, y_te: np.ndarray, pt_y, precision: str,
+                      max_mae_increase: float = 0.5) -> Dict:
+    """
+    Accuracy check of a quantized export against the float32 model
+
+    Both versions predict the held-out split; MAE is compared in days.
+    The export is accepted if MAE grows by at most `max_mae_increase` days.
+    """
+    layers = extract_mlp_layers(model)
+    y_true = pt_y.inverse_transform(np.asarray(y_te).reshape(-1, 1)).flatten()
+    y_f32 = pt_y.inverse_transform(mlp_forward(layers, X_te).reshape(-1, 1)).flatten()
+    y_q = pt_y.inverse_transform(mlp_forward(quantize_layers(layers, precision), X_te).reshape(-1, 1)).flatten()
+    mae_f32 = float(np.mean(np.abs(y_true - y_f32)))
+    mae_q = float(np.mean(np.abs(y_true - y_q)))
+    return {
+        "precision": precision,
+        "mae_days_float32": mae_f32,
+        "mae_days_quantized": mae_q,
+        "mae_increase_days": mae_q - mae_f32,
+        "max_abs_diff_days": float(np.max(np.abs(y_q - y_f32))) if len(y_q) else 0.0,
+        "accepted": (mae_q - mae_f32) <= max_mae_increase,
+    }
+
+
+def check_quantized_drift(layers: List[Dict], X: np.ndarray, pt_y, precision: str,
+                          max_mae_increase: float = 0.5) -> Dict:
+    """
+    Label-free accuracy check of a quantization, for models packed without a recorded one
+
+    The mean absolute difference in days between the quantized and float32
+    predictions bounds how much the MAE can grow on any labels (triangle
+    inequality), so it is compared against the same `max_mae_increase`.
+    """
+    y_f32 = pt_y.inverse_transform(mlp_forward(layers, X).reshape(-1, 1)).flatten()
+    y_q = pt_y.inverse_transform(mlp_forward(quantize_layers(layers, precision), X).reshape(-1, 1)).flatten()
+    drift = float(np.mean(np.abs(y_q - y_f32))) if len(y_q) else 0.0
+    return {
+        "precision": precision,
+        "rows": int(len(y_q)),
+        "mean_abs_diff_days": drift,
+        "max_abs_diff_days": float(np.max(np.abs(y_q - y_f32))) if len(y_q) else 0.0,
+        "accepted": drift <= max_mae_increase,
+    }
+
+
+def _parcel_features(parcel_id: int, x_cols: List[str], pt_x, robust, max_rows: int) -> Optional[np.ndarray]:
+    """Transformed feature-store rows of a parcel (None if it has none or they lack a model column)"""
+    raw = feature_store.read(columns=['parcel_id', 'date'] + COLS_X, parcel_ids=[parcel_id])
+    if raw.empty:
+        return None
+    df = derive_features(raw)
+    if any(c not in df.columns for c in x_cols):
+        return None
+    if len(df) > max_rows:
+        df = df.iloc[np.linspace(0, len(df) - 1, max_rows).round().astype(int)]
+    return _transformar_X(df, x_cols, pt_x, robust)
+
+
+class _PackWriter:
+    """Accumulates arrays/blobs into an aligned data region"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def add_bytes(self, data: bytes) -> Tuple[int, int]:
+        offset = _align(self.buffer.tell())
+        self.buffer.seek(offset)
+        self.buffer.write(data)
+        return offset, len(data)
+
+    def add_array(self, array: np.ndarray) -> Dict:
+        array = np.ascontiguousarray(array)
+        offset, _ = self.add_bytes(array.tobytes())
+        return {"offset": offset, "shape": list(array.shape), "dtype": str(array.dtype)}
+
+
+def pack_models(entries: List[Dict], output_path: Optional[str] = None, precision: Optional[str] = None,
+                max_mae_increase: float = 0.5) -> Dict:
+    """
+    Build the packed store from model manifest entries
+
+    The file is written to a temporary path and atomically renamed, so workers
+    that still map the previous pack keep a consistent view until they reload.
+
+    Args:
+        entries: Manifest entries (see model_registry) with model and transformer paths
+        output_path: Destination file (defaults to settings.PACKED_MODEL_STORE_PATH)
+        precision: Kernel precision (defaults to settings.PACKED_MODEL_PRECISION). The
+            training-time accuracy check for this precision is used when recorded;
+            otherwise the quantization is checked here against the float32 model on
+            the parcel's feature-store rows. Parcels that fail, or can't be
+            checked, are packed as float32
+        max_mae_increase: Tolerance of the pack-time check, in days
+
+    Returns:
+        Summary with the number of packed parcels, skipped entries and float32 fallbacks
+    """
+    output_path = output_path or settings.PACKED_MODEL_STORE_PATH
+    precision = precision or settings.PACKED_MODEL_PRECISION
+    writer = _PackWriter()
+    parcels = {}
+    skipped = []
+    float32_fallback = []
+
+    for entry in entries:
+        parcel_id = entry["parcel_id"]
+        if not entry.get("pt_x_path"):
+            # Legacy models without their own transformers can't be served from the pack
+            skipped.append(parcel_id)
+            continue
+        try:
+            model = keras.models.load_model(entry["model_path"])
+            layers = extract_mlp_layers(model)
+            with open(entry["x_cols_path"], encoding="utf-8") as f:
+                x_cols = json.load(f)
+            transformers = (joblib.load(entry["pt_x_path"]), joblib.load(entry["robust_path"]),
+                            joblib.load(entry["pt_y_path"]))
+        except Exception as e:
+            logger.warning(f"Skipping parcel {parcel_id} in pack: {e}")
+            skipped.append(parcel_id)
+            continue
+
+        if precision != "float32":
+            check = (entry.get("metrics") or {}).get("quantization", {})
+            if check.get("precision") != precision:
+                X = _parcel_features(parcel_id, x_cols, transformers[0], transformers[1], CHECK_ROWS)
+                check = (check_quantized_drift(layers, X, transformers[2], precision, max_mae_increase)
+                         if X is not None else {"accepted": False})
+            if check.get("accepted"):
+                layers = quantize_layers(layers, precision)
+            else:
+                logger.warning(f"Parcel {parcel_id}: {precision} not verified by an accuracy check, packing float32")
+                float32_fallback.append(parcel_id)
+
+        blob = io.BytesIO()
+        joblib.dump(transformers, blob)
+        t_offset, t_length = writer.add_bytes(blob.getvalue())
+
+        parcels[str(parcel_id)] = {
+            "model_version": entry.get("version"),
+            "x_cols": x_cols,
+            "transformers": {"offset": t_offset, "length": t_length},
+            "layers": [
+                {
+                    "kernel": writer.add_array(layer["kernel"]),
+                    "bias": writer.add_array(layer["bias"]),
+                    "scale": layer.get("scale"),
+                    "activation": layer["activation"],
+                    "dropout": layer["dropout"],
+                }
+                for layer in layers
+            ],
+        }
+
+    header = json.dumps({"format_version": 1, "precision": precision, "parcels": parcels}).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    out_dir = os.path.dirname(output_path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".pack.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            f.write(b"\0" * (data_start - f.tell()))
+            f.write(writer.buffer.getvalue())
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    logger.info(f"Packed {len(parcels)} models into {output_path} ({len(skipped)} skipped)")
+    return {"path": output_path, "packed": len(parcels), "skipped": skipped, "float32_fallback": float32_fallback}
+
+
+class PackedMLP:
+    """MLP whose weights are zero-copy views into the shared mapping"""
+
+    def __init__(self, layers: List[Dict], x_cols: List[str], transformers: tuple, model_version: Optional[int]):
+        self.layers = layers
+        self.x_cols = x_cols
+        self.pt_x, self.robust, self.pt_y = transformers
+        self.model_version = model_version
+
+    def forward(self, X: np.ndarray) -> np.ndarray:
+        """Forward pass on already transformed features (inference mode: dropout off)"""
+        return mlp_forward(self.layers, X)
+
+    def predict_days(self, rows: List[dict]) -> np.ndarray:
+        """Transform raw feature rows, run the MLP and return days to flowering"""
+        X_df = pd.DataFrame(rows)
+        missing = [col for col in self.x_cols if col not in X_df.columns]
+        if missing:
+            raise ValueError(f"Faltan columnas: {missing}")
+        X = _transformar_X(X_df, self.x_cols, self.pt_x, self.robust)
+        y_t = self.forward(X)
+        return self.pt_y.inverse_transform(y_t.reshape(-1, 1)).flatten()
+
+    def predict_distribution(self, row: dict, samples: int = 50, seed: Optional[int] = None) -> Dict:
+        """MC-dropout: replicate the row `samples` times and run one forward pass with dropout on"""
+        X_df = pd.DataFrame([row])
+        missing = [col for col in self.x_cols if col not in X_df.columns]
+        if missing:
+            raise ValueError(f"Faltan columnas: {missing}")
+        X = np.repeat(_transformar_X(X_df, self.x_cols, self.pt_x, self.robust), samples, axis=0)
+        y_t = mlp_forward(self.layers, X, rng=np.random.default_rng(seed))
+        return resumir_incertidumbre(self.pt_y.inverse_transform(y_t.reshape(-1, 1)).flatten())
+
+
+class PackedModelStore:
+    """Read-only view over a packed model file, remapped when the file is replaced"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.PACKED_MODEL_STORE_PATH
+        self._lock = threading.Lock()
+        self._mm: Optional[mmap.mmap] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._data_start = 0
+        self._index: Dict[str, Dict] = {}
+        self._models: Dict[int, PackedMLP] = {}
+
+    def _ensure_mapped(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        key = (st.st_ino, st.st_mtime_ns)
+        if self._mm is not None and key == self._stat:
+            return True
+        with self._lock:
+            if self._mm is not None and key == self._stat:
+                return True
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:len(MAGIC)] != MAGIC:
+                mm.close()
+                raise ValueError(f"Not a packed model store: {self.path}")
+            (header_len,) = struct.unpack("<Q", mm[len(MAGIC):len(MAGIC) + 8])
+            header = json.loads(mm[len(MAGIC) + 8:len(MAGIC) + 8 + header_len])
+            # Old mapping is dropped, not closed: PackedMLP views may still reference it
+            self._mm = mm
+            self._data_start = _align(len(MAGIC) + 8 + header_len)
+            self._index = header["parcels"]
+            self._models = {}
+            self._stat = key
+            logger.info(f"Mapped packed model store {self.path} ({len(self._index)} parcels)")
+        return True
+
+    def _snapshot(self) -> Tuple[mmap.mmap, int, Dict[str, Dict], Dict[int, PackedMLP]]:
+        """Mapping, data start, index and model cache of the current pack, read together"""
+        with self._lock:
+            return self._mm, self._data_start, self._index, self._models
+
+    @staticmethod
+    def _array(mm: mmap.mmap, data_start: int, spec: Dict) -> np.ndarray:
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"])) if spec["shape"] else 1
+        return np.frombuffer(mm, dtype=dtype, count=count, offset=data_start + spec["offset"]).reshape(spec["shape"])
+
+    def version_of(self, parcel_id: int) -> Optional[int]:
+        """Model version packed for this parcel (None if the parcel isn't in the pack)"""
+        if not self._ensure_mapped():
+            return None
+        info = self._snapshot()[2].get(str(parcel_id))
+        return info["model_version"] if info else None
+
+    def get(self, parcel_id: int) -> Optional[PackedMLP]:
+        """Model for a parcel backed by the shared mapping (None if not packed)"""
+        if not self._ensure_mapped():
+            return None
+        # A remap swaps all four at once: never mix an index with another pack's mapping
+        mm, data_start, index, models = self._snapshot()
+        model = models.get(int(parcel_id))
+        if model is not None:
+            return model
+        info = index.get(str(parcel_id))
+        if info is None:
+            return None
+        t = info["transformers"]
+        start = data_start + t["offset"]
+        transformers = joblib.load(io.BytesIO(mm[start:start + t["length"]]))
+        layers = [
+            {
+                "kernel": self._array(mm, data_start, layer["kernel"]),
+                "bias": self._array(mm, data_start, layer["bias"]),
+                "scale": layer.get("scale"),
+                "activation": layer["activation"],
+                "dropout": layer["dropout"],
+            }
+            for layer in info["layers"]
+        ]
+        model = PackedMLP(layers, info["x_cols"], transformers, info["model_version"])
+        models[int(parcel_id)] = model
+        return model
+
+
+# Create global instance
+packed_model_store = PackedModelStore()
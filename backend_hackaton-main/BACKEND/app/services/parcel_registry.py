@@ -0,0 +1,177 @@
+"""
+Parcel registry
+Parcels are registered once with their polygon; the canonical geometry,
+area, bounding box and MODIS cell membership are computed at that point and
+every later request references the parcel by id
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.database.database import SessionLocal
+from app.database.models import Parcel
+from app.services import geometry
+from app.services.spatial_index import parcel_index
+
+logger = logging.getLogger(__name__)
+
+
+class ParcelRegistry:
+    """Parcels table with an in-memory cache of the rows already read (expiring after ttl_seconds)"""
+
+    def __init__(self, session_factory=SessionLocal, ttl_seconds: Optional[float] = None):
+        self.session_factory = session_factory
+        self.ttl_seconds = settings.PARCEL_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        # parcel id -> (monotonic expiry, entry)
+        self._cache: Dict[int, Tuple[float, Dict]] = {}
+        self._by_hash: Dict[str, int] = {}
+
+    @staticmethod
+    def _to_dict(parcel: Parcel) -> Dict:
+        return {
+            "id": parcel.id,
+            "name": parcel.name,
+            "coordinates": parcel.coordinates,
+            "geometry_hash": parcel.geometry_hash,
+            "area_hectares": parcel.area_hectares,
+            "bbox": [parcel.min_lon, parcel.min_lat, parcel.max_lon, parcel.max_lat],
+            "centroid": [parcel.centroid_lon, parcel.centroid_lat],
+            "modis_cells": parcel.modis_cells or [],
+            "modis_tiles": parcel.modis_tiles or [],
+            "model_version": parcel.model_version,
+            "created_at": parcel.created_at.isoformat() if parcel.created_at else None,
+            "updated_at": parcel.updated_at.isoformat() if parcel.updated_at else None,
+        }
+
+    @staticmethod
+    def describe(coordinates: List[List[float]], parcel_id: Optional[int] = None,
+                 prepared: Optional[Dict] = None) -> Dict:
+        """Canonical geometry and metadata for a polygon, without storing it (unregistered parcels)"""
+        return {"id": parcel_id, "name": None, "model_version": None, **geometry.describe(coordinates, prepared)}
+
+    @staticmethod
+    def _apply_geometry(parcel: Parcel, coordinates: List[List[float]], prepared: Optional[Dict] = None):
+        meta = geometry.describe(coordinates, prepared)
+        parcel.coordinates = meta["coordinates"]
+        parcel.geometry_hash = meta["geometry_hash"]
+        parcel.area_hectares = meta["area_hectares"]
+        parcel.min_lon, parcel.min_lat, parcel.max_lon, parcel.max_lat = meta["bbox"]
+        parcel.centroid_lon, parcel.centroid_lat = meta["centroid"]
+        parcel.modis_cells = meta["modis_cells"]
+        parcel.modis_tiles = meta["modis_tiles"]
+
+    def _remember(self, entry: Dict) -> Dict:
+        with self._lock:
+            self._cache[entry["id"]] = (time.monotonic() + self.ttl_seconds, entry)
+            if entry.get("geometry_hash"):
+                self._by_hash[entry["geometry_hash"]] = entry["id"]
+        return entry
+
+    def get(self, parcel_id: int) -> Optional[Dict]:
+        """Registered parcel (None if unknown or the database is unavailable)"""
+        with self._lock:
+            cached = self._cache.get(parcel_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        db = self.session_factory()
+        try:
+            parcel = db.get(Parcel, parcel_id)
+            return self._remember(self._to_dict(parcel)) if parcel is not None else None
+        except Exception as e:
+            logger.warning(f"Parcel registry unavailable: {e}")
+            return None
+        finally:
+            db.close()
+
+    def find_by_geometry(self, geometry_hash: str) -> Optional[Dict]:
+        """Registered parcel with exactly this canonical geometry, if any"""
+        with self._lock:
+            parcel_id = self._by_hash.get(geometry_hash)
+        if parcel_id is not None:
+            entry = self.get(parcel_id)
+            # The parcel's geometry may have been replaced since
+            if entry is not None and entry["geometry_hash"] == geometry_hash:
+                return entry
+        db = self.session_factory()
+        try:
+            parcel = db.query(Parcel).filter(Parcel.geometry_hash == geometry_hash).order_by(Parcel.id).first()
+            return self._remember(self._to_dict(parcel)) if parcel is not None else None
+        except Exception as e:
+            logger.warning(f"Parcel registry unavailable: {e}")
+            return None
+        finally:
+            db.close()
+
+    def list(self, limit: int = 100, offset: int = 0) -> List[Dict]:
+        db = self.session_factory()
+        try:
+            parcels = db.query(Parcel).order_by(Parcel.id).offset(offset).limit(limit).all()
+            return [self._remember(self._to_dict(p)) for p in parcels]
+        finally:
+            db.close()
+
+    def search(self, bbox: Optional[List[float]] = None, point: Optional[List[float]] = None) -> List[Dict]:
+        """Registered parcels intersecting a [min_lon, min_lat, max_lon, max_lat] box or containing a [lon, lat] point"""
+        ids = parcel_index.intersecting(bbox) if bbox is not None else parcel_index.containing(*point)
+        return [entry for entry in map(self.get, ids) if entry is not None]
+
+    def create(self, coordinates: List[List[float]], parcel_id: Optional[int] = None,
+               name: Optional[str] = None, prepared: Optional[Dict] = None) -> Dict:
+        """
+        Register a parcel and precompute its geometry metadata
+
+        Args:
+            coordinates: Polygon ring [[lon, lat], ...]
+            parcel_id: Explicit id (e.g. one already used by the feature store); autoincrement if None
+            name: Optional display name
+            prepared: prepare_polygon result for these coordinates, if already computed
+
+        Returns:
+            The stored parcel
+        """
+        db = self.session_factory()
+        try:
+            parcel = Parcel(id=parcel_id, name=name)
+            self._apply_geometry(parcel, coordinates, prepared)
+            db.add(parcel)
+            db.commit()
+            db.refresh(parcel)
+            logger.info(f"Registered parcel {parcel.id} ({parcel.area_hectares:.2f} ha, {len(parcel.modis_cells)} MODIS cells)")
+            return self._remember(self._to_dict(parcel))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def update(self, parcel_id: int, coordinates: Optional[List[List[float]]] = None,
+               name: Optional[str] = None, model_version: Optional[int] = None,
+               prepared: Optional[Dict] = None) -> Optional[Dict]:
+        """Replace the geometry (recomputing its metadata), name or model version; None if unknown"""
+        db = self.session_factory()
+        try:
+            parcel = db.get(Parcel, parcel_id)
+            if parcel is None:
+                return None
+            if coordinates is not None:
+                self._apply_geometry(parcel, coordinates, prepared)
+            if name is not None:
+                parcel.name = name
+            if model_version is not None:
+                parcel.model_version = model_version
+            db.commit()
+            db.refresh(parcel)
+            return self._remember(self._to_dict(parcel))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+# Create global instance
+parcel_registry = ParcelRegistry()
@@ -0,0 +1,242 @@
+"""
+Similarity index over parcel feature signatures
+Serves blended predictions from the most similar trained parcels to parcels
+that do not have a model of their own yet (cold start)
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from app.core.config import settings
+from app.services.feature_engineering import SEASONS, season_for_month
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import (
+    cached_prediction, predict_flowering_batch, predict_flowering_distribution, resumir_incertidumbre,
+    version_servida
+)
+from app.services.model_registry import model_registry
+from app.services.packed_model_store import packed_model_store
+
+logger = logging.getLogger(__name__)
+
+# Features that describe a parcel's vegetation and climate regime
+SIGNATURE_COLUMNS = [
+    'NDVI', 'EVI', 'LST_day', 'LST_night', 'precip_30d', 'precip_90d', 'ET_estimate',
+    'water_balance_30d', 'water_balance_90d'
+]
+
+# Parcels whose seasonal query signatures are kept in memory
+MAX_CACHED_SIGNATURES = 4096
+
+
+class ParcelSimilarityIndex:
+    """
+    One KD-tree per season over z-scored seasonal mean signatures of trained parcels
+
+    A parcel is compared with the others in the season of its observation, so
+    a winter reading is never matched against summer climatologies. The index
+    is rebuilt whenever the set of trained parcels (or their versions) changes.
+    """
+
+    def __init__(self, store=feature_store, registry=model_registry):
+        self.store = store
+        self.registry = registry
+        # _lock guards the (registry key, trees) snapshot; _build_lock lets one thread rebuild at a time
+        self._lock = threading.Lock()
+        self._build_lock = threading.RLock()
+        # season -> (tree, parcel ids, mean, std)
+        self._state: Tuple[Optional[Tuple], Dict[str, Tuple[KDTree, np.ndarray, np.ndarray, np.ndarray]]] = (None, {})
+        # (registry generation, key) so the manifest is only listed again after it changed
+        self._key_cache: Tuple[Optional[int], Tuple] = (None, ())
+        # parcel id -> (store version of its history, season -> mean signature), LRU
+        self._signatures: "OrderedDict[int, Tuple[int, Dict[str, np.ndarray]]]" = OrderedDict()
+
+    def _registry_key(self) -> Tuple:
+        generation = self.registry.generation()
+        cached_generation, key = self._key_cache
+        if cached_generation == generation:
+            return key
+        # Legacy entries have no transformers of their own and cannot serve other parcels
+        key = tuple(sorted((e["parcel_id"], e["version"]) for e in self.registry.list() if e.get("pt_x_path")))
+        self._key_cache = (generation, key)
+        return key
+
+    def _build(self, trained: List[int]) -> Dict:
+        trees = {}
+        if trained:
+            df = self.store.read(columns=['parcel_id', 'month'] + SIGNATURE_COLUMNS, parcel_ids=trained)
+            if not df.empty:
+                df['season'] = df['month'].map(season_for_month)
+                signatures = df.groupby(['season', 'parcel_id'])[SIGNATURE_COLUMNS].mean()
+                for season in SEASONS:
+                    if season not in signatures.index.get_level_values('season'):
+                        continue
+                    sig = signatures.xs(season, level='season')
+                    values = sig.to_numpy(dtype=np.float64)
+                    mean = np.nanmean(values, axis=0)
+                    std = np.nanstd(values, axis=0)
+                    std[~np.isfinite(std) | (std == 0)] = 1.0
+                    mean[~np.isfinite(mean)] = 0.0
+                    trees[season] = (KDTree(self._normalize(values, mean, std)), sig.index.to_numpy(), mean, std)
+        return trees
+
+    def rebuild(self) -> Dict:
+        """Recompute the signatures of every trained parcel and swap in the new trees"""
+        with self._build_lock:
+            key = self._registry_key()
+            trees = self._build([pid for pid, _ in key])
+            with self._lock:
+                self._state = (key, trees)
+        logger.info(f"Parcel similarity index built for {len(key)} trained parcels")
+        return trees
+
+    def _current_trees(self) -> Dict:
+        """Trees for the current set of trained parcels, rebuilt once if it changed"""
+        key = self._registry_key()
+        with self._lock:
+            built_key, trees = self._state
+        if built_key == key:
+            return trees
+        with self._build_lock:
+            # Another request may have rebuilt the index while this one waited
+            with self._lock:
+                built_key, trees = self._state
+            return trees if built_key == key else self.rebuild()
+
+    @staticmethod
+    def _normalize(values: np.ndarray, mean: np.ndarray, std: np.ndarray) -> np.ndarray:
+        # Missing features sit at the population mean (0 after z-scoring)
+        return np.nan_to_num((values - mean) / std, nan=0.0)
+
+    def _stored_signatures(self, parcel_id: int) -> Dict[str, np.ndarray]:
+        """Seasonal mean signatures of a parcel's stored history, cached until the parcel gets new rows"""
+        version = self.store.parcel_version(parcel_id)
+        if version is None:
+            return {}
+        with self._lock:
+            cached = self._signatures.get(parcel_id)
+            if cached is not None and cached[0] == version:
+                self._signatures.move_to_end(parcel_id)
+                return cached[1]
+        df = self.store.read(columns=['month'] + SIGNATURE_COLUMNS, parcel_ids=[parcel_id])
+        seasons = df['month'].map(season_for_month)
+        signatures = {season: group[SIGNATURE_COLUMNS].mean().to_numpy(dtype=np.float64)
+                      for season, group in df.groupby(seasons)}
+        with self._lock:
+            self._signatures[parcel_id] = (version, signatures)
+            self._signatures.move_to_end(parcel_id)
+            while len(self._signatures) > MAX_CACHED_SIGNATURES:
+                self._signatures.popitem(last=False)
+        return signatures
+
+    def _query_signature(self, features: Dict, parcel_id: Optional[int], season: str) -> np.ndarray:
+        """Seasonal mean of the parcel's stored history if there is one, otherwise the given reading"""
+        if parcel_id is not None:
+            signature = self._stored_signatures(parcel_id).get(season)
+            if signature is not None:
+                return signature
+        return np.array([features.get(c) if features.get(c) is not None else np.nan
+                         for c in SIGNATURE_COLUMNS], dtype=np.float64)
+
+    def neighbors(self, features: Dict, parcel_id: Optional[int] = None, k: Optional[int] = None) -> List[Dict]:
+        """
+        Find the k trained parcels most similar to a parcel
+
+        Args:
+            features: Current feature reading of the parcel (needs ``month`` or uses today)
+            parcel_id: Parcel being served; excluded from its own neighbours
+            k: Number of neighbours (defaults to SIMILAR_PARCELS_K)
+
+        Returns:
+            Neighbours sorted by distance with inverse-distance blending weights
+        """
+        trees = self._current_trees()
+        season = season_for_month(features.get("month") or datetime.utcnow().month)
+        if season not in trees:
+            return []
+        tree, ids, mean, std = trees[season]
+        k = k or settings.SIMILAR_PARCELS_K
+        query = self._normalize(self._query_signature(features, parcel_id, season), mean, std)
+        n = min(len(ids), k + (1 if parcel_id is not None else 0))
+        dist, idx = tree.query(query.reshape(1, -1), k=n)
+        found = [(float(d), int(ids[i])) for d, i in zip(dist[0], idx[0]) if parcel_id is None or ids[i] != parcel_id]
+        found = found[:k]
+        inv = np.array([1.0 / (d + 1e-6) for d, _ in found])
+        weights = inv / inv.sum() if len(found) else inv
+        return [{"parcel_id": pid, "distance": d, "weight": float(w)} for (d, pid), w in zip(found, weights)]
+
+
+def _current_neighbors(neighbors: Sequence[Dict]) -> List[Tuple[Dict, Dict]]:
+    """
+    Neighbours that still have a model in the manifest, paired with their entry
+
+    A model can be removed between finding the neighbours and predicting with
+    them; the remaining weights are renormalised to sum to one.
+    """
+    current = [(n, model_registry.get(n["parcel_id"])) for n in neighbors]
+    current = [(n, entry) for n, entry in current if entry is not None]
+    if not current:
+        raise ValueError("None of the similar parcels has a model anymore")
+    total = sum(n["weight"] for n, _ in current)
+    return [({**n, "weight": n["weight"] / total}, entry) for n, entry in current]
+
+
+def _predict_with(parcel_id: int, entry: Dict, rows: List[dict]) -> np.ndarray:
+    """Days to flowering from one trained parcel's model (mmapped pack when it is current)"""
+    if packed_model_store.version_of(parcel_id) == entry["version"]:
+        return packed_model_store.get(parcel_id).predict_days(rows)
+    return predict_flowering_batch(rows, entry=entry)
+
+
+def _distribution_with(parcel_id: int, entry: Dict, row: dict, samples: int) -> Dict:
+    """MC-dropout summary of one trained parcel's model (cached like its own predictions)"""
+    if packed_model_store.version_of(parcel_id) == entry["version"]:
+        return cached_prediction(
+            f"packed:{parcel_id}", version_servida(packed_model_store.path, entry), row,
+            lambda: packed_model_store.get(parcel_id).predict_distribution(row, samples=samples),
+            samples=samples
+        )
+    return predict_flowering_distribution(row, entry=entry, samples=samples)
+
+
+def predict_blended(rows: List[dict], neighbors: Sequence[Dict]) -> np.ndarray:
+    """Weighted mean of the neighbours' predictions for every row"""
+    current = _current_neighbors(neighbors)
+    preds = np.stack([_predict_with(n["parcel_id"], entry, rows) for n, entry in current])
+    weights = np.array([n["weight"] for n, _ in current]).reshape(-1, 1)
+    return (preds * weights).sum(axis=0)
+
+
+def blended_distribution(input_dict: dict, neighbors: Sequence[Dict], samples: int = 50) -> Dict:
+    """
+    Uncertainty of a blended prediction as a mixture of the neighbours' distributions
+
+    Each neighbour is a normal with its own MC-dropout mean and spread, widened to
+    at least SIMILAR_MIN_STD_DAYS * (1 + distance) because a borrowed model is less
+    certain about a parcel the further that parcel is from the ones it was trained on.
+    Neighbours contribute quantile points in proportion to their weight, so
+    disagreement between them widens the interval as well.
+    """
+    current = _current_neighbors(neighbors)
+    means, points = [], []
+    for n, entry in current:
+        dist = _distribution_with(n["parcel_id"], entry, input_dict, samples)
+        spread = max(dist["std_days"], settings.SIMILAR_MIN_STD_DAYS * (1.0 + n["distance"]))
+        count = max(1, int(round(n["weight"] * samples)))
+        z = np.array([NormalDist().inv_cdf((j + 0.5) / count) for j in range(count)])
+        means.append(dist["mean_days"])
+        points.append(dist["mean_days"] + spread * z)
+    resumen = resumir_incertidumbre(np.concatenate(points))
+    resumen["mean_days"] = float(np.dot(means, [n["weight"] for n, _ in current]))
+    return resumen
+
+
+# Create global instance
+parcel_similarity_index = ParcelSimilarityIndex()
@@ -0,0 +1,136 @@
+"""
+Small dependency graph of async stages sharing one end-to-end deadline
+Stages start as soon as their dependencies resolve, so independent work
+(e.g. Earth Engine extraction and model loading) overlaps; whatever has not
+finished when the budget runs out is cancelled and reported as such
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Stage outcomes reported by Pipeline.summary()
+OK, ERROR, TIMEOUT, SKIPPED = "ok", "error", "timeout", "skipped"
+
+
+class Deadline:
+    """Absolute point in time derived from a budget in seconds"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._start = time.monotonic()
+        self._end = self._start + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self._end - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class Pipeline:
+    """
+    Named stages started as asyncio tasks
+
+    ``add(name, func, after=deps)`` schedules ``func(*results_of_deps)`` right
+    away; the task first waits for its dependencies. ``run()`` waits for every
+    stage until the deadline and cancels the rest. Blocking work should be
+    wrapped in ``asyncio.to_thread`` by the caller: a cancelled thread keeps
+    running in the background, but the response no longer waits for it.
+    """
+
+    def __init__(self, deadline_seconds: float):
+        self.deadline = Deadline(deadline_seconds)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._after: Dict[str, Sequence[str]] = {}
+        self._seconds: Dict[str, float] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], after: Sequence[str] = (),
+            timeout: Optional[float] = None) -> "Pipeline":
+        """
+        Schedule a stage
+
+        Args:
+            name: Stage name (key of the results and of the summary)
+            func: Coroutine function called with the results of ``after`` in order
+            after: Stages this one depends on (must have been added already)
+            timeout: Optional cap for this stage on top of the shared deadline
+        """
+        deps = [self._tasks[d] for d in after]
+
+        async def run():
+            inputs = [await d for d in deps]
+            start = time.monotonic()
+            limit = self.deadline.remaining() if timeout is None else min(timeout, self.deadline.remaining())
+            try:
+                return await asyncio.wait_for(func(*inputs), timeout=limit)
+            finally:
+                self._seconds[name] = round(time.monotonic() - start, 3)
+
+        self._after[name] = tuple(after)
+        self._tasks[name] = asyncio.ensure_future(run())
+        return self
+
+    async def run(self) -> "Pipeline":
+        """Wait for all stages until the deadline, then cancel whatever is still pending"""
+        done, pending = await asyncio.wait(self._tasks.values(), timeout=self.deadline.remaining())
+        for task in pending:
+            task.cancel()
+        if pending:
+            late = [name for name, task in self._tasks.items() if task in pending]
+            logger.warning(f"Deadline of {self.deadline.seconds}s reached, cancelled stages: {late}")
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            # Mark errors as retrieved; they are reported through status()/result()
+            if not task.cancelled():
+                task.exception()
+        return self
+
+    def status(self, name: str) -> str:
+        task = self._tasks[name]
+        if any(self.status(d) != OK for d in self._after[name]):
+            return SKIPPED
+        if task.cancelled():
+            return TIMEOUT
+        error = task.exception()
+        if error is None:
+            return OK
+        return TIMEOUT if isinstance(error, asyncio.TimeoutError) else ERROR
+
+    def ok(self, name: str) -> bool:
+        return self.status(name) == OK
+
+    def result(self, name: str) -> Any:
+        """Result of a finished stage, None if it timed out or was skipped; re-raises stage errors"""
+        status = self.status(name)
+        if status == ERROR:
+            raise self._tasks[name].exception()
+        return self._tasks[name].result() if status == OK else None
+
+    def raise_errors(self):
+        """Re-raise the first stage error (in the order stages were added)"""
+        for name in self._tasks:
+            if self.status(name) == ERROR:
+                raise self._tasks[name].exception()
+
+    @property
+    def partial(self) -> bool:
+        return any(self.status(name) != OK for name in self._tasks)
+
+    def summary(self) -> Dict:
+        """Per-stage outcome and duration plus the overall budget usage"""
+        return {
+            "deadline_seconds": self.deadline.seconds,
+            "elapsed_seconds": round(self.deadline.elapsed(), 3),
+            "partial": self.partial,
+            "stages": {
+                name: {"status": self.status(name), "seconds": self._seconds.get(name)}
+                for name in self._tasks
+            },
+        }
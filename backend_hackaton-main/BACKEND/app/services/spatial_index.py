@@ -0,0 +1,284 @@
+"""
+In-memory spatial index over parcels
+A packed STR (Sort-Tile-Recursive) R-tree answers bbox and point queries in
+logarithmic time; rows written after the last build go to a small delta that
+is scanned linearly until it is large enough to justify a rebuild. The
+index follows the database through session events, so only committed
+changes are visible. Bloom detections are filtered in SQL by their geohash
+and bounds columns instead (see bloom_detector.get_bloom_history).
+"""
+
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.database.database import SessionLocal
+from app.database.models import Parcel
+from app.services import geometry
+
+logger = logging.getLogger(__name__)
+
+BBox = Tuple[float, float, float, float]
+
+# Children per tree node
+NODE_CAPACITY = 16
+# The tree is rebuilt once the delta exceeds this fraction of the entries (or REBUILD_MIN_CHANGES)
+REBUILD_FRACTION = 0.1
+REBUILD_MIN_CHANGES = 256
+
+
+def _str_order(boxes: np.ndarray, capacity: int) -> np.ndarray:
+    """Sort-Tile-Recursive order: vertical slices by x centre, each slice sorted by y centre"""
+    n = len(boxes)
+    if n <= capacity:
+        return np.arange(n)
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    slices = math.ceil(math.sqrt(math.ceil(n / capacity)))
+    slice_size = capacity * math.ceil(math.ceil(n / capacity) / slices)
+    by_x = np.argsort(cx, kind="mergesort")
+    slice_of = np.empty(n, dtype=np.int64)
+    slice_of[by_x] = np.arange(n) // slice_size
+    return np.lexsort((cy, slice_of))
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(s, e) for every (s, e) pair"""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(total) + offsets
+
+
+def _intersects(boxes: np.ndarray, bbox: Sequence[float]) -> np.ndarray:
+    return ((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0])
+            & (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1]))
+
+
+class STRTree:
+    """
+    Static R-tree packed bottom-up with the STR algorithm
+
+    Every level is a flat array of node boxes whose children are a contiguous
+    range of the level below (the items themselves for the lowest level), so
+    a query is a handful of vectorised box tests per level.
+    """
+
+    def __init__(self, ids: Sequence[int], boxes: np.ndarray, node_capacity: int = NODE_CAPACITY):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        order = _str_order(boxes, node_capacity)
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.boxes = boxes[order]
+        # Bottom-up list of (node boxes, first child, end of children)
+        self.levels: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        current = self.boxes
+        while len(current) > node_capacity:
+            starts = np.arange(0, len(current), node_capacity)
+            ends = np.minimum(starts + node_capacity, len(current))
+            nodes = np.column_stack([
+                np.minimum.reduceat(current[:, 0], starts), np.minimum.reduceat(current[:, 1], starts),
+                np.maximum.reduceat(current[:, 2], starts), np.maximum.reduceat(current[:, 3], starts),
+            ])
+            order = _str_order(nodes, node_capacity)
+            self.levels.append((nodes[order], starts[order], ends[order]))
+            current = nodes[order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def query(self, bbox: Sequence[float]) -> np.ndarray:
+        """Ids of the items whose box intersects bbox"""
+        if not len(self.ids):
+            return self.ids
+        if not self.levels:
+            return self.ids[_intersects(self.boxes, bbox)]
+        top = self.levels[-1][0]
+        hits = np.flatnonzero(_intersects(top, bbox))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            _, starts, ends = self.levels[depth]
+            children = _ranges(starts[hits], ends[hits])
+            below = self.levels[depth - 1][0] if depth > 0 else self.boxes
+            hits = children[_intersects(below[children], bbox)]
+        return self.ids[hits]
+
+
+class SpatialIndex:
+    """
+    STR tree plus a delta of recent changes, loaded lazily from the database
+
+    Entries are ``id -> (box, shape)``; the shape ([lon, lat] ring) is used to
+    refine box candidates exactly and may be None when the box is the geometry.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Iterable[Tuple[int, BBox, Optional[list]]]],
+                 node_capacity: int = NODE_CAPACITY):
+        self.name = name
+        self.loader = loader
+        self.node_capacity = node_capacity
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._entries: Dict[int, Tuple[BBox, Optional[np.ndarray]]] = {}
+        self._tree = STRTree([], np.empty((0, 4)), node_capacity)
+        # Changed since the last build: new boxes to scan, and tree ids to ignore
+        self._delta: Dict[int, BBox] = {}
+        self._stale: set = set()
+
+    def load(self):
+        """Read the committed rows now instead of on the first query (blocking: call it off the event loop)"""
+        self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            entries = {}
+            for entry_id, box, shape in self.loader():
+                entries[entry_id] = (tuple(box), None if shape is None else geometry.open_ring(shape))
+            self._entries = entries
+            self._rebuild()
+            self._loaded = True
+            logger.info(f"Spatial index '{self.name}' loaded with {len(entries)} entries")
+
+    def _rebuild(self):
+        ids = list(self._entries)
+        boxes = np.array([self._entries[i][0] for i in ids], dtype=np.float64).reshape(-1, 4)
+        self._tree = STRTree(ids, boxes, self.node_capacity)
+        self._delta = {}
+        self._stale = set()
+
+    def _maybe_rebuild(self):
+        changes = len(self._delta) + len(self._stale)
+        if changes > max(REBUILD_MIN_CHANGES, REBUILD_FRACTION * len(self._entries)):
+            self._rebuild()
+
+    def upsert(self, entry_id: int, box: Optional[Sequence[float]], shape: Optional[list] = None):
+        """Insert or replace an entry (removes it when it has no box)"""
+        if box is None:
+            return self.remove(entry_id)
+        with self._lock:
+            if not self._loaded:
+                # The first query reads the committed rows anyway
+                return
+            self._entries[entry_id] = (tuple(box), None if shape is None else geometry.open_ring(shape))
+            self._delta[entry_id] = tuple(box)
+            self._stale.add(entry_id)
+            self._maybe_rebuild()
+
+    def remove(self, entry_id: int):
+        with self._lock:
+            if not self._loaded or self._entries.pop(entry_id, None) is None:
+                return
+            self._delta.pop(entry_id, None)
+            self._stale.add(entry_id)
+            self._maybe_rebuild()
+
+    def reset(self):
+        """Forget everything; the next query reloads from the database"""
+        with self._lock:
+            self._loaded = False
+            self._entries = {}
+            self._rebuild()
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._entries)
+
+    def candidates(self, bbox: Sequence[float]) -> List[int]:
+        """Ids whose bounding box intersects bbox"""
+        self._ensure_loaded()
+        with self._lock:
+            hits = [int(i) for i in self._tree.query(bbox) if int(i) not in self._stale]
+            hits.extend(i for i, box in self._delta.items() if box[0] <= bbox[2] and box[2] >= bbox[0]
+                        and box[1] <= bbox[3] and box[3] >= bbox[1])
+        return sorted(hits)
+
+    def intersecting(self, bbox: Sequence[float]) -> List[int]:
+        """Ids whose geometry intersects bbox"""
+        result = []
+        for entry_id in self.candidates(bbox):
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            if entry[1] is None or geometry.polygon_intersects_bbox(entry[1], bbox):
+                result.append(entry_id)
+        return result
+
+    def containing(self, lon: float, lat: float) -> List[int]:
+        """Ids whose geometry contains the point"""
+        result = []
+        for entry_id in self.candidates((lon, lat, lon, lat)):
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            ring = entry[1]
+            if ring is None or geometry.points_in_polygon(np.array([lon]), np.array([lat]), ring[:, 0], ring[:, 1])[0]:
+                result.append(entry_id)
+        return result
+
+
+def _parcel_entry(parcel) -> Tuple[int, Optional[BBox], Optional[list]]:
+    if parcel.min_lon is None or not parcel.coordinates:
+        return parcel.id, None, None
+    return parcel.id, (parcel.min_lon, parcel.min_lat, parcel.max_lon, parcel.max_lat), parcel.coordinates
+
+
+def _load_parcels():
+    db = SessionLocal()
+    try:
+        rows = db.query(Parcel.id, Parcel.coordinates, Parcel.min_lon, Parcel.min_lat,
+                        Parcel.max_lon, Parcel.max_lat).all()
+        return [entry for entry in map(_parcel_entry, rows) if entry[1] is not None]
+    except Exception as e:
+        logger.warning(f"Could not load parcels into the spatial index: {e}")
+        return []
+    finally:
+        db.close()
+
+
+parcel_index = SpatialIndex("parcels", _load_parcels)
+
+
+# Keep the index in sync with committed rows: changes are collected on
+# flush and applied on commit, so rolled back writes never reach it
+def _spatial_change(obj, deleted: bool = False):
+    """(index, id, box, shape) for a flushed Parcel, None for other rows"""
+    if isinstance(obj, Parcel):
+        return (parcel_index, obj.id, None, None) if deleted else (parcel_index, *_parcel_entry(obj))
+    return None
+
+
+# Columns whose change moves a row in its index
+_SPATIAL_COLUMNS = {Parcel: ("coordinates", "min_lon", "min_lat", "max_lon", "max_lat")}
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_spatial_changes(session, flush_context):
+    changes = session.info.setdefault("spatial_changes", [])
+    for obj in session.dirty:
+        columns = _SPATIAL_COLUMNS.get(type(obj), ())
+        state = inspect(obj)
+        if any(state.attrs[c].history.has_changes() for c in columns):
+            changes.append(_spatial_change(obj))
+    changes.extend(_spatial_change(obj) for obj in session.new)
+    changes.extend(_spatial_change(obj, deleted=True) for obj in session.deleted)
+    changes[:] = [c for c in changes if c is not None]
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_spatial_changes(session):
+    for index, entry_id, box, shape in session.info.pop("spatial_changes", []):
+        index.upsert(entry_id, box, shape)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_spatial_changes(session, previous_transaction):
+    session.info.pop("spatial_changes", None)
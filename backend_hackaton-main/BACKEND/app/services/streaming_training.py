@@ -0,0 +1,228 @@
+"""
+Entrenamiento en streaming del modelo de floración.
+El feature store se lee por bloques de parcelas y se alimenta a model.fit con tf.data,
+de modo que la memoria no crece con el número de parcelas ni de años.
+"""
+
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from sklearn.preprocessing import PowerTransformer, RobustScaler
+
+from app.services.feature_engineering import derive_features
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import (
+    BASE_MODEL_DIR, COLS_X, CYCLIC, HIPERPARAMETROS_BASE, _callbacks, build_model, preparar_con_fechas_reales
+)
+
+# Resolución del hash que reparte filas entre entrenamiento y validación
+_SPLIT_BUCKETS = 10_000
+
+
+def _es_validacion(df: pd.DataFrame, val_fraction: float) -> np.ndarray:
+    """Split determinista por (parcela, fecha): la misma fila cae siempre del mismo lado en cada época."""
+    h = pd.util.hash_pandas_object(df[['parcel_id', 'date']], index=False).to_numpy()
+    return (h % _SPLIT_BUCKETS) < int(val_fraction * _SPLIT_BUCKETS)
+
+
+def _yeo_johnson_tf(x: tf.Tensor, lambdas: np.ndarray) -> tf.Tensor:
+    """Transformación Yeo-Johnson columna a columna con las lambdas ya ajustadas (equivale a sklearn)."""
+    lmb = tf.constant(lambdas, dtype=tf.float32)
+    pos = x >= 0
+    lmb_cero = tf.abs(lmb) < 1e-8
+    lmb_dos = tf.abs(lmb - 2.0) < 1e-8
+    xp = tf.where(pos, x, tf.zeros_like(x))
+    xn = tf.where(pos, tf.zeros_like(x), -x)
+    lmb_seguro = tf.where(lmb_cero, tf.ones_like(lmb), lmb)
+    dos_menos = tf.where(lmb_dos, tf.ones_like(lmb), 2.0 - lmb)
+    rama_pos = tf.where(lmb_cero, tf.math.log1p(xp), (tf.pow(xp + 1.0, lmb_seguro) - 1.0) / lmb_seguro)
+    rama_neg = tf.where(lmb_dos, -tf.math.log1p(xn), -(tf.pow(xn + 1.0, dos_menos) - 1.0) / dos_menos)
+    return tf.where(pos, rama_pos, rama_neg)
+
+
+def _power_transform_tf(pt: PowerTransformer):
+    """Devuelve una función TF equivalente a pt.transform (Yeo-Johnson + estandarización)."""
+    media = tf.constant(pt._scaler.mean_, dtype=tf.float32) if pt.standardize else 0.0
+    escala = tf.constant(pt._scaler.scale_, dtype=tf.float32) if pt.standardize else 1.0
+    return lambda x: (_yeo_johnson_tf(x, pt.lambdas_) - media) / escala
+
+
+def _transformacion_tf(X_cols: List[str], pt_x: PowerTransformer, robust: RobustScaler, pt_y: PowerTransformer):
+    """
+    Construye el map de tf.data que aplica los transformadores ajustados a cada batch.
+    Es el mismo cálculo que _transformar_X, pero en operaciones TF que corren en paralelo sin el GIL.
+    """
+    idx_pt = [i for i, c in enumerate(X_cols) if c not in CYCLIC]
+    idx_cyc = [i for i, c in enumerate(X_cols) if c in CYCLIC]
+    orden = np.argsort(idx_pt + idx_cyc)
+    tx = _power_transform_tf(pt_x) if idx_pt else None
+    ty = _power_transform_tf(pt_y)
+    centro = tf.constant(robust.center_, dtype=tf.float32) if idx_cyc else None
+    escala = tf.constant(robust.scale_, dtype=tf.float32) if idx_cyc else None
+
+    def transformar(X: tf.Tensor, y: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+        partes = []
+        if idx_pt:
+            partes.append(tx(tf.gather(X, idx_pt, axis=1)))
+        if idx_cyc:
+            partes.append((tf.gather(X, idx_cyc, axis=1) - centro) / escala)
+        Xt = tf.gather(tf.concat(partes, axis=1), orden, axis=1)
+        # NaN -> 0 e infinitos acotados a ±1e5, como np.nan_to_num en _transformar_X
+        Xt = tf.where(tf.math.is_nan(Xt), tf.zeros_like(Xt), tf.clip_by_value(Xt, -1e5, 1e5))
+        yt = tf.squeeze(ty(tf.expand_dims(y, -1)), -1)
+        return Xt, yt
+
+    return transformar
+
+
+def entrenar_modelo_streaming(
+    path_fechas: str = "fechas_floracion.csv",
+    parcel_ids: Optional[List[int]] = None,
+    years: Optional[Tuple[int, int]] = None,
+    parcels_per_chunk: int = 64,
+    fit_sample_rows: int = 50_000,
+    val_fraction: float = 0.2,
+    shuffle_buffer: int = 10_000,
+    seed: int = 42,
+    epochs: int = 200,
+    batch_size: int = 256,
+    output_dir: str = BASE_MODEL_DIR,
+) -> Dict:
+    """
+    Entrena el modelo de floración leyendo el feature store en bloques.
+
+    1. Primera pasada: cuenta filas y toma una muestra uniforme (bottom-k) de
+       como máximo `fit_sample_rows` filas de entrenamiento para ajustar pt_x/robust/pt_y.
+    2. Cada época vuelve a leer el store bloque a bloque (parcels_per_chunk parcelas),
+       calcula features y etiquetas, y tf.data mezcla, agrupa en batches, aplica los
+       transformadores en paralelo (map) y hace prefetch mientras entrena la época.
+    3. Las métricas de validación se acumulan batch a batch (sin materializar el split).
+
+    Guarda los mismos artefactos que entrenar_modelo_floracion, así que output_dir
+    puede usarse como base_dir para el fine-tuning por parcela.
+    Returns: dict con métricas y rutas guardadas.
+    """
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+    if not os.path.exists(path_fechas):
+        raise FileNotFoundError(f"No se encontró: {path_fechas}")
+    df_fechas = pd.read_csv(path_fechas)
+    X_cols = list(COLS_X)
+
+    def leer_bloques() -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        for chunk in feature_store.iter_parcels(columns=['parcel_id', 'date'] + COLS_X, parcel_ids=parcel_ids,
+                                                years=years, parcels_per_chunk=parcels_per_chunk):
+            df = preparar_con_fechas_reales(derive_features(chunk), df_fechas)
+            if df.empty:
+                continue
+            yield (df[X_cols].to_numpy(dtype=np.float32),
+                   df['days_to_flowering'].to_numpy(dtype=np.float32),
+                   _es_validacion(df, val_fraction))
+
+    def bloques(validacion: bool) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for X, y, es_val in leer_bloques():
+            mask = es_val == validacion
+            if mask.any():
+                yield X[mask], y[mask]
+
+    # -------------------- Pasada 1: muestra para ajustar transformadores --------------------
+    rng = np.random.default_rng(seed)
+    muestra_X = np.empty((0, len(X_cols)), dtype=np.float32)
+    muestra_y = np.empty((0,), dtype=np.float32)
+    claves = np.empty((0,), dtype=np.float64)
+    n_train = n_val = 0
+    for X, y, es_val in leer_bloques():
+        n_val += int(es_val.sum())
+        X, y = X[~es_val], y[~es_val]
+        n_train += len(y)
+        muestra_X = np.concatenate([muestra_X, X])
+        muestra_y = np.concatenate([muestra_y, y])
+        claves = np.concatenate([claves, rng.random(len(y))])
+        if len(claves) > fit_sample_rows:
+            keep = np.argpartition(claves, fit_sample_rows)[:fit_sample_rows]
+            muestra_X, muestra_y, claves = muestra_X[keep], muestra_y[keep], claves[keep]
+    if n_train == 0:
+        raise ValueError("El feature store no tiene datos con fecha de floración para las parcelas solicitadas.")
+    if n_val == 0:
+        raise ValueError("El split de validación quedó vacío; aumenta val_fraction o añade parcelas.")
+
+    df_muestra = pd.DataFrame(muestra_X, columns=X_cols)
+    pt_x = PowerTransformer(method='yeo-johnson', standardize=True)
+    robust = RobustScaler()
+    cols_pt = [c for c in X_cols if c not in CYCLIC]
+    cyc = [c for c in CYCLIC if c in X_cols]
+    if cols_pt:
+        pt_x.fit(df_muestra[cols_pt])
+    if cyc:
+        robust.fit(df_muestra[cyc])
+    pt_y = PowerTransformer(method='yeo-johnson', standardize=True)
+    pt_y.fit(muestra_y.reshape(-1, 1).astype(np.float64))
+    print(f"📊 Transformadores ajustados con {len(muestra_y)} de {n_train} filas de entrenamiento")
+
+    # -------------------- Pipeline tf.data --------------------
+    transformar = _transformacion_tf(X_cols, pt_x, robust, pt_y)
+    firma = (tf.TensorSpec(shape=(None, len(X_cols)), dtype=tf.float32),
+             tf.TensorSpec(shape=(None,), dtype=tf.float32))
+
+    def dataset(validacion: bool, filas: int) -> tf.data.Dataset:
+        ds = tf.data.Dataset.from_generator(lambda: bloques(validacion), output_signature=firma).unbatch()
+        if not validacion:
+            ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size).map(transformar, num_parallel_calls=tf.data.AUTOTUNE)
+        # Cardinalidad conocida desde la pasada 1: Keras muestra el progreso y no avisa de fin de datos
+        ds = ds.apply(tf.data.experimental.assert_cardinality(-(-filas // batch_size)))
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    train_ds, val_ds = dataset(False, n_train), dataset(True, n_val)
+
+    cfg = HIPERPARAMETROS_BASE
+    model = build_model(len(X_cols), lr=cfg["lr"], units=cfg["units"], dropout=cfg["dropout"], l2=cfg["l2"])
+    print(f"🚀 Entrenando en streaming ({n_train} filas de entrenamiento)...")
+    hist = model.fit(train_ds, validation_data=val_ds, epochs=epochs, callbacks=_callbacks(epochs), verbose=1)
+
+    # -------------------- Métricas (escala original: días), acumuladas por batch --------------------
+    n = suma_abs = suma_res2 = suma_y = suma_y2 = 0.0
+    for Xb, yb in val_ds:
+        y_true = pt_y.inverse_transform(yb.numpy().reshape(-1, 1)).flatten()
+        y_pred = pt_y.inverse_transform(model.predict_on_batch(Xb).reshape(-1, 1)).flatten()
+        n += len(y_true)
+        suma_abs += float(np.abs(y_true - y_pred).sum())
+        suma_res2 += float(((y_true - y_pred) ** 2).sum())
+        suma_y += float(y_true.sum())
+        suma_y2 += float((y_true ** 2).sum())
+    mae_days = suma_abs / n
+    ss_tot = suma_y2 - suma_y ** 2 / n
+    r2 = 1.0 - suma_res2 / ss_tot if ss_tot > 0 else 0.0
+    print(f"R2:  {r2:.4f}")
+    print(f"MAE: {mae_days:.2f} días")
+
+    # -------------------- Guardados --------------------
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "model": os.path.join(output_dir, "modelo_florecimiento.keras"),
+        "pt_x": os.path.join(output_dir, "pt_x.joblib"),
+        "robust": os.path.join(output_dir, "robust_scaler.joblib"),
+        "pt_y": os.path.join(output_dir, "pt_y.joblib"),
+        "x_cols": os.path.join(output_dir, "x_cols.json"),
+    }
+    model.save(paths["model"])
+    joblib.dump(pt_x, paths["pt_x"])
+    joblib.dump(robust, paths["robust"])
+    joblib.dump(pt_y, paths["pt_y"])
+    with open(paths["x_cols"], 'w', encoding="utf-8") as f:
+        json.dump(X_cols, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Guardado modelo en: {paths['model']}")
+
+    return {
+        "status": "trained streaming model",
+        "metrics": {"r2": r2, "mae_days": mae_days, "epochs_run": len(hist.history['loss']),
+                    "train_rows": n_train, "val_rows": int(n), "fit_sample_rows": int(len(muestra_y))},
+        "config": {**cfg, "units": list(cfg["units"]), "batch_size": batch_size,
+                   "parcels_per_chunk": parcels_per_chunk},
+        "paths": paths,
+    }
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Local OpenRouter stand-in for BloomWatch
+Answers /api/v1/chat/completions with a canned flowering analysis so the LLM
+path (pooling, concurrency limit, cache) can be exercised without an API key
+
+Usage:
+    python scripts/mock_openrouter.py [port] [delay_seconds]
+    OPENROUTER_BASE_URL=http://127.0.0.1:8081/api/v1 OPENROUTER_API_KEY=test uvicorn app.main:app
+"""
+
+import asyncio
+import json
+import re
+import sys
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+app = FastAPI(title="Mock OpenRouter")
+
+# Simulated provider latency (seconds), overridable from the command line
+DELAY = 0.5
+calls = {"count": 0}
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Return a JSON analysis that echoes the days/confidence found in the prompt"""
+    body = await request.json()
+    calls["count"] += 1
+    prompt = body["messages"][-1]["content"]
+    days = re.search(r"Días hasta floración: (\d+)", prompt)
+    confidence = re.search(r"Nivel de confianza: (\d+%)", prompt)
+    days = days.group(1) if days else "?"
+    confidence = confidence.group(1) if confidence else "?"
+    await asyncio.sleep(DELAY)
+    analysis = {
+        "key_indicators": [
+            f"[mock] Floración prevista en {days} días",
+            f"[mock] Confianza del modelo: {confidence}",
+            "[mock] Condiciones ambientales simuladas",
+        ],
+        "recommendations": ["[mock] Recomendación 1", "[mock] Recomendación 2", "[mock] Recomendación 3"],
+        "risk_factors": ["[mock] Sin riesgos simulados"],
+    }
+    return {
+        "id": f"mock-{calls['count']}",
+        "model": body.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(analysis, ensure_ascii=False)}}],
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Number of completions served, to check how many requests the cache absorbed"""
+    return calls
+
+
+def main():
+    global DELAY
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    if len(sys.argv) > 2:
+        DELAY = float(sys.argv[2])
+    print(f"🤖 Mock OpenRouter on http://127.0.0.1:{port}/api/v1 (delay {DELAY}s)")
+    uvicorn.run(app, host="127.0.0.1", port=port)
+
+
+if __name__ == "__main__":
+    main()
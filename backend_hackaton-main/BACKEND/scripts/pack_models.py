@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Packed Model Store Builder for BloomWatch
+Packs the latest model of every parcel in the manifest into one memory-mapped file
+"""
+
+import sys
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.model_registry import model_registry
+from app.services.packed_model_store import pack_models
+
+def main():
+    """Build the packed store from the model manifest"""
+    # Optional precision argument: float32 (default), float16 or int8
+    precision = sys.argv[1] if len(sys.argv) > 1 else None
+    entries = model_registry.list()
+    print(f"📦 Packing {len(entries)} parcel models...")
+    summary = pack_models(entries, precision=precision)
+    print(f"✅ Packed {summary['packed']} models into {summary['path']}")
+    if summary["skipped"]:
+        print(f"⚠️  Skipped parcels (legacy or unsupported models): {summary['skipped']}")
+    if summary["float32_fallback"]:
+        print(f"⚠️  Packed as float32 (quantization not verified): {summary['float32_fallback']}")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
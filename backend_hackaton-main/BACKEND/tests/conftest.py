@@ -0,0 +1,84 @@
+"""
+Shared fixtures: every test session runs against a throwaway SQLite database
+and model manifest, configured before any app module reads the settings
+"""
+
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="bloomwatch_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["DEBUG"] = "false"
+os.environ["MODEL_MANIFEST_PATH"] = os.path.join(_TMP, "manifest.sqlite")
+os.environ["MODELS_DIR"] = os.path.join(_TMP, "models")
+os.environ["FEATURE_STORE_DIR"] = os.path.join(_TMP, "feature_store")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+import pytest_asyncio  # noqa: E402
+
+from app.database import models  # noqa: E402,F401
+from app.database.database import Base, async_engine, engine  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """Fresh tables for one test (the parcel spatial index is reset with them)"""
+    from app.services.spatial_index import parcel_index
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    parcel_index.reset()
+    yield engine
+    parcel_index.reset()
+
+
+@pytest_asyncio.fixture
+async def async_db(db):
+    """Same as db for async tests; pooled aiosqlite connections are closed on the test's loop"""
+    yield async_engine
+    await async_engine.dispose()
+
+
+@pytest.fixture
+def tiny_store(tmp_path, monkeypatch):
+    """
+    Feature store with four parcels (two years of 8-day observations each) and
+    the flowering dates CSV that labels them; returns the CSV path
+    """
+    from app.services.feature_store import feature_store
+    monkeypatch.setattr(feature_store, "root", str(tmp_path / "feature_store"))
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2022-01-01", "2023-12-31", freq="8D")
+    season = np.sin(2 * np.pi * (dates.dayofyear.to_numpy() - 80) / 365)
+    fechas = []
+    for parcel_id in range(1, 5):
+        noise = rng.normal(0, 0.02, (len(dates), 4))
+        records = pd.DataFrame({
+            "date": dates,
+            "NDVI": 0.4 + 0.2 * season + noise[:, 0] + parcel_id / 50,
+            "EVI": 0.3 + 0.15 * season + noise[:, 1],
+            "LST_day": 295 + 10 * season + noise[:, 2],
+            "LST_night": 282 + 8 * season + noise[:, 3],
+            "ET_estimate": 2 + season,
+            **{f"precip_{w}d": w * (1.5 - season) for w in (7, 15, 30, 60, 90)},
+            **{f"water_balance_{w}d": w * (0.5 - season) for w in (7, 15, 30, 60, 90)},
+        })
+        feature_store.append(parcel_id, records)
+        fechas.append({"parcel_id": parcel_id, "flowering_date": f"2024-04-{10 + parcel_id}"})
+    path = tmp_path / "fechas_floracion.csv"
+    pd.DataFrame(fechas).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def parcel_models(tiny_store):
+    """Small per-parcel models for parcels 1 and 2 of tiny_store: parcel_id -> manifest entry"""
+    from app.services.iamodel_service import entrenar_modelo_floracion
+    entries = {}
+    for parcel_id in (1, 2):
+        result = entrenar_modelo_floracion(demo_mode=False, path_fechas=tiny_store, use_feature_store=True,
+                                           parcel_ids=[parcel_id], parcel_id=parcel_id, epochs=2, batch_size=64)
+        entries[parcel_id] = result["manifest"]
+    return entries
@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import func, select
+
+from app.database.database import SessionLocal
+from app.database.models import AnalysisJob, BloomCluster, BloomDetection, SatelliteImage
+from app.services.bloom_detector import bloom_detector
+from app.services.geometry import geohash_of_bbox
+from app.services.parcel_registry import ParcelRegistry
+
+
+def _images(*ages_days):
+    session = SessionLocal()
+    try:
+        images = [SatelliteImage(filename=f"img{i}", collection="MOD13Q1", satellite="MODIS",
+                                 acquisition_date=datetime.utcnow() - timedelta(days=age))
+                  for i, age in enumerate(ages_days)]
+        session.add_all(images)
+        session.commit()
+        return [image.id for image in images]
+    finally:
+        session.close()
+
+
+def _cluster(i):
+    # Cluster boxes are pixel offsets in the raster, never degrees
+    return {"id": i, "area": 4.0, "centroid": [120, 80], "bounding_box": {"x": 100, "y": 60, "width": 40, "height": 30}}
+
+
+@pytest.mark.asyncio
+async def test_store_uses_the_analysed_area_as_extent(async_db):
+    image_id, = _images(1)
+    results = {"individual_results": [
+        {"satellite_image_id": image_id, "bbox": [-3.7, 40.4, -3.6, 40.5], "bloom_areas_count": 2,
+         "clusters": [_cluster(1), _cluster(2)]},
+        {"satellite_image_id": image_id, "clusters": [_cluster(3)]},
+    ]}
+    await bloom_detector._store_detection_results(results, job_id=1)
+
+    session = SessionLocal()
+    try:
+        rows = session.execute(select(BloomDetection).order_by(BloomDetection.id)).scalars().all()
+        assert [r.bounding_box for r in rows] == [[-3.7, 40.4, -3.6, 40.5], None]
+        assert (rows[0].min_lon, rows[0].min_lat, rows[0].max_lon, rows[0].max_lat) == (-3.7, 40.4, -3.6, 40.5)
+        assert rows[0].geohash == geohash_of_bbox([-3.7, 40.4, -3.6, 40.5])
+        assert rows[1].min_lon is None and rows[1].geohash is None
+        clusters = session.execute(select(BloomCluster.bloom_detection_id).order_by(BloomCluster.id)).scalars().all()
+        assert clusters == [rows[0].id, rows[0].id, rows[1].id]
+    finally:
+        session.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_store_leaves_nothing_behind(async_db):
+    await bloom_detector._store_detection_results({"individual_results": [{"satellite_image_id": None}]}, job_id=1)
+    session = SessionLocal()
+    try:
+        assert session.scalar(select(func.count(BloomDetection.id))) == 0
+    finally:
+        session.close()
+
+
+@pytest.mark.asyncio
+async def test_detections_and_clusters_are_bulk_inserted(async_db):
+    from sqlalchemy import event
+
+    image_id, = _images(1)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("INSERT"):
+            statements.append((statement.split("(")[0].split()[-1], "RETURNING" in statement, executemany))
+
+    event.listen(async_db.sync_engine, "before_cursor_execute", record)
+    try:
+        await bloom_detector._store_detection_results({"individual_results": [
+            {"satellite_image_id": image_id, "bloom_areas_count": i, "clusters": [_cluster(j) for j in range(i % 3)]}
+            for i in range(300)
+        ]}, job_id=1)
+    finally:
+        event.remove(async_db.sync_engine, "before_cursor_execute", record)
+
+    # Detections go through INSERT ... RETURNING (one batched statement where the dialect can keep the
+    # parameter order, e.g. PostgreSQL; SQLite falls back to a statement per row) and the clusters
+    # through a single executemany once all detection ids are known
+    detection_inserts = [s for s in statements if s[0] == "bloom_detections"]
+    assert all(returning for _, returning, _ in detection_inserts)
+    if async_db.dialect.name == "postgresql":
+        assert len(detection_inserts) == 1
+    assert statements[len(detection_inserts):] == [("bloom_clusters", False, True)]
+    session = SessionLocal()
+    try:
+        detections = session.execute(select(BloomDetection.id, BloomDetection.bloom_areas_count)
+                                     .order_by(BloomDetection.id)).all()
+        assert [count for _, count in detections] == list(range(300))
+        per_detection = dict(session.execute(select(BloomCluster.bloom_detection_id, func.count(BloomCluster.id))
+                                             .group_by(BloomCluster.bloom_detection_id)).all())
+        assert per_detection == {det_id: count % 3 for det_id, count in detections if count % 3}
+    finally:
+        session.close()
+
+
+@pytest.mark.asyncio
+async def test_history_matches_brute_force(async_db):
+    recent, old = _images(3, 900)
+    rng = np.random.default_rng(4)
+    n = 1500
+    xy = np.column_stack([rng.uniform(-180, 175, n), rng.uniform(-89, 85, n)])
+    sizes = np.where(rng.random((n, 1)) < 0.9, rng.uniform(0, 0.5, (n, 2)), rng.uniform(0, 4, (n, 2)))
+    boxes = np.hstack([xy, xy + sizes])
+    images = np.where(rng.random(n) < 0.8, recent, old)
+    await bloom_detector._store_detection_results({"individual_results": [
+        {"satellite_image_id": int(images[i]), "bbox": boxes[i].tolist(), "bloom_areas_count": i % 5,
+         "total_bloom_area": float(i), "clusters": []}
+        for i in range(n)
+    ]}, job_id=1)
+
+    for _ in range(60):
+        q = rng.uniform(-180, 170, 2)
+        size = rng.choice([0.5, 5, 40])
+        bbox = (q[0], max(q[1], -90), q[0] + size, min(q[1] + size, 90))
+        history = await bloom_detector.get_bloom_history(bbox, days_back=365)
+
+        expected = np.flatnonzero((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) & (boxes[:, 1] <= bbox[3])
+                                  & (boxes[:, 3] >= bbox[1]) & (images == recent)) + 1
+        assert sorted(d["id"] for d in history["detections"]) == expected.tolist()
+        assert history["summary"]["total_detections"] == len(expected)
+        if len(expected):
+            assert history["summary"]["avg_bloom_areas"] == pytest.approx(np.mean((expected - 1) % 5))
+            assert history["summary"]["max_bloom_area"] == float(expected.max() - 1)
+
+
+@pytest.mark.asyncio
+async def test_history_lists_the_parcels_under_each_detection(async_db):
+    image_id, = _images(1)
+    parcel = ParcelRegistry().create([[-3.7, 40.4], [-3.69, 40.4], [-3.69, 40.41], [-3.7, 40.41]])
+    await bloom_detector._store_detection_results({"individual_results": [
+        {"satellite_image_id": image_id, "bbox": [-3.71, 40.39, -3.68, 40.42], "clusters": []},
+        {"satellite_image_id": image_id, "bbox": [10, 10, 11, 11], "clusters": []},
+    ]}, job_id=1)
+
+    history = await bloom_detector.get_bloom_history((-4, 40, -3, 41))
+    assert [d["parcel_ids"] for d in history["detections"]] == [[parcel["id"]]]
+    assert history["detections"][0]["bbox"] == [-3.71, 40.39, -3.68, 40.42]
+
+
+@pytest.mark.asyncio
+async def test_analysis_jobs_round_trip(async_db):
+    job_id = await bloom_detector._create_analysis_job("bloom_detection", {"bbox": [0, 0, 1, 1]})
+    completed = await bloom_detector._complete_job(job_id, "completed", result={"ok": 1})
+    assert completed["status"] == "completed"
+    session = SessionLocal()
+    try:
+        job = session.get(AnalysisJob, job_id)
+        assert (job.status, job.result_data, job.parameters) == ("completed", {"ok": 1}, {"bbox": [0, 0, 1, 1]})
+        assert job.completed_at >= job.started_at
+    finally:
+        session.close()
+
+
+@pytest.mark.asyncio
+async def test_image_metadata_is_stored_through_the_async_session(async_db, tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    acquired = datetime(2024, 1, 1)
+    monkeypatch.setattr(bloom_detector, "nasa_service",
+                        SimpleNamespace(get_temporal_coverage=lambda dataset: (acquired, acquired)), raising=False)
+    path = tmp_path / "MOD13Q1.A2024001.hdf"
+    path.write_bytes(b"0" * 128)
+    dataset = {"collection_concept_id": "C-MOD13Q1", "links": [{"href": "https://example.org/file.hdf"}]}
+    image = await bloom_detector._store_satellite_image_metadata(dataset, str(path))
+    # Usable after the session closed (no lazy refresh through a sync session)
+    assert (image.filename, image.satellite, image.file_size) == ("MOD13Q1.A2024001.hdf", "MODIS", 128)
+    assert image.acquisition_date == acquired
+    session = SessionLocal()
+    try:
+        assert session.get(SatelliteImage, image.id).download_url == "https://example.org/file.hdf"
+    finally:
+        session.close()
+
+
+@pytest.mark.asyncio
+async def test_history_looks_parcels_up_off_the_event_loop(async_db, monkeypatch):
+    import asyncio
+    from app.services.spatial_index import parcel_index
+
+    image_id, = _images(1)
+    await bloom_detector._store_detection_results({"individual_results": [
+        {"satellite_image_id": image_id, "bbox": [-3.71, 40.39, -3.68, 40.42], "clusters": []},
+    ]}, job_id=1)
+    threads = []
+    intersecting = parcel_index.intersecting
+
+    def recorded(extent):
+        try:
+            asyncio.get_running_loop()
+            threads.append("loop")
+        except RuntimeError:
+            threads.append("worker")
+        return intersecting(extent)
+
+    monkeypatch.setattr(parcel_index, "intersecting", recorded)
+    history = await bloom_detector.get_bloom_history((-4, 40, -3, 41))
+    assert len(history["detections"]) == 1 and threads == ["worker"]
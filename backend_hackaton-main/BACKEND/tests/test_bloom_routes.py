@@ -0,0 +1,232 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import bloom
+
+SQUARE = [[-0.4, 39.5], [-0.39, 39.5], [-0.39, 39.51], [-0.4, 39.51]]
+
+
+def _off_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    return False
+
+
+@pytest.fixture
+def client(db):
+    bloom.parcel_registry._cache.clear()
+    bloom.parcel_registry._by_hash.clear()
+    app = FastAPI()
+    app.include_router(bloom.router)
+    return TestClient(app)
+
+
+@pytest.fixture
+def fake_gee(monkeypatch):
+    """Earth Engine available, with an empty history; records the parcel each call stores under"""
+    calls = []
+
+    async def history(coordinates, parcel_id=None, geometry_hash=None):
+        calls.append(parcel_id)
+        return {"history": []}
+
+    monkeypatch.setattr(bloom.gee_service, "is_available", lambda: True)
+    monkeypatch.setattr(bloom.gee_service, "get_history_parcel", history)
+    return calls
+
+
+@pytest.fixture
+def fake_training(monkeypatch):
+    calls = []
+
+    def train(**kwargs):
+        calls.append({**kwargs, "off_loop": _off_event_loop()})
+        return {"status": "trained new model", "manifest": None}
+
+    monkeypatch.setattr(bloom, "entrenar_modelo_floracion", train)
+    return calls
+
+
+def test_train_model_runs_off_the_event_loop_and_uses_the_registered_parcel(client, fake_gee, fake_training):
+    client.post("/parcels", json={"coordinates": SQUARE, "id": 31})
+    # Same polygon without an id: the registered parcel's history is used
+    response = client.post("/train-model", json={"coordinates": SQUARE[::-1]})
+    assert response.status_code == 200
+    assert response.json()["parcel_id"] == 31
+    assert fake_gee == [31]
+    assert fake_training[0]["parcel_ids"] == [31] and fake_training[0]["use_feature_store"]
+    assert fake_training[0]["off_loop"]
+
+
+def test_train_model_fine_tune_without_base_model_is_a_conflict(client, fake_gee, fake_training, monkeypatch):
+    monkeypatch.setattr(bloom, "modelo_base_disponible", lambda: False)
+    response = client.post("/train-model?fine_tune=true", json={"coordinates": SQUARE})
+    assert response.status_code == 409
+    assert "modelo base" in response.json()["detail"]
+    assert fake_gee == [] and fake_training == []
+
+
+def test_cached_distributions_follow_the_sample_count(parcel_models, tmp_path, monkeypatch):
+    from app.services.feature_store import feature_store
+    from app.services.iamodel_service import COLS_X, prediction_cache
+    from app.services.packed_model_store import PackedModelStore, pack_models
+
+    path = str(tmp_path / "models.pack")
+    pack_models(list(parcel_models.values()), output_path=path, precision="float32")
+    monkeypatch.setattr(bloom, "packed_model_store", PackedModelStore(path))
+    prediction_cache.clear()
+    row = feature_store.read(columns=COLS_X, parcel_ids=[1]).iloc[0].to_dict()
+
+    monkeypatch.setattr(bloom.settings, "MC_DROPOUT_SAMPLES", 20)
+    first = bloom._predecir_distribucion(1, row)
+    assert first["model_source"] == "packed" and first["samples"] == 20
+    assert bloom._predecir_distribucion(1, row) == first
+    monkeypatch.setattr(bloom.settings, "MC_DROPOUT_SAMPLES", 30)
+    assert bloom._predecir_distribucion(1, row)["samples"] == 30
+
+
+def test_trajectory_resolves_and_predicts_off_the_event_loop(client, parcel_models, monkeypatch):
+    from app.services.feature_store import feature_store
+    from app.services.iamodel_service import COLS_X
+
+    row = feature_store.read(columns=COLS_X, parcel_ids=[1]).iloc[0].to_dict()
+    monkeypatch.setattr(bloom.gee_service, "is_available", lambda: True)
+    monkeypatch.setattr(bloom, "_datos_actuales", lambda parcela: dict(row))
+    threads = []
+    resolve, batch = bloom._resolver_modelo_floracion, bloom._predictor_lotes
+    monkeypatch.setattr(bloom, "_resolver_modelo_floracion",
+                        lambda *a, **k: threads.append(_off_event_loop()) or resolve(*a, **k))
+    monkeypatch.setattr(bloom, "_predictor_lotes",
+                        lambda *a: (lambda rows: threads.append(_off_event_loop()) or batch(*a)(rows)))
+
+    client.post("/parcels", json={"coordinates": SQUARE, "id": 1})
+    response = client.post("/predict-bloom/trajectory?id=1&days=12")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["model_source"] == "keras" and len(body["trajectory"]) == 12
+    assert threads == [True, True]
+
+
+def test_parcel_history_is_read_from_the_store_off_the_event_loop(client, tiny_store, monkeypatch):
+    import io
+    import pyarrow as pa
+
+    reads = []
+    read = bloom.feature_store.read
+    monkeypatch.setattr(bloom.feature_store, "read", lambda **k: reads.append(_off_event_loop()) or read(**k))
+    monkeypatch.setattr(bloom.gee_service, "is_available", lambda: pytest.fail("Earth Engine was queried"))
+
+    body = client.post("/parcel-history?id=3").json()
+    assert body["parcel_id"] == 3 and body["rows"] == len(body["index"]) > 0
+    assert body["index"] == sorted(body["index"])
+    arrow = client.post("/parcel-history?id=3&format=arrow")
+    assert arrow.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    assert pa.ipc.open_stream(io.BytesIO(arrow.content)).read_all().num_rows == body["rows"]
+    assert reads == [True, True]
+
+
+@pytest.mark.asyncio
+async def test_llm_text_quotes_each_prediction_exactly(monkeypatch):
+    from app.services.llm_service import TTLCache
+    prompts = []
+
+    async def complete(prompt):
+        prompts.append(prompt)
+        return {"key_indicators": ["Floración en {dias} días ({confianza}), NDVI {ndvi}"]}
+
+    monkeypatch.setattr(bloom.llm_service, "api_key", "test")
+    monkeypatch.setattr(bloom.llm_service, "cache", TTLCache(8, 60))
+    monkeypatch.setattr(bloom.llm_service, "_complete", complete)
+    first = await bloom.request_llm_analysis(42, "76%", {"NDVI": 0.612})
+    second = await bloom.request_llm_analysis(41, "77%", {"NDVI": 0.598})
+    assert len(prompts) == 1 and "{dias}" in prompts[0]
+    assert first["key_indicators"] == ["Floración en 42 días (76%), NDVI 0.612"]
+    assert second["key_indicators"] == ["Floración en 41 días (77%), NDVI 0.598"]
+
+
+def _sse(body: str):
+    """(event, data) pairs of a Server-Sent Events body"""
+    import json
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture
+def fake_stream(client, monkeypatch):
+    """Registered parcel 41 with stubbed current data, model and explanation"""
+    import numpy as np
+    from app.services.iamodel_service import resumir_incertidumbre
+
+    monkeypatch.setattr(bloom.gee_service, "is_available", lambda: True)
+    monkeypatch.setattr(bloom, "_datos_actuales", lambda parcela: {"NDVI": 0.61, "area_hectares": 1.0})
+    monkeypatch.setattr(bloom, "_predecir_distribucion",
+                        lambda id, current_data, propio=None: resumir_incertidumbre(np.array([40.0, 42.0, 44.0])))
+    monkeypatch.setattr(bloom, "_explicar_prediccion", lambda id, current_data, propio=None: {"drivers": []})
+    client.post("/parcels", json={"coordinates": SQUARE, "id": 41})
+    return client
+
+
+def test_stream_sends_each_stage_as_it_completes(fake_stream, monkeypatch):
+    async def analysis(days, confidence, current_data):
+        return {"key_indicators": [f"{days} días"]}
+
+    monkeypatch.setattr(bloom, "request_llm_analysis", analysis)
+    response = fake_stream.post("/predict-bloom/stream?id=41")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _sse(response.text)
+    assert [name for name, _ in events] == ["current_data", "prediction", "explanation", "ai_analysis", "done"]
+    assert events[1][1]["days_until_bloom"] == 42
+    assert events[3][1] == {"source": "ai", "ai_analysis": {"key_indicators": ["42 días"]}}
+    assert events[4][1]["parcel_id"] == 41
+
+
+def test_stream_falls_back_to_the_rule_based_analysis_when_the_llm_is_late(fake_stream, monkeypatch):
+    async def slow_analysis(days, confidence, current_data):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(bloom, "request_llm_analysis", slow_analysis)
+    monkeypatch.setattr(bloom.settings, "AI_ANALYSIS_TIMEOUT_SECONDS", 0.05)
+    name, data = _sse(fake_stream.post("/predict-bloom/stream?id=41").text)[3]
+    assert name == "ai_analysis" and data["source"] == "contextual"
+    assert data["ai_analysis"]["key_indicators"]
+
+
+def test_stream_reports_a_failed_prediction_as_an_error_event(fake_stream, monkeypatch):
+    def missing_columns(id, current_data, propio=None):
+        raise ValueError("Faltan columnas: ['EVI']")
+
+    monkeypatch.setattr(bloom, "_predecir_distribucion", missing_columns)
+    events = _sse(fake_stream.post("/predict-bloom/stream?id=41").text)
+    assert [name for name, _ in events] == ["current_data", "error"]
+    assert events[1][1] == {"status_code": 422, "detail": "Faltan columnas: ['EVI']"}
+
+
+def test_parcel_routes_use_the_registry_off_the_event_loop(client, monkeypatch):
+    registry = bloom.parcel_registry
+    calls = []
+    for name in ("get", "create", "list", "search", "update"):
+        method = getattr(registry, name)
+
+        def recorded(*args, _name=name, _method=method, **kwargs):
+            calls.append((_name, _off_event_loop()))
+            return _method(*args, **kwargs)
+        monkeypatch.setattr(registry, name, recorded)
+
+    assert client.post("/parcels", json={"coordinates": SQUARE, "id": 51, "name": "a"}).status_code == 201
+    assert client.post("/parcels", json={"coordinates": SQUARE, "id": 51}).status_code == 409
+    assert [p["id"] for p in client.get("/parcels").json()["parcels"]] == [51]
+    assert [p["id"] for p in client.get("/parcels/search?lon=-0.395&lat=39.505").json()["parcels"]] == [51]
+    assert client.get("/parcels/search?bbox=-1,39,0,40").json()["parcels"][0]["id"] == 51
+    assert client.get("/parcels/51").json()["name"] == "a"
+    assert client.put("/parcels/51", json={"name": "b"}).json()["name"] == "b"
+    assert client.get("/parcels/52").status_code == 404
+    assert {name for name, _ in calls} == {"get", "create", "list", "search", "update"}
+    assert all(off_loop for _, off_loop in calls)
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services import iamodel_service
+from app.services.iamodel_service import entrenar_modelo_floracion, validacion_cruzada
+
+CONFIG = {"lr": 1e-3, "units": (8,), "dropout": 0.1, "l2": 1e-4, "batch_size": 16}
+
+
+def _frame(n_parcels: int = 4, rows: int = 30, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n = n_parcels * rows
+    df = pd.DataFrame({"NDVI": rng.uniform(0, 0.9, n), "LST_day": rng.normal(295, 5, n),
+                       "parcel_id": np.repeat(np.arange(1, n_parcels + 1), rows),
+                       "season": np.tile(["winter", "spring", "summer", "autumn"], n // 4)})
+    df["days_to_flowering"] = 40 + 60 * df["NDVI"] + rng.normal(0, 2, n)
+    return df
+
+
+def test_fold_is_fit_on_its_training_rows_only():
+    df = _frame()
+    Y = df['days_to_flowering'].values.reshape(-1, 1)
+    iamodel_service._datos_trial = (df[["NDVI", "LST_day"]], Y, ["NDVI", "LST_day"])
+    idx_tr, idx_va = np.arange(0, 90), np.arange(90, 120)
+    fold = iamodel_service._entrenar_fold(CONFIG, idx_tr, idx_va, epochs=2, seed=0)
+    assert (fold["train_rows"], fold["val_rows"], fold["epochs_run"]) == (90, 30, 2)
+    assert np.isfinite(fold["mae_days"]) and np.isfinite(fold["r2"])
+
+
+@pytest.mark.parametrize("grupo, k", [("parcel", 3), ("season", 4)])
+def test_grouped_folds_need_enough_distinct_groups(grupo, k):
+    df = _frame(n_parcels=2)
+    if grupo == "season":
+        df["season"] = "spring"
+    with pytest.raises(ValueError, match=f"CV por {grupo}"):
+        validacion_cruzada(df, ["NDVI", "LST_day"], CONFIG, k=k, grupo=grupo, epochs=1, n_jobs=1)
+    with pytest.raises(ValueError, match="no soportada"):
+        validacion_cruzada(df, ["NDVI", "LST_day"], CONFIG, k=2, grupo="year", epochs=1, n_jobs=1)
+
+
+def test_parcel_cv_runs_from_the_feature_store(tiny_store, tmp_path):
+    result = entrenar_modelo_floracion(demo_mode=False, path_fechas=tiny_store, use_feature_store=True,
+                                       epochs=2, batch_size=64, cv_folds=2, cv_group="parcel", n_jobs=1,
+                                       output_dir=str(tmp_path / "cv"))
+    cv = result["metrics"]["cv"]
+    assert (cv["k"], cv["group"], cv["n_jobs"]) == (2, "parcel", 1)
+    assert len(cv["folds"]) == 2
+    # Every row is evaluated exactly once across the folds
+    assert sum(f["val_rows"] for f in cv["folds"]) == cv["folds"][0]["train_rows"] + cv["folds"][0]["val_rows"]
+    assert cv["mae_days_mean"] == pytest.approx(np.mean([f["mae_days"] for f in cv["folds"]]))
+
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.explanation_service import ExplanationEngine, indicators_from_drivers
+
+WEIGHTS = {"NDVI": -20.0, "LST_mean": 0.5, "precip_7d": 0.1}
+
+
+def _linear(rows):
+    return np.array([30 + sum(w * row[c] for c, w in WEIGHTS.items()) for row in rows])
+
+
+def _background():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "NDVI": rng.uniform(0.2, 0.6, 12),
+        "LST_mean": rng.uniform(285, 300, 12),
+        "precip_7d": rng.uniform(0, 30, 12),
+    })
+
+
+def test_attributions_of_a_linear_predictor_are_weight_times_offset():
+    background = _background()
+    reading = {"NDVI": 0.8, "LST_mean": 295.0, "precip_7d": 2.0}
+    groups = [(c,) for c in WEIGHTS]
+
+    result = ExplanationEngine(store=None).attributions(reading, _linear, background, groups=groups)
+
+    assert result["predicted_days"] == pytest.approx(_linear([reading])[0])
+    assert result["background_rows"] == len(background)
+    effects = {d["features"][0]: d["effect_days"] for d in result["drivers"]}
+    for column, weight in WEIGHTS.items():
+        expected = weight * (reading[column] - background[column].mean())
+        assert effects[column] == pytest.approx(expected, abs=0.01)
+    # Sorted by absolute effect
+    magnitudes = [abs(d["effect_days"]) for d in result["drivers"]]
+    assert magnitudes == sorted(magnitudes, reverse=True)
+
+
+def test_predictor_is_called_once_with_every_occlusion():
+    calls = []
+
+    def predictor(rows):
+        calls.append(len(rows))
+        return _linear(rows)
+
+    background = _background()
+    ExplanationEngine(store=None).attributions(
+        {"NDVI": 0.5, "LST_mean": 290.0, "precip_7d": 5.0}, predictor, background, groups=[(c,) for c in WEIGHTS]
+    )
+    assert calls == [1 + len(WEIGHTS) * len(background)]
+
+
+def test_no_background_raises():
+    with pytest.raises(ValueError):
+        ExplanationEngine(store=None).attributions({"NDVI": 0.5}, _linear, pd.DataFrame())
+
+
+def test_indicators_name_the_strongest_drivers():
+    explanation = ExplanationEngine(store=None).attributions(
+        {"NDVI": 0.9, "LST_mean": 292.0, "precip_7d": 10.0}, _linear, _background(), groups=[(c,) for c in WEIGHTS]
+    )
+    indicators = indicators_from_drivers(explanation)
+    assert "el NDVI" in indicators[0] and "adelanta" in indicators[0]
+
+
+def test_store_background_reads_a_sample_of_parcels_once(tmp_path):
+    from app.services.explanation_service import GLOBAL_BACKGROUND_PARCELS
+    from app.services.feature_store import FeatureStore
+    from app.services.iamodel_service import COLS_X
+
+    store = FeatureStore(str(tmp_path / "store"))
+    dates = pd.date_range(end=pd.Timestamp.utcnow().normalize().tz_localize(None), periods=10, freq="8D")
+    for parcel_id in range(1, 21):
+        store.append(parcel_id, pd.DataFrame({"date": dates, **{c: float(parcel_id) for c in COLS_X
+                                                                 if c not in ("year", "month", "day_of_year")}}))
+    reads = []
+    read = store.read
+    store.read = lambda **kwargs: reads.append(kwargs) or read(**kwargs)
+
+    engine = ExplanationEngine(store=store, background_rows=16)
+    background = engine.background(None)
+    assert len(background) == 16
+    assert len(reads) == 1 and len(reads[0]["parcel_ids"]) == GLOBAL_BACKGROUND_PARCELS
+    assert {1, 20} <= set(reads[0]["parcel_ids"])
+    assert set(background["NDVI"]) <= set(map(float, reads[0]["parcel_ids"]))
+
+    # Cached, and parcels without history of their own fall back to it
+    assert engine.background(99) is background
+    assert len(reads) == 2 and reads[1]["parcel_ids"] == [99]
+    assert ExplanationEngine(store=FeatureStore(str(tmp_path / "empty"))).background(None).empty
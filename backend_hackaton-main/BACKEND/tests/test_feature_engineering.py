@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.feature_engineering import (
+    CURRENT_COLUMNS, THERMAL_STRESS_K, compact_history, derive_features, latest_features, season_for_month,
+)
+
+
+def _raw(parcel_id, dates, ndvi):
+    n = len(dates)
+    return pd.DataFrame({
+        "parcel_id": parcel_id, "date": dates, "NDVI": ndvi, "EVI": np.full(n, 0.25),
+        "LST_day": np.linspace(300, 310, n), "LST_night": np.full(n, 290.0), "ET_estimate": np.full(n, 1.0),
+        **{f"precip_{w}d": np.full(n, float(w)) for w in (7, 15, 30, 60, 90)},
+        **{f"et_{w}d": np.full(n, w / 2) for w in (7, 15, 30, 60, 90)},
+    })
+
+
+def test_derived_columns_match_their_definitions_per_parcel():
+    dates = pd.to_datetime(["2023-01-01", "2023-01-09", "2023-01-25", "2023-02-26"])
+    raw = pd.concat([_raw(2, dates, [0.2, 0.4, 0.6, 0.8]), _raw(1, dates[::-1], [0.1, 0.3, 0.5, 0.7])])
+    df = derive_features(raw)
+
+    assert df["parcel_id"].tolist() == [1] * 4 + [2] * 4
+    two = df[df["parcel_id"] == 2].reset_index(drop=True)
+    assert np.isnan(two["NDVI_change"].iloc[0])  # no previous row in the parcel
+    np.testing.assert_allclose(two["NDVI_change"].iloc[1:], 0.2)
+    # Time-aware 30-day window: (date - 30 days, date]
+    np.testing.assert_allclose(two["NDVI_rolling_mean_30d"], [0.2, 0.3, 0.4, 0.8])
+    np.testing.assert_allclose(two["LST_range"], two["LST_day"] - 290)
+    np.testing.assert_allclose(two["LST_mean"], (two["LST_day"] + 290) / 2)
+    np.testing.assert_allclose(two["NDVI_EVI_ratio"], two["NDVI"] / 0.25)
+    assert two["thermal_stress"].tolist() == (two["LST_day"] > THERMAL_STRESS_K).astype(float).tolist()
+    np.testing.assert_allclose(two["water_balance_30d"], 15.0)
+    assert two["season"].tolist() == ["winter"] * 4 and season_for_month(7) == "summer"
+    assert two["day_of_year"].tolist() == [1, 9, 25, 57]
+
+
+def test_missing_inputs_leave_stored_columns_alone():
+    stored = pd.DataFrame({"date": ["2023-05-01"], "NDVI": [0.5], "water_balance_7d": [3.0], "EVI": [0.0]})
+    df = derive_features(stored, group_col=None)
+    assert df["water_balance_7d"].tolist() == [3.0]
+    assert np.isnan(df["NDVI_EVI_ratio"].iloc[0])  # EVI == 0 is not divided by
+    assert "LST_mean" not in df
+
+
+def test_latest_features_and_compact_history():
+    dates = pd.date_range("2023-03-01", periods=5, freq="8D")
+    current = latest_features(_raw(1, dates, np.linspace(0.3, 0.7, 5)))
+    assert list(current) == CURRENT_COLUMNS
+    assert current["NDVI"] == pytest.approx(0.7) and current["NDVI_change"] == pytest.approx(0.1)
+    assert latest_features(pd.DataFrame({"date": []})) == {}
+
+    compact = compact_history(derive_features(_raw(1, dates, np.linspace(0.3, 0.7, 5))))
+    assert compact.index.name == "date" and len(compact) == 5
+    assert compact["NDVI"].dtype == np.float32 and compact["month"].dtype == np.int8
+    assert isinstance(compact["season"].dtype, pd.CategoricalDtype)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.feature_store import DATA_COLUMNS, FEATURE_COLUMNS, FeatureStore
+
+
+def _records(start: str, days: int, ndvi: float = 0.5):
+    dates = pd.date_range(start, periods=days, freq='8D')
+    return [{"date": d.strftime('%Y-%m-%d'), "NDVI": ndvi + i / 100, "LST_day": 300.0, "precip_7d": float(i),
+             "season": "spring"} for i, d in enumerate(dates)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FeatureStore(str(tmp_path / "store"))
+
+
+def test_empty_store_reads_as_an_empty_frame(store):
+    assert store.read().empty
+    assert list(store.read().columns) == DATA_COLUMNS
+    assert store.parcel_ids() == []
+    assert list(store.iter_parcels()) == []
+
+
+def test_round_trip_keeps_values_types_and_partitions(store):
+    assert store.append(1, _records('2022-11-01', 20)) == 20
+    assert store.append(2, _records('2023-03-01', 5, ndvi=0.2)) == 5
+    assert store.append(3, []) == 0
+
+    df = store.read()
+    assert list(df.columns) == DATA_COLUMNS
+    assert len(df) == 25
+    assert all(df[col].dtype == np.float32 for col in FEATURE_COLUMNS)
+    assert store.parcel_ids() == [1, 2]
+
+    one = store.read(columns=['date', 'NDVI', 'precip_7d'], parcel_ids=[1]).sort_values('date')
+    assert list(one.columns) == ['date', 'NDVI', 'precip_7d']
+    np.testing.assert_allclose(one['NDVI'], 0.5 + np.arange(20) / 100, rtol=1e-6)
+    assert one['precip_7d'].tolist() == list(range(20))
+
+    assert set(store.read(columns=['year'], parcel_ids=[1], years=(2023, 2023))['year']) == {2023}
+    late = store.read(columns=['date'], start_date=pd.Timestamp('2023-03-20'))
+    assert (late['date'] >= pd.Timestamp('2023-03-20')).all()
+    assert [sorted(chunk['parcel_id'].unique()) for chunk in store.iter_parcels(parcels_per_chunk=1)] == [[1], [2]]
+
+
+def test_re_appended_rows_keep_the_newest_write(store):
+    # Files are read in an arbitrary order: repeat enough times to catch it
+    for i in range(20):
+        store.append(7, [{"date": f"2023-0{1 + i % 9}-0{1 + i % 9}", "NDVI": 0.1, "season": "winter"}])
+        store.append(7, [{"date": f"2023-0{1 + i % 9}-0{1 + i % 9}", "NDVI": float(i), "season": "winter"}])
+        row = store.read(columns=['date', 'NDVI'], parcel_ids=[7],
+                         start_date=pd.Timestamp(f"2023-0{1 + i % 9}-0{1 + i % 9}"),
+                         end_date=pd.Timestamp(f"2023-0{1 + i % 9}-0{1 + i % 9}"))
+        assert row['NDVI'].tolist() == [float(i)]
+    assert len(store.read(parcel_ids=[7])) == 9
+    assert len(store.read(parcel_ids=[7], deduplicate=False)) == 40
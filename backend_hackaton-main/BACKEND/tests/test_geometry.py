@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from app.services import geometry
+from app.services.geometry import (
+    MAX_VERTICES, describe, geohash_encode, geohash_of_bbox, geohash_query_keys, is_simple,
+    polygon_intersects_bbox, prepare_polygon,
+)
+
+LAT = 39.5
+DLAT = 1000 / 111195
+DLON = DLAT / np.cos(np.radians(LAT))
+# 1 km x 1 km square near Valencia
+SQUARE = [[-0.4, LAT], [-0.4 + DLON, LAT], [-0.4 + DLON, LAT + DLAT], [-0.4, LAT + DLAT]]
+
+
+def test_prepare_polygon_hash_ignores_start_winding_closure_and_redundant_vertices():
+    reference = prepare_polygon(SQUARE)["hash"]
+    midpoint = [(SQUARE[0][0] + SQUARE[1][0]) / 2, LAT]
+    variants = [
+        SQUARE[2:] + SQUARE[:2],                          # other start vertex
+        SQUARE[::-1],                                     # clockwise
+        SQUARE + [SQUARE[0]],                             # explicitly closed
+        [SQUARE[0], SQUARE[0]] + SQUARE[1:],              # double click
+        [SQUARE[0], midpoint] + SQUARE[1:],               # collinear vertex
+        [[x + 1e-8, y - 1e-8] for x, y in SQUARE],        # below the coordinate precision
+    ]
+    for variant in variants:
+        assert prepare_polygon(variant)["hash"] == reference
+
+
+def test_prepare_polygon_hash_changes_with_the_shape():
+    moved = [[x + 0.001, y] for x, y in SQUARE]
+    assert prepare_polygon(moved)["hash"] != prepare_polygon(SQUARE)["hash"]
+
+
+def test_self_intersecting_ring_is_repaired_to_its_hull():
+    a, b, c, d = SQUARE
+    bowtie = [a, c, b, d]
+    assert not is_simple(np.array(bowtie))
+    prepared = prepare_polygon(bowtie)
+    assert prepared["repaired"]
+    assert prepared["hash"] == prepare_polygon(SQUARE)["hash"]
+
+
+@pytest.mark.parametrize("coordinates, message", [
+    ([[0, 0], [0, 0], [0, 0]], "distintos"),
+    ([[0, 0], [200, 0], [0, 1]], "fuera de rango"),
+    ([[0, 0], [0, 1], [0, 2]], "área"),
+])
+def test_invalid_polygons_raise(coordinates, message):
+    with pytest.raises(ValueError, match=message):
+        prepare_polygon(coordinates)
+
+
+def test_vertex_cap():
+    angles = np.linspace(0, 2 * np.pi, MAX_VERTICES + 1, endpoint=False)
+    ring = np.column_stack([np.cos(angles), np.sin(angles)]) * 0.01
+    with pytest.raises(ValueError, match="vértices"):
+        prepare_polygon(ring.tolist())
+    assert prepare_polygon(ring[:MAX_VERTICES].tolist())["vertices_in"] == MAX_VERTICES
+
+
+def test_blocked_is_simple_matches_the_pairwise_test():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        ring = rng.random((int(rng.integers(4, 30)), 2))
+        n = len(ring)
+        ends = np.roll(ring, -1, axis=0)
+        crossing = geometry._segments_cross(ring, ends, ring, ends)
+        gap = np.abs(np.subtract.outer(np.arange(n), np.arange(n)))
+        expected = not np.any(crossing & (gap > 1) & (gap != n - 1))
+        assert is_simple(ring, block=int(rng.integers(1, 8))) == expected
+
+
+def test_describe_reuses_a_prepared_polygon():
+    prepared = prepare_polygon(SQUARE)
+    meta = describe(SQUARE, prepared)
+    assert meta == describe(SQUARE)
+    assert meta["area_hectares"] == pytest.approx(100, rel=0.01)
+    assert meta["modis_tiles"] == ["h17v05"]
+
+
+def test_polygon_intersects_bbox():
+    x0, y0 = SQUARE[0]
+    assert polygon_intersects_bbox(SQUARE, [x0 - 1, y0 - 1, x0 + 1, y0 + 1])  # box around it
+    assert polygon_intersects_bbox(SQUARE, [x0 + 0.001, y0 + 0.001, x0 + 0.002, y0 + 0.002])  # box inside
+    assert not polygon_intersects_bbox(SQUARE, [x0 - 1, y0 - 1, x0 - 0.5, y0 - 0.5])
+
+
+def _random_box(rng, max_size):
+    lon, lat = rng.uniform(-180, 180), rng.uniform(-90, 90)
+    w, h = rng.uniform(0, max_size, 2)
+    return [lon, lat, min(lon + w, 180), min(lat + h, 90)]
+
+
+def test_geohash_of_bbox_contains_the_box():
+    rng = np.random.default_rng(1)
+    for _ in range(500):
+        box = _random_box(rng, 5)
+        key = geohash_of_bbox(box)
+        assert geohash_encode(box[0], box[1]).startswith(key)
+        assert geohash_encode(box[2], box[3]).startswith(key)
+
+
+def test_geohash_query_keys_find_every_intersecting_extent():
+    rng = np.random.default_rng(2)
+    stored = [_random_box(rng, size) for size in rng.choice([0.001, 0.1, 2, 30], 2000)]
+    keys = [geohash_of_bbox(box) for box in stored]
+    for _ in range(200):
+        query = _random_box(rng, rng.choice([0.01, 1, 20]))
+        exact, prefixes = geohash_query_keys(query)
+        exact = set(exact)
+        for box, key in zip(stored, keys):
+            intersects = box[0] <= query[2] and box[2] >= query[0] and box[1] <= query[3] and box[3] >= query[1]
+            if intersects:
+                assert key in exact or any(key.startswith(p) for p in prefixes), (box, query)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from app.services.feature_store import feature_store
+from app.services.global_model_service import GlobalFloweringModel, entrenar_modelo_global
+from app.services.iamodel_service import COLS_X
+
+
+@pytest.fixture
+def global_model(tiny_store, tmp_path):
+    result = entrenar_modelo_global(path_fechas=tiny_store, parcel_ids=[1, 2, 3], epochs=2,
+                                    output_dir=str(tmp_path / "global"))
+    assert result["parcels"] == 3
+    return GlobalFloweringModel(str(tmp_path / "global"))
+
+
+def _rows(parcel_id, n=3):
+    return feature_store.read(columns=COLS_X, parcel_ids=[parcel_id]).head(n).to_dict('records')
+
+
+def test_batch_prediction_matches_single_predictions(global_model):
+    rows = _rows(1, 2) + _rows(2, 2)
+    parcels = [1, 1, 2, 2]
+    batch = global_model.predict_batch(rows, parcels)
+    single = [global_model.predict(row, parcel) for row, parcel in zip(rows, parcels)]
+    np.testing.assert_allclose(batch, single, rtol=1e-4)
+
+
+def test_unseen_parcels_use_the_unknown_embedding(global_model):
+    assert global_model.knows(1) and not global_model.knows(4) and not global_model.knows(None)
+    row = _rows(4, 1)[0]
+    assert global_model.predict(row, 4) == pytest.approx(global_model.predict(row, None))
+    assert global_model.predict(row, 4) != pytest.approx(global_model.predict(row, 1))
+
+
+def test_distribution_and_input_validation(global_model):
+    summary = global_model.predict_distribution(_rows(1, 1)[0], 1, samples=20)
+    assert summary["samples"] == 20
+    assert summary["interval"][0] <= summary["mean_days"] <= summary["interval"][1]
+    with pytest.raises(ValueError, match="Faltan columnas"):
+        global_model.predict({"NDVI": 0.5}, 1)
+    with pytest.raises(ValueError):
+        global_model.predict_batch(_rows(1, 2), [1])
+    with pytest.raises(FileNotFoundError):
+        GlobalFloweringModel("/nonexistent").predict(_rows(1, 1)[0], 1)
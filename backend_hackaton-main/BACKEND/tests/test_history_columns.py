@@ -0,0 +1,29 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from app.services.feature_engineering import compact_history, history_to_arrow, history_to_columns
+
+
+def _history():
+    return compact_history(pd.DataFrame({
+        "date": ["2023-01-01", "2023-01-09"], "NDVI": [0.1, np.nan], "month": [1, 1], "season": ["winter", None],
+    }))
+
+
+def test_columns_are_rounded_json_lists_sharing_the_date_index():
+    out = history_to_columns(_history())
+    assert out["index"] == ["2023-01-01", "2023-01-09"]
+    # float32 0.1 is widened before rounding, and NaN becomes null
+    assert out["columns"]["NDVI"] == [0.1, None]
+    assert out["columns"]["month"] == [1, 1]
+    assert out["columns"]["season"] == ["winter", None]
+
+
+def test_arrow_stream_round_trip():
+    table = pa.ipc.open_stream(io.BytesIO(history_to_arrow(_history()))).read_all()
+    assert table.column_names == ["date", "NDVI", "month", "season"]
+    assert table.schema.field("NDVI").type == pa.float32()
+    assert table.column("month").to_pylist() == [1, 1]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import PowerTransformer
+
+from app.services import iamodel_service
+from app.services.iamodel_service import buscar_hiperparametros
+
+
+def _split(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(80, 4)).astype('float32')
+    days = 30 + 8 * X[:, 0] - 4 * X[:, 1] + rng.normal(0, 1, 80)
+    pt_y = PowerTransformer(method='yeo-johnson', standardize=True)
+    y = pt_y.fit_transform(days.reshape(-1, 1)).flatten()
+    return X[:60], y[:60], X[60:], y[60:], pt_y
+
+
+def test_trial_metrics_leave_out_the_l2_penalty():
+    iamodel_service._datos_trial = _split()
+    config = {"lr": 1e-3, "units": (8,), "dropout": 0.1, "l2": 1e-2, "batch_size": 16}
+    trial = iamodel_service._entrenar_trial(config, epochs=3, seed=0)
+    assert "val_loss" not in trial
+    assert trial["val_mse"] >= 0 and trial["mae_days"] >= 0
+
+
+@pytest.mark.parametrize("modo", ["random", "halving"])
+def test_search_ranks_trials_by_validation_error_in_days(modo):
+    result = buscar_hiperparametros(*_split(), modo=modo, n_trials=3, epochs=6, min_epochs=2, eta=3, n_jobs=1)
+    last_round = [t for t in result["trials"] if t["epochs"] == result["trials"][-1]["epochs"]]
+    assert [t["mae_days"] for t in last_round] == sorted(t["mae_days"] for t in last_round)
+    assert result["best_metrics"]["mae_days"] == last_round[0]["mae_days"]
+    assert set(result["best_metrics"]) == {"mae_days", "val_mse", "epochs_run"}
+    if modo == "halving":
+        assert last_round[0]["resumed_from_epoch"] == 2
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.services import llm_service as llm_module
+from app.services.llm_service import LLMService, TTLCache, bucket_days, bucket_inputs, fill_placeholders
+
+
+def test_day_buckets_get_coarser_with_the_horizon():
+    assert [bucket_days(d) for d in (3.4, 13.6, 22, 58, 100, 170, 200)] == [3, 14, 20, 60, 105, 165, 210]
+
+
+def test_close_predictions_share_the_same_bins():
+    a = bucket_inputs(42.3, "76%", 0.612, 18.9, 11.0, 2.3)
+    b = bucket_inputs(41.0, "77%", 0.598, 18.5, 12.4, 2.4)
+    assert a == b == {"days_until_bloom": 40, "confidence": "75%", "ndvi": 0.6, "temperature": 18.0,
+                      "precipitation": 10.0, "area": 2.5}
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llm_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_entries=2, ttl_seconds=10)
+    cache.put(("a",), {"v": 1})
+    cache.put(("b",), {"v": 2})
+    assert cache.get(("a",)) == {"v": 1}
+    cache.put(("c",), {"v": 3})
+    assert cache.get(("b",)) is None  # least recently used
+    now[0] += 11
+    assert cache.get(("a",)) is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+
+def test_placeholders_are_filled_without_touching_the_cached_answer():
+    cached = {"key_indicators": ["Faltan {dias} días con {confianza} de confianza"], "risk_factors": [],
+              "score": 1}
+    filled = fill_placeholders(cached, {"dias": "43", "confianza": "77%"})
+    assert filled == {"key_indicators": ["Faltan 43 días con 77% de confianza"], "risk_factors": [], "score": 1}
+    assert cached["key_indicators"] == ["Faltan {dias} días con {confianza} de confianza"]
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_requests_share_one_completion(monkeypatch):
+    service = LLMService()
+    service.api_key = "test"
+    calls = []
+
+    async def fake_complete(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(0.05)
+        return {"text": prompt}
+
+    monkeypatch.setattr(service, "_complete", fake_complete)
+    results = await asyncio.gather(*(service.complete_json(("k",), "p") for _ in range(5)))
+    assert results == [{"text": "p"}] * 5 and len(calls) == 1
+    assert await service.complete_json(("k",), "p") == {"text": "p"}
+    assert len(calls) == 1
+
+    service.api_key = None
+    assert await service.complete_json(("other",), "p") is None
@@ -0,0 +1,46 @@
+import os
+
+from app.services.model_registry import ModelRegistry
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def test_legacy_models_are_imported_once(tmp_path):
+    models_dir = tmp_path / "models"
+    manifest = str(tmp_path / "manifest.sqlite")
+    _touch(str(models_dir / "modelo_florecimiento5.keras"))
+    _touch(str(models_dir / "sub" / "modelo_florecimiento12.keras"))
+
+    registry = ModelRegistry(manifest, str(models_dir))
+    assert sorted(e["parcel_id"] for e in registry.list()) == [5, 12]
+    assert registry.get(5)["version"] == 1
+
+    # A later file is not picked up by a new worker: the import already ran for this manifest
+    _touch(str(models_dir / "modelo_florecimiento7.keras"))
+    assert ModelRegistry(manifest, str(models_dir)).get(7) is None
+
+
+def test_register_before_any_read_still_imports_legacy_models(tmp_path):
+    models_dir = tmp_path / "models"
+    _touch(str(models_dir / "modelo_florecimiento123.keras"))
+    registry = ModelRegistry(str(tmp_path / "manifest.sqlite"), str(models_dir))
+
+    registry.register(5, {"model": "m5.keras"})
+    assert registry.get(123) is not None
+    assert registry.get(5)["model_path"] == "m5.keras"
+
+
+def test_versions_increase_and_latest_wins(tmp_path):
+    registry = ModelRegistry(str(tmp_path / "manifest.sqlite"), str(tmp_path / "none"))
+    registry.register(1, {"model": "a.keras"}, metrics={"mae": 3.0})
+    assert registry.next_version(1) == 2
+    entry = registry.register(1, {"model": "b.keras"})
+    assert entry["version"] == 2
+    assert registry.get(1)["model_path"] == "b.keras"
+    # Another instance on the same manifest sees the same state
+    other = ModelRegistry(registry.manifest_path, registry.models_dir)
+    assert other.get(1)["version"] == 2
+    assert other.get(2) is None
@@ -0,0 +1,78 @@
+import threading
+
+import joblib
+import numpy as np
+import pytest
+
+from app.services import iamodel_service
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import COLS_X, MAX_MODELOS_CARGADOS, predict_flowering_batch
+from app.services.packed_model_store import PackedModelStore, pack_models
+
+
+def _rows(parcel_id, n=5):
+    return feature_store.read(columns=COLS_X, parcel_ids=[parcel_id]).head(n).to_dict('records')
+
+
+def test_packed_models_predict_like_keras(parcel_models, tmp_path):
+    path = str(tmp_path / "models.pack")
+    summary = pack_models(list(parcel_models.values()), output_path=path, precision="float32")
+    assert summary["packed"] == 2 and summary["skipped"] == []
+
+    store = PackedModelStore(path)
+    for parcel_id, entry in parcel_models.items():
+        packed = store.get(parcel_id)
+        assert packed is store.get(parcel_id)
+        assert store.version_of(parcel_id) == entry["version"]
+        rows = _rows(parcel_id)
+        np.testing.assert_allclose(packed.predict_days(rows), predict_flowering_batch(rows, entry=entry),
+                                   rtol=1e-3, atol=1e-2)
+    assert store.get(99) is None and store.version_of(99) is None
+    assert PackedModelStore(str(tmp_path / "missing.pack")).get(1) is None
+
+
+def test_repacking_while_reading_never_mixes_packs(parcel_models, tmp_path):
+    path = str(tmp_path / "models.pack")
+    entries = list(parcel_models.values())
+    pack_models(entries, output_path=path, precision="float32")
+    store = PackedModelStore(path)
+    rows = _rows(1, 2)
+    errors = []
+
+    def read():
+        try:
+            for _ in range(200):
+                model = store.get(1)
+                assert model is not None
+                assert np.all(np.isfinite(model.predict_days(rows)))
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for precision in ("float16", "float32", "int8", "float32"):
+        pack_models(entries, output_path=path, precision=precision, max_mae_increase=1e9)
+    for reader in readers:
+        reader.join()
+    assert errors == []
+
+
+def test_transformers_share_the_model_lru_and_reload_when_rewritten(tmp_path, monkeypatch):
+    monkeypatch.setattr(iamodel_service, "_transformadores_por_modelo",
+                        iamodel_service._CacheArtefactos(MAX_MODELOS_CARGADOS))
+    x_cols = tmp_path / "x_cols.json"
+    x_cols.write_text('["NDVI"]')
+    entries = []
+    for i in range(MAX_MODELOS_CARGADOS + 8):
+        path = str(tmp_path / f"pt_{i}.joblib")
+        joblib.dump(i, path)
+        entries.append({"pt_x_path": path, "robust_path": path, "pt_y_path": path, "x_cols_path": str(x_cols)})
+    for entry in entries:
+        assert iamodel_service._load_entry_transformers(entry)[0] == int(entry["pt_x_path"].split("_")[-1][:-7])
+    assert len(iamodel_service._transformadores_por_modelo) == MAX_MODELOS_CARGADOS
+
+    last = entries[-1]
+    joblib.dump("retrained", last["pt_x_path"])
+    assert iamodel_service._load_entry_transformers(last)[0] == "retrained"
+    assert iamodel_service._load_entry_transformers({"pt_x_path": None}) is None
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from app.services.parcel_registry import ParcelRegistry
+
+SQUARE = [[-0.4, 39.5], [-0.39, 39.5], [-0.39, 39.51], [-0.4, 39.51]]
+TRIANGLE = SQUARE[:3]
+
+
+def test_create_precomputes_the_geometry(db):
+    registry = ParcelRegistry()
+    parcel = registry.create(SQUARE, parcel_id=7, name="huerta")
+
+    assert parcel["id"] == 7 and parcel["name"] == "huerta"
+    assert parcel["bbox"] == [-0.4, 39.5, -0.39, 39.51]
+    assert parcel["area_hectares"] == pytest.approx(95.4, rel=0.01)
+    assert parcel["modis_cells"] and parcel["modis_tiles"] == ["h17v05"]
+    assert registry.get(7) == parcel
+    assert registry.get(8) is None
+
+
+def test_find_by_geometry_matches_the_canonical_polygon(db):
+    registry = ParcelRegistry()
+    parcel = registry.create(SQUARE)
+    redrawn = registry.describe(SQUARE[::-1] + [SQUARE[-1]])
+
+    assert redrawn["id"] is None
+    assert registry.find_by_geometry(redrawn["geometry_hash"])["id"] == parcel["id"]
+    assert registry.find_by_geometry(registry.describe(TRIANGLE)["geometry_hash"]) is None
+
+
+def test_update_replaces_the_geometry_and_its_hash(db):
+    registry = ParcelRegistry()
+    parcel = registry.create(SQUARE)
+    updated = registry.update(parcel["id"], coordinates=TRIANGLE, model_version=3)
+
+    assert updated["area_hectares"] == pytest.approx(parcel["area_hectares"] / 2, rel=0.01)
+    assert updated["model_version"] == 3
+    assert registry.find_by_geometry(parcel["geometry_hash"]) is None
+    assert registry.update(999, name="x") is None
+
+
+def test_cached_parcels_expire(db):
+    reader = ParcelRegistry(ttl_seconds=0.2)
+    parcel = reader.create(SQUARE)
+    # Another worker changes the row behind this cache
+    ParcelRegistry().update(parcel["id"], coordinates=TRIANGLE)
+    assert reader.get(parcel["id"])["geometry_hash"] == parcel["geometry_hash"]
+
+    time.sleep(0.3)
+    assert reader.get(parcel["id"])["geometry_hash"] != parcel["geometry_hash"]
+
+
+def test_unavailable_database_reads_as_unknown_parcel():
+    class BrokenSession:
+        def get(self, *args):
+            raise RuntimeError("database down")
+
+        def close(self):
+            pass
+
+    assert ParcelRegistry(session_factory=BrokenSession).get(1) is None
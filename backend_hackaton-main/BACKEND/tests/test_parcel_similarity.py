@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from app.services import parcel_similarity
+from app.services.feature_engineering import season_for_month
+from app.services.feature_store import feature_store
+from app.services.model_registry import ModelRegistry
+from app.services.parcel_similarity import ParcelSimilarityIndex, blended_distribution, predict_blended
+
+
+class _Counting:
+    """Wraps an object and counts calls to one of its methods"""
+
+    def __init__(self, wrapped, method):
+        self.wrapped, self.method, self.calls = wrapped, method, 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.wrapped, name)
+        if name != self.method:
+            return attr
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    """Neighbour models 1 and 2 that always predict 30 and 40 days with no MC spread"""
+    entries = {1: {"parcel_id": 1, "version": 1}, 2: {"parcel_id": 2, "version": 1}}
+    days = {1: 30.0, 2: 40.0}
+    monkeypatch.setattr(parcel_similarity.model_registry, "get", entries.get)
+    monkeypatch.setattr(parcel_similarity, "_predict_with",
+                        lambda pid, entry, rows: np.full(len(rows), days[pid]))
+    monkeypatch.setattr(parcel_similarity, "_distribution_with",
+                        lambda pid, entry, row, samples: {"mean_days": days[pid], "std_days": 0.0})
+    return entries
+
+
+def test_blended_interval_keeps_a_distance_based_width(fake_models):
+    close = [{"parcel_id": 1, "distance": 0.0, "weight": 1.0}]
+    far = [{"parcel_id": 1, "distance": 3.0, "weight": 1.0}]
+    near_summary = blended_distribution({}, close, samples=50)
+    far_summary = blended_distribution({}, far, samples=50)
+    assert near_summary["mean_days"] == 30.0
+    assert near_summary["interval"][0] < 30.0 < near_summary["interval"][1]
+    assert near_summary["confidence"] < 1.0
+    assert far_summary["confidence"] < near_summary["confidence"]
+
+    both = blended_distribution({}, [{"parcel_id": 1, "distance": 0.0, "weight": 0.5},
+                                     {"parcel_id": 2, "distance": 0.0, "weight": 0.5}], samples=50)
+    assert both["mean_days"] == pytest.approx(35.0)
+    assert both["interval"][1] - both["interval"][0] > near_summary["interval"][1] - near_summary["interval"][0]
+
+
+def test_removed_neighbours_are_skipped_and_weights_renormalised(fake_models):
+    neighbors = [{"parcel_id": 1, "distance": 0.1, "weight": 0.2},
+                 {"parcel_id": 2, "distance": 0.2, "weight": 0.3},
+                 {"parcel_id": 9, "distance": 0.3, "weight": 0.5}]
+    np.testing.assert_allclose(predict_blended([{}, {}], neighbors), [0.4 * 30 + 0.6 * 40] * 2)
+    assert blended_distribution({}, neighbors)["mean_days"] == pytest.approx(0.4 * 30 + 0.6 * 40)
+    with pytest.raises(ValueError, match="similar parcels"):
+        predict_blended([{}], [{"parcel_id": 9, "distance": 0.0, "weight": 1.0}])
+
+
+def test_index_lists_the_manifest_and_reads_signatures_only_after_changes(tiny_store, tmp_path):
+    registry = _Counting(ModelRegistry(str(tmp_path / "manifest.sqlite"), str(tmp_path / "none")), "list")
+    store = _Counting(feature_store, "read")
+    for parcel_id in (1, 2, 3):
+        registry.register(parcel_id, {"model": f"m{parcel_id}.keras", "pt_x": "pt_x.pkl"})
+    index = ParcelSimilarityIndex(store=store, registry=registry)
+    reading = {"month": 4}
+
+    first = index.neighbors(reading, parcel_id=4, k=2)
+    assert len(first) == 2 and 4 not in [n["parcel_id"] for n in first]
+    assert sum(n["weight"] for n in first) == pytest.approx(1.0)
+    calls = (registry.calls, store.calls)
+    assert index.neighbors(reading, parcel_id=4, k=2) == first
+    assert (registry.calls, store.calls) == calls
+
+    # New rows for the served parcel refresh its signature only
+    feature_store.append(4, [{"date": "2024-04-01", "NDVI": 0.9}])
+    index.neighbors(reading, parcel_id=4, k=2)
+    assert (registry.calls, store.calls) == (calls[0], calls[1] + 1)
+
+    # A new model in the manifest rebuilds the trees with it
+    registry.register(4, {"model": "m4.keras", "pt_x": "pt_x.pkl"})
+    assert 4 in [n["parcel_id"] for n in index.neighbors(reading, parcel_id=1, k=3)]
+    assert registry.calls == calls[0] + 1
+
+
+def test_unknown_parcel_is_matched_by_its_current_reading(tiny_store, tmp_path):
+    registry = ModelRegistry(str(tmp_path / "manifest.sqlite"), str(tmp_path / "none"))
+    for parcel_id in (1, 4):
+        registry.register(parcel_id, {"model": f"m{parcel_id}.keras", "pt_x": "pt_x.pkl"})
+    index = ParcelSimilarityIndex(registry=registry)
+    history = feature_store.read(parcel_ids=[4])
+    spring = history[history["month"].map(season_for_month) == season_for_month(4)]
+    reading = {**spring.mean(numeric_only=True).to_dict(), "month": 4}
+    assert index.neighbors(reading, parcel_id=None, k=1)[0]["parcel_id"] == 4
+
+
+def test_blend_of_trained_models_reports_their_mc_spread(parcel_models):
+    from app.services.iamodel_service import COLS_X
+    row = feature_store.read(columns=COLS_X, parcel_ids=[3]).iloc[10].to_dict()
+    neighbors = [{"parcel_id": 1, "distance": 0.5, "weight": 0.5}, {"parcel_id": 2, "distance": 0.5, "weight": 0.5}]
+    summary = blended_distribution(row, neighbors, samples=40)
+    assert summary["interval"][0] < summary["mean_days"] < summary["interval"][1]
+    assert predict_blended([row], neighbors).shape == (1,)
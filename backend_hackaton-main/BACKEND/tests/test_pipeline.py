@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.pipeline import ERROR, OK, SKIPPED, TIMEOUT, Pipeline
+
+
+async def _value(value, delay: float = 0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+@pytest.mark.asyncio
+async def test_independent_stages_overlap_and_dependents_get_results():
+    pipeline = Pipeline(5)
+    pipeline.add("a", lambda: _value(1, 0.2))
+    pipeline.add("b", lambda: _value(2, 0.2))
+    pipeline.add("sum", lambda a, b: _value(a + b), after=("a", "b"))
+    start = time.monotonic()
+    await pipeline.run()
+
+    assert time.monotonic() - start < 0.35
+    assert pipeline.result("sum") == 3
+    assert not pipeline.partial
+    assert pipeline.summary()["stages"]["sum"]["status"] == OK
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_late_stages_and_skips_their_dependents():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    pipeline = Pipeline(0.2)
+    pipeline.add("fast", lambda: _value("ok"))
+    pipeline.add("slow", slow)
+    pipeline.add("after_slow", lambda s: _value(s), after=("slow",))
+    start = time.monotonic()
+    await pipeline.run()
+
+    assert time.monotonic() - start < 1
+    assert cancelled.is_set()
+    assert pipeline.status("fast") == OK
+    assert pipeline.status("slow") == TIMEOUT
+    assert pipeline.status("after_slow") == SKIPPED
+    assert pipeline.result("slow") is None
+    assert pipeline.partial
+
+
+@pytest.mark.asyncio
+async def test_stage_timeout_is_capped_below_the_deadline():
+    pipeline = Pipeline(5)
+    pipeline.add("capped", lambda: _value("late", 1), timeout=0.1)
+    start = time.monotonic()
+    await pipeline.run()
+
+    assert time.monotonic() - start < 0.5
+    assert pipeline.status("capped") == TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_errors_skip_dependents_and_are_reraised():
+    async def broken():
+        raise ValueError("bad input")
+
+    pipeline = Pipeline(5)
+    pipeline.add("broken", broken)
+    pipeline.add("child", lambda v: _value(v), after=("broken",))
+    await pipeline.run()
+
+    assert pipeline.status("broken") == ERROR
+    assert pipeline.status("child") == SKIPPED
+    with pytest.raises(ValueError, match="bad input"):
+        pipeline.raise_errors()
+    with pytest.raises(ValueError):
+        pipeline.result("broken")
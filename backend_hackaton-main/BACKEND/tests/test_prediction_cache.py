@@ -0,0 +1,54 @@
+import os
+
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import (
+    COLS_X, PredictionCache, predict_flowering_days, prediction_cache, version_servida,
+)
+
+ROW = {col: 1.0 for col in COLS_X}
+
+
+def test_key_covers_version_samples_and_rounded_features():
+    cache = PredictionCache(max_entries=10, decimals=4)
+    cache.put("mc:a", "v1", ROW, "x", samples=50)
+    assert cache.get("mc:a", "v1", {**ROW, "NDVI": 1.00001}, samples=50) == "x"
+    assert cache.get("mc:a", "v1", ROW, samples=20) is None
+    assert cache.get("mc:a", "v1", {**ROW, "NDVI": 1.1}, samples=50) is None
+    assert cache.get("mc:b", "v1", ROW, samples=50) is None
+    # A new model version evicts the namespace's older entries
+    assert cache.get("mc:a", "v2", ROW, samples=50) is None
+    assert cache.get("mc:a", "v1", ROW, samples=50) is None
+
+
+def test_cache_is_bounded():
+    cache = PredictionCache(max_entries=3)
+    for i in range(5):
+        cache.put("days:a", "v1", {**ROW, "NDVI": float(i)}, i)
+    assert cache.get("days:a", "v1", {**ROW, "NDVI": 0.0}) is None
+    assert cache.get("days:a", "v1", {**ROW, "NDVI": 4.0}) == 4
+
+
+def test_served_version_combines_manifest_and_file(tmp_path):
+    path = tmp_path / "model.keras"
+    path.write_bytes(b"a")
+    assert version_servida(str(path), {"version": 3}).startswith("v3-")
+    assert version_servida(str(path), {"version": 3}) != version_servida(str(path), {"version": 4})
+    assert version_servida(str(path)) == version_servida(str(path), {"version": None})
+
+
+def test_predictions_are_recomputed_when_the_model_changes(parcel_models):
+    prediction_cache.clear()
+    entry = parcel_models[1]
+    row = feature_store.read(columns=COLS_X, parcel_ids=[1]).iloc[3].to_dict()
+    first = predict_flowering_days(row, entry=entry)
+    misses = prediction_cache.misses
+    assert predict_flowering_days(row, entry=entry) == first
+    assert prediction_cache.misses == misses
+
+    # Same file registered under another version, then the file rewritten in place
+    predict_flowering_days(row, entry={**entry, "version": entry["version"] + 1})
+    assert prediction_cache.misses == misses + 1
+    stat = os.stat(entry["model_path"])
+    os.utime(entry["model_path"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    predict_flowering_days(row, entry=entry)
+    assert prediction_cache.misses == misses + 2
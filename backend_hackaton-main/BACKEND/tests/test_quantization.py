@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import PowerTransformer
+
+from app.services.packed_model_store import (
+    PackedModelStore, check_quantized_drift, mlp_forward, pack_models, quantize_layers,
+)
+
+
+def _layers(seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = [6, 16, 8, 1]
+    return [{"kernel": rng.normal(0, 0.5, (a, b)).astype(np.float32), "bias": rng.normal(0, 0.1, b).astype(np.float32),
+             "activation": "relu" if b != 1 else "linear", "dropout": 0.0}
+            for a, b in zip(sizes, sizes[1:])]
+
+
+def _pt_y():
+    pt = PowerTransformer(method='yeo-johnson', standardize=True)
+    pt.fit(np.random.default_rng(1).uniform(10, 120, (200, 1)))
+    return pt
+
+
+@pytest.mark.parametrize("precision, dtype, tolerance", [("float16", np.float16, 1e-2), ("int8", np.int8, 5e-2)])
+def test_quantized_layers_stay_close_to_float32(precision, dtype, tolerance):
+    layers = _layers()
+    X = np.random.default_rng(2).normal(size=(100, 6)).astype(np.float32)
+    quantized = quantize_layers(layers, precision)
+    assert all(layer["kernel"].dtype == dtype for layer in quantized)
+    reference = mlp_forward(layers, X)
+    assert np.max(np.abs(mlp_forward(quantized, X) - reference)) <= tolerance * np.max(np.abs(reference))
+    with pytest.raises(ValueError):
+        quantize_layers(layers, "int4")
+
+
+def test_drift_check_compares_the_mean_difference_in_days():
+    layers = _layers()
+    X = np.random.default_rng(3).normal(size=(200, 6)).astype(np.float32)
+    check = check_quantized_drift(layers, X, _pt_y(), "int8", max_mae_increase=0.5)
+    assert check["rows"] == 200
+    assert 0 < check["mean_abs_diff_days"] <= check["max_abs_diff_days"]
+    assert check["accepted"] == (check["mean_abs_diff_days"] <= 0.5)
+    assert not check_quantized_drift(layers, X, _pt_y(), "int8", max_mae_increase=0.0)["accepted"]
+
+
+def test_pack_quantizes_only_parcels_that_pass_the_drift_check(parcel_models, tmp_path):
+    entries = list(parcel_models.values())
+    loose = str(tmp_path / "loose.pack")
+    summary = pack_models(entries, output_path=loose, precision="int8", max_mae_increase=1e9)
+    assert summary["float32_fallback"] == []
+    assert PackedModelStore(loose).get(1).layers[0]["kernel"].dtype == np.int8
+
+    strict = str(tmp_path / "strict.pack")
+    summary = pack_models(entries, output_path=strict, precision="int8", max_mae_increase=0.0)
+    assert sorted(summary["float32_fallback"]) == [1, 2]
+    assert PackedModelStore(strict).get(1).layers[0]["kernel"].dtype == np.float32
+
+
+def test_a_recorded_training_check_is_used_instead_of_the_drift_check(parcel_models, tmp_path):
+    entry = {**parcel_models[1], "metrics": {"quantization": {"precision": "int8", "accepted": False}}}
+    summary = pack_models([entry], output_path=str(tmp_path / "recorded.pack"), precision="int8",
+                          max_mae_increase=1e9)
+    assert summary["float32_fallback"] == [1]
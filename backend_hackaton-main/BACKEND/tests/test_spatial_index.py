@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from app.database.database import SessionLocal
+from app.database.models import Parcel
+from app.services.parcel_registry import ParcelRegistry
+from app.services.spatial_index import REBUILD_MIN_CHANGES, SpatialIndex, STRTree, parcel_index
+
+
+def _brute_force(boxes, bbox):
+    return np.flatnonzero((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0])
+                          & (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1]))
+
+
+@pytest.mark.parametrize("n, capacity", [(0, 16), (10, 16), (5000, 16), (3000, 4)])
+def test_str_tree_query_matches_brute_force(n, capacity):
+    rng = np.random.default_rng(n)
+    xy = rng.uniform(-10, 10, (n, 2))
+    boxes = np.hstack([xy, xy + rng.uniform(0, 0.5, (n, 2))])
+    tree = STRTree(np.arange(n) + 100, boxes, capacity)
+    for _ in range(200):
+        q = rng.uniform(-11, 11, 2)
+        bbox = (q[0], q[1], q[0] + rng.uniform(0, 3), q[1] + rng.uniform(0, 3))
+        assert sorted(tree.query(bbox)) == sorted(_brute_force(boxes, bbox) + 100)
+
+
+def test_spatial_index_delta_and_rebuild_stay_consistent():
+    rng = np.random.default_rng(3)
+    boxes = {}
+    for i in range(500):
+        x, y = rng.uniform(0, 10, 2)
+        boxes[i] = (x, y, x + 0.2, y + 0.2)
+    index = SpatialIndex("test", lambda: [(i, box, None) for i, box in boxes.items()])
+    assert len(index) == 500
+
+    # Enough moves and removals to go through the delta and at least one rebuild
+    for step in range(REBUILD_MIN_CHANGES * 2):
+        i = int(rng.integers(0, 600))
+        if step % 5 == 0:
+            index.remove(i)
+            boxes.pop(i, None)
+        else:
+            x, y = rng.uniform(0, 10, 2)
+            boxes[i] = (x, y, x + 0.2, y + 0.2)
+            index.upsert(i, boxes[i])
+        if step % 50 == 0:
+            q = rng.uniform(0, 10, 2)
+            bbox = (q[0], q[1], q[0] + 1, q[1] + 1)
+            ids = np.array(list(boxes))
+            expected = ids[_brute_force(np.array([boxes[i] for i in ids]), bbox)]
+            assert index.candidates(bbox) == sorted(expected.tolist())
+
+
+def _square(x, y, d=0.01):
+    return [[x, y], [x + d, y], [x + d, y + d], [x, y + d]]
+
+
+def test_parcel_index_follows_commits_not_rollbacks(db):
+    registry = ParcelRegistry()
+    first = registry.create(_square(-3.7, 40.4))
+    second = registry.create(_square(-3.6, 40.4))
+    assert parcel_index.containing(-3.695, 40.405) == [first["id"]]
+    assert registry.search(bbox=[-3.75, 40.39, -3.55, 40.42]) == [first, second]
+
+    registry.update(second["id"], coordinates=_square(-3.5, 40.4))
+    assert parcel_index.containing(-3.595, 40.405) == []
+    assert parcel_index.containing(-3.495, 40.405) == [second["id"]]
+
+    session = SessionLocal()
+    try:
+        session.add(Parcel(id=99, coordinates=_square(0, 0), area_hectares=1, centroid_lon=0, centroid_lat=0,
+                           min_lon=0, min_lat=0, max_lon=0.01, max_lat=0.01))
+        session.flush()
+        session.rollback()
+    finally:
+        session.close()
+    assert parcel_index.containing(0.005, 0.005) == []
+
+
+def test_parcel_index_refines_boxes_with_the_polygon(db):
+    triangle = ParcelRegistry().create([[0, 0], [0.01, 0], [0, 0.01]])
+    assert parcel_index.containing(0.002, 0.002) == [triangle["id"]]
+    # Inside the bounding box, outside the triangle
+    assert parcel_index.containing(0.009, 0.009) == []
+    assert parcel_index.intersecting([0.008, 0.008, 0.02, 0.02]) == []
+
+
+def test_load_reads_the_rows_once_ahead_of_the_first_query():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return [(1, (0, 0, 1, 1), None), (2, (5, 5, 6, 6), None)]
+
+    index = SpatialIndex("test", loader)
+    index.load()
+    assert loads == [1]
+    assert index.candidates((0.5, 0.5, 0.6, 0.6)) == [1]
+    index.load()
+    assert loads == [1] and len(index) == 2
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+import tensorflow as tf
+from sklearn.preprocessing import PowerTransformer, RobustScaler
+
+from app.services.iamodel_service import _transformar_X, entrenar_modelo_floracion, modelo_base_disponible
+from app.services.streaming_training import _es_validacion, _transformacion_tf, entrenar_modelo_streaming
+
+
+def test_tf_transform_matches_the_sklearn_transformers():
+    rng = np.random.default_rng(0)
+    cols = ["NDVI", "LST_day", "precip_30d", "day_sin"]
+    df = pd.DataFrame({"NDVI": rng.uniform(-0.2, 0.9, 300), "LST_day": rng.normal(295, 8, 300),
+                       "precip_30d": rng.exponential(20, 300), "day_sin": rng.uniform(-1, 1, 300)})
+    df.loc[5, "NDVI"] = np.nan
+    y = rng.uniform(5, 200, 300)
+    pt_x = PowerTransformer(method='yeo-johnson', standardize=True).fit(df[cols[:3]])
+    robust = RobustScaler().fit(df[["day_sin"]])
+    pt_y = PowerTransformer(method='yeo-johnson', standardize=True).fit(y.reshape(-1, 1))
+
+    Xt, yt = _transformacion_tf(cols, pt_x, robust, pt_y)(tf.constant(df.to_numpy(np.float32)),
+                                                          tf.constant(y.astype(np.float32)))
+    np.testing.assert_allclose(Xt.numpy(), _transformar_X(df, cols, pt_x, robust), rtol=1e-3, atol=1e-3)
+    np.testing.assert_allclose(yt.numpy(), pt_y.transform(y.reshape(-1, 1)).flatten(), rtol=1e-3, atol=1e-3)
+
+
+def test_validation_split_is_stable_per_row():
+    df = pd.DataFrame({"parcel_id": np.repeat([1, 2, 3], 100),
+                       "date": np.tile(pd.date_range("2023-01-01", periods=100), 3)})
+    split = _es_validacion(df, 0.2)
+    assert 0.1 < split.mean() < 0.3
+    # The same row falls on the same side whatever chunk it arrives in
+    np.testing.assert_array_equal(_es_validacion(df.iloc[::-1].reset_index(drop=True), 0.2), split[::-1])
+
+
+def test_streaming_model_can_be_used_as_a_fine_tuning_base(tiny_store, tmp_path):
+    base_dir = str(tmp_path / "base")
+    result = entrenar_modelo_streaming(path_fechas=tiny_store, parcels_per_chunk=1, fit_sample_rows=50,
+                                       epochs=2, batch_size=32, output_dir=base_dir)
+    metrics = result["metrics"]
+    assert metrics["fit_sample_rows"] == 50
+    assert metrics["val_rows"] > 0 and metrics["train_rows"] > metrics["val_rows"]
+    assert np.isfinite(metrics["mae_days"]) and metrics["epochs_run"] == 2
+    assert modelo_base_disponible(base_dir)
+
+    tuned = entrenar_modelo_floracion(demo_mode=False, path_fechas=tiny_store, use_feature_store=True,
+                                      parcel_ids=[3], fine_tune=True, base_dir=base_dir, fine_tune_epochs=1,
+                                      output_dir=str(tmp_path / "parcel_3"))
+    assert tuned["metrics"]["epochs_run"] == 1
+
+
+def test_streaming_without_labels_fails_clearly(tiny_store, tmp_path):
+    with pytest.raises(ValueError, match="fecha de floración"):
+        entrenar_modelo_streaming(path_fechas=tiny_store, parcel_ids=[99], epochs=1,
+                                  output_dir=str(tmp_path / "none"))
+    with pytest.raises(FileNotFoundError):
+        entrenar_modelo_streaming(path_fechas=str(tmp_path / "missing.csv"), output_dir=str(tmp_path / "none"))
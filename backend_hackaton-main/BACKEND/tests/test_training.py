@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from tensorflow import keras
+
+from app.services.iamodel_service import entrenar_modelo_base, entrenar_modelo_floracion, modelo_base_disponible
+
+
+def _dense_kernels(path):
+    model = keras.models.load_model(path)
+    return [layer.get_weights()[0] for layer in model.layers if isinstance(layer, keras.layers.Dense)]
+
+
+def test_fine_tune_without_a_base_model_fails_before_loading_data(tmp_path):
+    assert not modelo_base_disponible(str(tmp_path))
+    with pytest.raises(FileNotFoundError, match="modelo base"):
+        entrenar_modelo_floracion(demo_mode=False, use_feature_store=True, fine_tune=True, base_dir=str(tmp_path))
+
+
+def test_fine_tune_warm_starts_from_the_base_model(tiny_store, tmp_path):
+    base_dir = str(tmp_path / "base")
+    base = entrenar_modelo_base(path_fechas=tiny_store, output_dir=base_dir, epochs=2, batch_size=64)
+    assert modelo_base_disponible(base_dir)
+
+    tuned = entrenar_modelo_floracion(demo_mode=False, path_fechas=tiny_store, use_feature_store=True,
+                                      parcel_ids=[2], fine_tune=True, base_dir=base_dir, fine_tune_epochs=2,
+                                      freeze_layers=1, output_dir=str(tmp_path / "parcel_2"))
+    assert tuned["config"]["fine_tune"] and tuned["metrics"]["epochs_run"] == 2
+
+    base_kernels = _dense_kernels(base["paths"]["model"])
+    tuned_kernels = _dense_kernels(tuned["paths"]["model"])
+    # The frozen first layer keeps the base weights, the rest is adjusted
+    np.testing.assert_array_equal(tuned_kernels[0], base_kernels[0])
+    assert not np.array_equal(tuned_kernels[-1], base_kernels[-1])
+    with open(tuned["paths"]["x_cols"]) as tuned_cols, open(base["paths"]["x_cols"]) as base_cols:
+        assert tuned_cols.read() == base_cols.read()
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import (
+    COLS_X, construir_trayectoria, curva_trayectoria, predict_flowering_batch, predict_flowering_days,
+)
+
+ROW = {**{col: 1.0 for col in COLS_X}, "NDVI": 0.5, "NDVI_change": 0.16, "NDVI_EVI_ratio": 2.0}
+
+
+def test_calendar_advances_and_climate_modes():
+    hold = construir_trayectoria(ROW, 40, inicio=datetime(2023, 12, 20))
+    assert len(hold) == 40 and hold["date"].is_monotonic_increasing
+    assert hold["year"].tolist()[:12] == [2023] * 12 and hold["year"].iloc[12] == 2024
+    assert hold["day_of_year"].iloc[12] == 1
+    assert (hold["NDVI"] == 0.5).all()
+
+    trend = construir_trayectoria(ROW, 40, inicio=datetime(2023, 12, 20), clima="trend")
+    assert trend["NDVI"].iloc[0] == 0.5 and trend["NDVI"].is_monotonic_increasing
+    np.testing.assert_allclose(trend["EVI"], trend["NDVI"] / 2.0)
+    with pytest.raises(ValueError):
+        construir_trayectoria(ROW, 5, clima="storm")
+
+
+def test_batched_curve_matches_day_by_day_predictions(parcel_models):
+    entry = parcel_models[1]
+    row = feature_store.read(columns=COLS_X, parcel_ids=[1]).iloc[20].to_dict()
+    trayectoria = construir_trayectoria(row, 10, inicio=datetime(2024, 3, 1))
+    rows = trayectoria.drop(columns=["date"]).to_dict("records")
+    curve = curva_trayectoria(trayectoria, predict_flowering_batch(rows, entry=entry))
+
+    assert [point["date"] for point in curve][:2] == ["2024-03-01", "2024-03-02"]
+    for point, features in zip(curve, rows):
+        assert point["days_until_bloom"] == pytest.approx(predict_flowering_days(features, entry=entry), abs=0.1)
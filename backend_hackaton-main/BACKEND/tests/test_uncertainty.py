@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from app.services.feature_store import feature_store
+from app.services.iamodel_service import (
+    COLS_X, predict_flowering_batch, predict_flowering_distribution, prediction_cache, resumir_incertidumbre,
+)
+from app.services.packed_model_store import PackedModelStore, pack_models
+
+
+def test_summary_interval_and_confidence():
+    summary = resumir_incertidumbre(np.arange(100, 201), nivel=0.9)
+    assert summary["mean_days"] == 150
+    assert summary["interval"] == pytest.approx([105, 195])
+    assert summary["confidence"] == pytest.approx(1 - 45 / 150)
+    assert summary["samples"] == 101
+    # Short horizons divide by at least 7 days
+    assert resumir_incertidumbre(np.array([1.0, 3.0]), nivel=1.0)["confidence"] == pytest.approx(1 - 1 / 7)
+    assert resumir_incertidumbre(np.full(10, 40.0))["confidence"] == 1.0
+
+
+def test_mc_dropout_spreads_the_samples_around_the_prediction(parcel_models):
+    prediction_cache.clear()
+    entry = parcel_models[1]
+    row = feature_store.read(columns=COLS_X, parcel_ids=[1]).iloc[10].to_dict()
+    summary = predict_flowering_distribution(row, entry=entry, samples=200)
+    assert summary["samples"] == 200
+    low, high = summary["interval"]
+    assert low < high
+    assert low <= float(predict_flowering_batch([row], entry=entry)[0]) <= high
+
+
+def test_packed_mc_dropout_is_reproducible_with_a_seed(parcel_models, tmp_path):
+    path = str(tmp_path / "models.pack")
+    pack_models(list(parcel_models.values()), output_path=path, precision="float32")
+    model = PackedModelStore(path).get(2)
+    row = feature_store.read(columns=COLS_X, parcel_ids=[2]).iloc[5].to_dict()
+    first = model.predict_distribution(row, samples=100, seed=7)
+    assert first == model.predict_distribution(row, samples=100, seed=7)
+    assert first["interval"][0] < first["interval"][1]